@@ -15,12 +15,13 @@ def print_dict(dictionary, indentation=0):
             print("\t" * indentation + f"{key}: {value}")
 
 class myCleancloudClient:
-    GIFT_CARD_SOURCE_ACCOUNTS = []
     headers = {"Content-Type": "application/json"}
 
     def __init__(self, API_TOKEN, print_gift_card_source_accounts=True):
         self.API_TOKEN = API_TOKEN
         self.API_URL = "https://cleancloudapp.com/api/"
+        # per instance: a class-level list was appended to by every new client
+        self.GIFT_CARD_SOURCE_ACCOUNTS = []
 
         current_dir = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
 
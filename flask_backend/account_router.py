@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque
+
+# Health tracking for the gift card source accounts. Every purchase attempt is
+# recorded here; accounts that keep failing (e.g. a declined saved card) are put
+# on a cooldown and tried last, so most redemptions succeed on the first call.
+
+
+class AccountHealth:
+
+    def __init__(self, account, recent_failures=10):
+        self.account = account
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self.last_success_at = None
+        self.last_failure_at = None
+        self.recent_failures = deque(maxlen=recent_failures)  # (timestamp, reason)
+        self.open_until = 0.0  # circuit breaker: skipped until this time
+
+    @property
+    def attempts(self):
+        return self.successes + self.failures
+
+    @property
+    def success_rate(self):
+        # Laplace smoothing so a new account starts at 0.5 instead of 0 or 1
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def is_open(self, now):
+        return now < self.open_until
+
+    def to_dict(self, now):
+        return {
+            "account": self.account,
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "success_rate": round(self.success_rate, 4),
+            "latency_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "last_success_at": self.last_success_at,
+            "last_failure_at": self.last_failure_at,
+            "recent_failures": [{"at": at, "reason": reason} for at, reason in self.recent_failures],
+            "cooldown_remaining": max(0.0, round(self.open_until - now, 1)),
+        }
+
+
+class AccountRouter:
+
+    def __init__(self, accounts, failure_threshold=3, cooldown_seconds=300, latency_alpha=0.2):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+        self._health = {}
+        self.set_accounts(accounts)
+
+    def set_accounts(self, accounts):
+        """Replace the account list, keeping the history of accounts that remain"""
+        with self._lock:
+            self._order = list(dict.fromkeys(accounts))
+            self._health = {
+                account: self._health.get(account) or AccountHealth(account)
+                for account in self._order
+            }
+
+    def ordered_accounts(self, offset=0):
+        """Accounts in the order purchases should try them
+
+        Closed (healthy) accounts come first, best success rate then lowest latency,
+        with file order breaking ties. Accounts on cooldown are kept as a last resort,
+        soonest-to-recover first. offset rotates the healthy accounts, so the cards
+        of a split purchase start on different accounts.
+        """
+        now = time.time()
+        with self._lock:
+            position = {account: i for i, account in enumerate(self._order)}
+            health = list(self._health.values())
+
+        def score(h):
+            latency = h.latency_ewma if h.latency_ewma is not None else 0.0
+            return (-round(h.success_rate, 2), latency, position[h.account])
+
+        closed = sorted((h for h in health if not h.is_open(now)), key=score)
+        if closed and offset:
+            offset %= len(closed)
+            closed = closed[offset:] + closed[:offset]
+        cooling = sorted((h for h in health if h.is_open(now)), key=lambda h: h.open_until)
+        return [h.account for h in closed + cooling]
+
+    def record_success(self, account, latency):
+        with self._lock:
+            h = self._health.get(account)
+            if h is None:
+                return
+            h.successes += 1
+            h.consecutive_failures = 0
+            h.open_until = 0.0
+            h.last_success_at = time.time()
+            self._update_latency(h, latency)
+
+    def record_failure(self, account, latency, reason):
+        with self._lock:
+            h = self._health.get(account)
+            if h is None:
+                return
+            now = time.time()
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.last_failure_at = now
+            h.recent_failures.append((now, str(reason)[:200]))
+            self._update_latency(h, latency)
+            if h.consecutive_failures >= self.failure_threshold:
+                h.open_until = now + self.cooldown_seconds
+
+    def _update_latency(self, h, latency):
+        if latency is None:
+            return
+        if h.latency_ewma is None:
+            h.latency_ewma = latency
+        else:
+            h.latency_ewma += self.latency_alpha * (latency - h.latency_ewma)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return [self._health[account].to_dict(now) for account in self._order]
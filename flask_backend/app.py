@@ -1,18 +1,48 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, Response, stream_with_context
 from flask_cors import CORS, cross_origin
 import os
-from datetime import datetime, timedelta
+import hmac
+import json
+import logging
+import time
+import uuid
+from functools import wraps
 from dotenv import load_dotenv
-from supabase_tool import SupabaseClient
-from cleancloud_tool import myCleancloudClient
+from supabase_tool import RedeemError, NOT_FOUND, ALREADY_REDEEMED, EXPIRED, card_value
+from cleancloud_tool import myCleancloudClient, session_options_from_env
+from cleancloud_simulator import simulated_cleancloud_from_env
+from local_backend import supabase_client_from_env
+from outcome_cache import outcome_cache_from_env
+from code_index import code_index_from_env
+from fulfillment_queue import (FulfillmentWorkerPool, make_handler, queue_from_env, purchase_payloads,
+                               redeemed_message, record_code_fulfillment)
+from rate_limit import rate_limiter_from_env, client_ip, RateLimited
+from reporting import stats_cache_from_env, parse_day, export_csv, export_filename
+from static_assets import static_assets_from_env, StaticAssetsWSGI
+from batch_redeem import BatchRedemption, parse_batch, partner_authorized, POLL_INTERVAL, THREAD_WAIT_SECONDS
+from idempotency import (idempotency_store_from_env, request_fingerprint,
+                         STARTED, REPLAY, MISMATCH, MAX_KEY_LENGTH)
+from lifecycle import Lifecycle
+from log_config import setup_logging, request_id_var
+from metrics import REGISTRY, share_metrics_from_env
+import config
 
 # Load environment variables
 load_dotenv()
+setup_logging()
+share_metrics_from_env()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder="../frontend", static_url_path="/")
 
+# The page built by build_static.py is served from memory ahead of Flask, so
+# page loads skip the request hooks below; without a build, Flask serves ../frontend.
+static_assets = static_assets_from_env()
+if static_assets is not None:
+    app.wsgi_app = StaticAssetsWSGI(app.wsgi_app, static_assets)
+
 ###
-# To launch: flask run
+# To launch: gunicorn -c gunicorn.conf.py app:app  (python app.py / flask run for development)
 ###
 
 # Enable CORS for all routes and origins
@@ -20,29 +50,141 @@ CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Credentials"],
+        "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Credentials", "Idempotency-Key"],
         "supports_credentials": False
     }
 })
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-CLEANCLOUD_API_TOKEN = os.getenv("CLEANCLOUD_API_TOKEN")
+# Clients are built on first use in each process, not at import, so a pre-forking
+# server (gunicorn --preload) gives every worker its own connections and threads.
+def build_supabase():
+    settings = config.current()
+    # GIFT_CODES_BACKEND=memory or sqlite swaps Supabase for a local store (local_backend.py)
+    client = supabase_client_from_env(outcome_cache=outcome_cache_from_env())
+    # Bloom filter of every code, so unknown codes are rejected without a database call.
+    # Built by a background thread; until it is ready every code goes to the database.
+    client.code_index = code_index_from_env(client)
+    if client.code_index is not None:
+        client.code_index.start_background_refresh(settings.code_index_refresh_seconds)
+    return client
 
-# Initialize clients
-supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
-cleancloud = None
 
-# Initialize CleanCloud client if API token is available
-if CLEANCLOUD_API_TOKEN:
+def build_cleancloud():
+    settings = config.current()
+    # CLEANCLOUD_BACKEND=simulator buys nothing (cleancloud_simulator.py)
+    simulated = simulated_cleancloud_from_env(settings.source_accounts)
+    if simulated is not None:
+        return simulated
+    if not settings.cleancloud_api_token:
+        logger.warning("CleanCloud API token not found in environment variables")
+        return None
     try:
-        cleancloud = myCleancloudClient(CLEANCLOUD_API_TOKEN, print_gift_card_source_accounts=False)
-        print("✅ CleanCloud client initialized successfully")
+        client = myCleancloudClient(settings.cleancloud_api_token, print_gift_card_source_accounts=False,
+                                    source_accounts=settings.source_accounts, **session_options_from_env())
+        logger.info("CleanCloud client initialized")
+        return client
     except Exception as e:
-        print(f"❌ Failed to initialize CleanCloud client: {e}")
-        cleancloud = None
-else:
-    print("⚠️ CleanCloud API token not found in environment variables")
+        logger.error("Failed to initialize CleanCloud client: %s", e)
+        return None
+
+
+# Gift card purchases are queued and sent by a worker pool, not inside /redeem.
+# Set FULFILLMENT_WORKERS=0 to only enqueue here and drain the queue from a
+# separate `python fulfillment_queue.py` process.
+def start_fulfillment_workers():
+    pool = FulfillmentWorkerPool(
+        fulfillment_queue,
+        make_handler(cleancloud.instance()),
+        concurrency=config.current().fulfillment_workers,
+        # each code's outcome goes to its gift_codes row, for reconcile.py
+        recorder=lambda code: record_code_fulfillment(supabase, fulfillment_queue, code),
+    )
+    if pool.concurrency > 0:
+        pool.start()
+    return pool
+
+
+supabase = config.ProcessLocal(build_supabase)
+cleancloud = config.ProcessLocal(build_cleancloud)
+fulfillment_queue = config.ProcessLocal(queue_from_env)
+fulfillment_workers = config.ProcessLocal(start_fulfillment_workers)
+# SIGHUP can only be installed from the main thread: gunicorn.conf.py's
+# post_worker_init and warm_up() build this before any request does
+config_watcher = config.ProcessLocal(config.watch_from_env)
+lifecycle = config.ProcessLocal(Lifecycle)
+
+
+def warm_up_cleancloud():
+    if cleancloud.instance() is None:
+        raise RuntimeError("CleanCloud client not configured")
+    cleancloud.warm_up()
+
+
+def warm_up():
+    """Load config, open the Supabase and CleanCloud connections and start the fulfillment workers
+
+    Called in each worker before it takes traffic (gunicorn.conf.py); /readyz
+    answers 503 until the required steps have passed.
+    """
+    lifecycle.warm_up([
+        ("config", config.current, True),
+        ("config_watcher", config_watcher.instance, True),
+        ("supabase", lambda: supabase.ping(), True),
+        ("fulfillment_queue", lambda: fulfillment_queue.counts(), True),
+        ("fulfillment_workers", fulfillment_workers.instance, True),
+        # only the fulfillment workers call CleanCloud, so /redeem can run without it
+        ("cleancloud", warm_up_cleancloud, False),
+    ])
+
+
+def shutdown(timeout=30):
+    """Let running fulfillment jobs finish and record their outcome, then close connections"""
+    lifecycle.drain()
+    if config_watcher.built:
+        config_watcher.stop()
+    if fulfillment_workers.built:
+        fulfillment_workers.stop(timeout)
+    if supabase.built and supabase.code_index is not None:
+        supabase.code_index.stop()
+    if cleancloud.built and cleancloud.instance() is not None:
+        cleancloud.close()
+
+# Responses to /redeem requests that carried an Idempotency-Key header, for replaying retries
+idempotency = idempotency_store_from_env()
+
+# Per-IP / per-code limits and a global failed-attempts budget for /redeem
+rate_limiter = rate_limiter_from_env()
+
+# Cached /stats responses over the gift_code_stats summary
+stats_cache = stats_cache_from_env()
+
+
+@config.on_reload
+def update_source_accounts(settings):
+    if cleancloud.built and cleancloud.instance() is not None:
+        cleancloud.set_source_accounts(settings.source_accounts)
+
+
+def require_admin(view):
+    """Only allow requests carrying an "Authorization: Bearer <ADMIN_API_TOKEN>" header"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get("Authorization", "")
+        admin_api_token = config.current().admin_api_token
+        if not admin_api_token or not hmac.compare_digest(supplied, f"Bearer {admin_api_token}"):
+            return jsonify({"success": False, "message": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def require_partner(view):
+    """Like require_admin, also accepting the PARTNER_API_TOKENS"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not partner_authorized(request.headers.get("Authorization"), config.current()):
+            return jsonify({"success": False, "message": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route("/")
 def serve_html():
@@ -54,134 +196,297 @@ def test_cors():
         return jsonify({"status": "CORS preflight OK"}), 200
     return jsonify({"message": "CORS test successful", "method": request.method})
 
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Time from receiving a request to returning the response",
+    ["endpoint", "method", "status"])
+REDEEM_STAGE_SECONDS = REGISTRY.histogram(
+    "redeem_stage_seconds", "Time spent in each stage of /redeem", ["stage"])
+REDEEM_RESULTS = REGISTRY.counter(
+    "redeem_requests_total", "/redeem responses by outcome", ["outcome"])
+
+REGISTRY.gauge_callback(
+    "fulfillment_queue_jobs", "Fulfillment jobs by status", ["status"],
+    lambda: {(status,): n for status, n in fulfillment_queue.counts().items()})
+REGISTRY.gauge_callback(
+    "cleancloud_connections", "CleanCloud HTTP requests by pooled connection use", ["kind"],
+    lambda: {(kind,): n for kind, n in cleancloud.connection_stats().items()}
+    if cleancloud.built and cleancloud.instance() is not None else {})
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def assign_request_id():
+    # reuse the caller's id (e.g. from a load balancer) so logs can be joined across services
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex)
+
+@app.before_request
+def ensure_workers_started():
+    # once per process, after any fork; normally already done by warm_up()
+    fulfillment_workers.instance()
+    config_watcher.instance()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                             method=request.method, status=response.status_code)
+    return response
+
+@app.after_request
+def add_request_id(response):
+    response.headers["X-Request-ID"] = request_id_var.get() or ""
+    return response
+
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Requested-With')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Requested-With,Idempotency-Key')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     response.headers.add('Access-Control-Allow-Credentials', 'false')
     return response
 
+# HTTP status for each redeem_gift_code failure reason
+REDEEM_ERROR_STATUS = {
+    NOT_FOUND: 404,
+    ALREADY_REDEEMED: 409,
+    EXPIRED: 410,
+}
+
 @app.route("/redeem", methods=["POST", "OPTIONS"])
 def redeem_endpoint():
     # Handle preflight OPTIONS request
     if request.method == "OPTIONS":
         return jsonify({"status": "OK"}), 200
     
-    data = request.get_json()
-    print(f"Received data: {data}")
-    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        REDEEM_RESULTS.inc(outcome="invalid_request")
+        return jsonify({"success": False, "message": "Request body must be a JSON object"}), 400
+    ip = client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"), config.current().trusted_proxies)
+
+    key = request.headers.get("Idempotency-Key")
+    if not key or idempotency is None:
+        limited = check_rate_limit(ip, data.get("code"))
+        if limited is not None:
+            return limited
+        body, status = redeem(data, ip)
+        return jsonify(body), status
+
+    if len(key) > MAX_KEY_LENGTH:
+        return jsonify({"success": False, "message": "Idempotency-Key is too long"}), 400
+    fingerprint = request_fingerprint(data.get("code"), data.get("recipient_email"), data.get("recipient_phone"))
+    # a retry of a finished request is answered from the store before the limits count it
+    state, stored = idempotency.begin(key, fingerprint)
+    if state != STARTED:
+        body, status = idempotent_response(state, stored)
+        response = jsonify(body)
+        if state == REPLAY:
+            response.headers["Idempotent-Replayed"] = "true"
+        return response, status
+    limited = check_rate_limit(ip, data.get("code"))
+    if limited is not None:
+        idempotency.release(key)
+        return limited
+
+    body, status = None, 500
+    try:
+        body, status = redeem(data, ip)
+        return jsonify(body), status
+    finally:
+        # server errors are not stored, so a retry runs the redemption again
+        if status < 500:
+            idempotency.finish(key, body, status)
+        else:
+            idempotency.release(key)
+
+
+def check_rate_limit(ip, code):
+    """429 response if the rate limiter turns this request away (before any Supabase call), else None"""
+    if rate_limiter is None:
+        return None
+    try:
+        rate_limiter.check(ip, code)
+    except RateLimited as e:
+        REDEEM_RESULTS.inc(outcome="rate_limited")
+        return jsonify({"success": False, "message": str(e), "reason": "rate_limited"}), 429, \
+            {"Retry-After": str(e.retry_after)}
+    return None
+
+
+def idempotent_response(state, stored):
+    """Response for a request whose Idempotency-Key was already used"""
+    if state == REPLAY:
+        REDEEM_RESULTS.inc(outcome="replayed")
+        return stored
+    if state == MISMATCH:
+        REDEEM_RESULTS.inc(outcome="idempotency_mismatch")
+        return {"success": False, "message": "Idempotency-Key was already used for a different request"}, 422
+    REDEEM_RESULTS.inc(outcome="idempotency_in_progress")
+    return {"success": False, "message": "A request with this Idempotency-Key is still being processed",
+            "reason": "in_progress"}, 409
+
+
+def redeem(data, ip=None):
+    """Redeem a code and queue its gift card; returns (response body, HTTP status)"""
     code = data.get("code")
     recipient_email = data.get("recipient_email")
     recipient_phone = data.get("recipient_phone")
     metadata = data.get("metadata", {})
 
-    print(f"Parsed - code: {code}, email: {recipient_email}, phone: {recipient_phone}")
-
     if not code or not recipient_email or not recipient_phone:
-        return jsonify({"success": False, "message": "Missing code or recipient information"}), 400
+        REDEEM_RESULTS.inc(outcome="invalid_request")
+        return {"success": False, "message": "Missing code or recipient information"}, 400
 
     try:
         # Step 1: Redeem the code in Supabase
-        print("🎫 Redeeming code in Supabase...")
-        _ = supabase.redeem_code(code, recipient_email, recipient_phone, metadata=metadata)
-        print("✅ Code redeemed successfully in Supabase")
-        
-        # Step 2: Purchase and send CleanCloud gift card
-        if cleancloud:
-            try:
-                print("🎁 Purchasing CleanCloud gift card...")
-                
-                # Extract recipient name from email (before @) or use "Valued Customer"
-                to_name = recipient_email.split('@')[0].title() if '@' in recipient_email else "Valued Customer"
-                
-                # Gift card parameters
-                amount = float(os.getenv("GIFT_CARD_AMOUNT", "10.0"))  # Default $10
-                
-                # Send immediately
-                today = datetime.now()
-                send_date = today.strftime("%Y-%m-%d")
-                send_hour = today.strftime("%H:%M")
-                
-                message = f"Congratulations! Your redemption code {code} has been processed. Enjoy your gift card!"
-                
-                print("=" * 60)
-                print("🎁 CLEANCLOUD GIFT CARD PURCHASE DETAILS")
-                print("=" * 60)
-                print(f"📧 Recipient Name: {to_name}")
-                print(f"📧 Recipient Email: {recipient_email}")
-                print(f"📱 Recipient Phone: {recipient_phone}")
-                print(f"💰 Gift Card Amount: ${amount}")
-                print(f"📅 Send Date: {send_date}")
-                print(f"🕒 Send Time: {send_hour}")
-                print(f"💬 Message: {message}")
-                print(f"📨 Notification Method: Email")
-                print("=" * 60)
-                
-                # Attempt to purchase gift card
-                cleancloud_response = cleancloud.gift_card_buy(
-                    to_name=to_name,
-                    to_email=recipient_email,
-                    to_tel=recipient_phone,
-                    amount=amount,
-                    send_date=send_date,
-                    send_hour=send_hour,
-                    message=message,
-                    notify_by=2  # Email notification
-                )
-                
-                print("=" * 60)
-                print("🎯 CLEANCLOUD API RESPONSE")
-                print("=" * 60)
-                print(f"Response Type: {type(cleancloud_response)}")
-                print(f"Response Content: {cleancloud_response}")
-                print("=" * 60)
-                
-                if "Success" in str(cleancloud_response):
-                    print("🎉 SUCCESS! CleanCloud gift card purchased and sent successfully!")
-                    print(f"✅ ${amount} gift card sent to {recipient_email}")
-                    print("=" * 60)
-                    return jsonify({
-                        "success": True, 
-                        "message": f"Code {code} redeemed successfully! A ${amount} gift card has been sent to your email."
-                    })
-                else:
-                    print("❌ FAILED! CleanCloud gift card purchase failed")
-                    print(f"⚠️ Code was redeemed but gift card could not be sent")
-                    print(f"🔍 Failure reason: {cleancloud_response}")
-                    print("=" * 60)
-                    return jsonify({
-                        "success": True, 
-                        "message": f"Code {code} redeemed successfully! However, there was an issue sending your gift card. Please contact support."
-                    })
-                    
-            except Exception as cleancloud_error:
-                print("=" * 60)
-                print("💥 CLEANCLOUD EXCEPTION OCCURRED")
-                print("=" * 60)
-                print(f"Exception Type: {type(cleancloud_error).__name__}")
-                print(f"Exception Message: {str(cleancloud_error)}")
-                print(f"⚠️ Code was redeemed but gift card purchase failed due to exception")
-                print("=" * 60)
-                return jsonify({
-                    "success": True, 
-                    "message": f"Code {code} redeemed successfully! However, there was an issue sending your gift card. Please contact support."
-                })
-        else:
-            print("=" * 60)
-            print("⚠️ CLEANCLOUD NOT AVAILABLE")
-            print("=" * 60)
-            print("🚫 CleanCloud client not initialized")
-            print("💡 Check CLEANCLOUD_API_TOKEN in environment variables")
-            print("✅ Code was redeemed but no gift card sent")
-            print("=" * 60)
-            return jsonify({"success": True, "message": f"Code {code} redeemed successfully!"})
-            
+        with REDEEM_STAGE_SECONDS.time(stage="redeem_code"):
+            result = supabase.redeem_code(code, recipient_email, recipient_phone, metadata=metadata)
+
+        # Step 2: Queue the CleanCloud gift card purchases, workers send them in the background.
+        # The code's own card_value, split into one job per card bought
+        settings = config.current()
+        amount = card_value(result, settings.gift_card_amount)
+        payloads = purchase_payloads(code, recipient_email, recipient_phone,
+                                     settings.denomination_table.split(amount), request_id_var.get())
+        with REDEEM_STAGE_SECONDS.time(stage="enqueue"):
+            job_ids = fulfillment_queue.enqueue_many(code, payloads)
+        REDEEM_RESULTS.inc(outcome="redeemed")
+        logger.info("Code redeemed, gift card purchase queued",
+                    extra={"event": "redeem_succeeded", "code": code, "job_id": job_ids[0], "sample": True})
+        return {
+            "success": True,
+            "message": redeemed_message(code, amount, len(job_ids)),
+            "job_id": job_ids[0],
+            "job_ids": job_ids
+        }, 202
+
+    except RedeemError as e:
+        REDEEM_RESULTS.inc(outcome=e.reason)
+        if rate_limiter is not None:
+            rate_limiter.record_failure(ip)
+        logger.info("Code rejected", extra={"event": "redeem_rejected", "code": code,
+                                             "reason": e.reason, "sample": True})
+        return {"success": False, "message": str(e), "reason": e.reason}, REDEEM_ERROR_STATUS[e.reason]
+    except Exception as e:
+        REDEEM_RESULTS.inc(outcome="error")
+        logger.exception("Error in redeem_endpoint", extra={"event": "redeem_error", "code": code})
+        return {"success": False, "message": f"Server error: {str(e)}"}, 500
+
+
+@app.route("/redeem/batch", methods=["POST"])
+@require_partner
+def redeem_batch_endpoint():
+    settings = config.current()
+    items, error = parse_batch(request.get_json(silent=True), settings.redeem_batch_max_items)
+    if error is not None:
+        return jsonify({"success": False, "message": error[0]}), error[1]
+    wait = request.args.get("wait", "").lower() in ("1", "true", "yes")
+
+    batch = BatchRedemption(items, REDEEM_ERROR_STATUS, request_id_var.get())
+    try:
+        # one redeem_gift_codes call and one queue transaction for the whole batch
+        with REDEEM_STAGE_SECONDS.time(stage="redeem_codes"):
+            outcomes = supabase.redeem_codes(batch.to_redeem()) if batch.valid else []
+        code_payloads = batch.redeemed(outcomes, settings)
+        with REDEEM_STAGE_SECONDS.time(stage="enqueue"):
+            batch.queued(fulfillment_queue.enqueue_codes(code_payloads))
+    except Exception as e:
+        logger.exception("Error in redeem_batch_endpoint", extra={"event": "redeem_batch_error"})
+        batch.failed(e)
+    logger.info("Batch redeemed", extra={"event": "redeem_batch", "items": len(items)})
+
+    def stream():
+        for line in batch.lines:
+            yield json.dumps(line) + "\n"
+        deadline = time.monotonic() + min(settings.redeem_batch_wait_seconds, THREAD_WAIT_SECONDS)
+        while wait and batch.waiting and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            for line in batch.fulfillment_lines(fulfillment_queue.statuses(batch.waiting_job_ids())):
+                yield json.dumps(line) + "\n"
+        yield json.dumps(batch.summary()) + "\n"
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+
+@app.route("/redeem/status/<job_id>", methods=["GET"])
+def redeem_status_endpoint(job_id):
+    job = fulfillment_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job id"}), 404
+    body = {"success": True, "job_id": job["id"], "status": job["status"], "attempts": job["attempts"]}
+    # job ids are random, but the code and upstream errors are only shown to partners and admins
+    if partner_authorized(request.headers.get("Authorization"), config.current()):
+        body.update(code=job["code"], last_error=job["last_error"])
+    return jsonify(body)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz_endpoint():
+    body, status = lifecycle.liveness()
+    return jsonify(body), status
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz_endpoint():
+    if not lifecycle.checks:
+        # not started through gunicorn.conf.py, e.g. flask run
+        warm_up()
+    body, status = lifecycle.readiness()
+    return jsonify(body), status
+
+
+@app.route("/admin/accounts", methods=["GET"])
+@require_admin
+def account_stats_endpoint():
+    client = cleancloud.instance()
+    if not client:
+        return jsonify({"success": False, "message": "CleanCloud client not initialized"}), 503
+    return jsonify({"success": True, "accounts": client.account_stats()})
+
+
+@app.route("/admin/code-index", methods=["GET"])
+@require_admin
+def code_index_stats_endpoint():
+    if supabase.code_index is None:
+        return jsonify({"success": False, "message": "Code index disabled"}), 404
+    return jsonify({"success": True, "code_index": supabase.code_index.stats()})
+
+
+@app.route("/stats", methods=["GET"])
+@require_admin
+def stats_endpoint():
+    try:
+        since, until = parse_day(request.args.get("since")), parse_day(request.args.get("until"))
+    except ValueError:
+        return jsonify({"success": False, "message": "since and until must be YYYY-MM-DD dates"}), 400
+    try:
+        stats = stats_cache.get(supabase, since, until, request.args.get("distributed_to"),
+                                config.current().gift_card_amount)
     except Exception as e:
-        print(f"❌ Error in redeem_endpoint: {type(e).__name__}: {str(e)}")
+        logger.exception("Error loading stats", extra={"event": "stats_error"})
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
+    return jsonify({"success": True, **stats})
+
+
+@app.route("/stats/export", methods=["GET"])
+@require_admin
+def stats_export_endpoint():
+    distributed_to = request.args.get("distributed_to")
+    return Response(stream_with_context(export_csv(supabase, distributed_to)), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{export_filename(distributed_to)}"'})
 
 
 if __name__ == "__main__":
+    # development server; see gunicorn.conf.py for production
     port = int(os.environ.get("PORT", 5000))  # Render sets $PORT
+    warm_up()
     app.run(host="0.0.0.0", port=port)
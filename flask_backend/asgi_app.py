@@ -0,0 +1,483 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from supabase_tool import RedeemError, NOT_FOUND, ALREADY_REDEEMED, EXPIRED, card_value
+from cleancloud_tool import AsyncCleancloudClient, session_options_from_env
+from cleancloud_simulator import simulated_cleancloud_from_env
+from local_backend import supabase_client_from_env, async_supabase_client_from_env
+from outcome_cache import outcome_cache_from_env
+from code_index import code_index_from_env
+from fulfillment_queue import (AsyncFulfillmentWorkerPool, make_async_handler, queue_from_env, purchase_payloads,
+                               redeemed_message, record_code_fulfillment)
+from rate_limit import rate_limiter_from_env, client_ip, RateLimited
+from reporting import stats_cache_from_env, parse_day, export_csv, export_filename
+from static_assets import static_assets_from_env, StaticAssetsASGI
+from batch_redeem import BatchRedemption, parse_batch, partner_authorized, POLL_INTERVAL
+from idempotency import idempotency_store_from_env, request_fingerprint, STARTED, REPLAY, MISMATCH, IN_PROGRESS, MAX_KEY_LENGTH
+from lifecycle import Lifecycle
+from log_config import setup_logging, request_id_var
+from metrics import REGISTRY, share_metrics_from_env
+import config
+
+# Async server mode: the same /redeem API as app.py on an event loop, so a
+# request waiting on Supabase costs a coroutine instead of a thread.
+#
+# To launch: uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 4 --timeout-graceful-shutdown 30
+#
+# Redemption goes through AsyncSupabaseClient and purchases through
+# AsyncCleancloudClient, both on pooled keep-alive connections. Fulfillment
+# jobs use the same SQLite queue as app.py, drained by asyncio tasks, so the
+# two servers (and `python fulfillment_queue.py`) can share one queue file.
+
+load_dotenv()
+setup_logging()
+share_metrics_from_env()
+logger = logging.getLogger(__name__)
+
+
+
+# Built on first use in each worker process, like app.py
+def build_supabase():
+    client = async_supabase_client_from_env(outcome_cache=outcome_cache_from_env())
+    # The index pages through gift_codes on a background thread, which needs the sync client
+    client.code_index = code_index_from_env(sync_supabase.instance())
+    return client
+
+
+def build_sync_supabase():
+    return supabase_client_from_env()
+
+
+def build_cleancloud():
+    settings = config.current()
+    simulated = simulated_cleancloud_from_env(settings.source_accounts, async_client=True)
+    if simulated is not None:
+        return simulated
+    if not settings.cleancloud_api_token:
+        logger.warning("CleanCloud API token not found in environment variables")
+        return None
+    try:
+        client = AsyncCleancloudClient(settings.cleancloud_api_token, print_gift_card_source_accounts=False,
+                                       source_accounts=settings.source_accounts, **session_options_from_env())
+        logger.info("CleanCloud client initialized")
+        return client
+    except Exception as e:
+        logger.error("Failed to initialize CleanCloud client: %s", e)
+        return None
+
+
+def build_fulfillment_workers():
+    return AsyncFulfillmentWorkerPool(
+        fulfillment_queue,
+        make_async_handler(cleancloud.instance()),
+        concurrency=config.current().fulfillment_workers,
+        # runs in a thread, so it writes each code's outcome through the sync client
+        recorder=lambda code: record_code_fulfillment(sync_supabase, fulfillment_queue, code),
+    )
+
+
+supabase = config.ProcessLocal(build_supabase)
+sync_supabase = config.ProcessLocal(build_sync_supabase)
+cleancloud = config.ProcessLocal(build_cleancloud)
+fulfillment_queue = config.ProcessLocal(queue_from_env)
+fulfillment_workers = config.ProcessLocal(build_fulfillment_workers)
+lifecycle = config.ProcessLocal(Lifecycle)
+idempotency = idempotency_store_from_env()
+rate_limiter = rate_limiter_from_env()
+# the page built by build_static.py, answered ahead of the other middleware
+static_assets = static_assets_from_env()
+stats_cache = stats_cache_from_env()
+
+
+@config.on_reload
+def update_source_accounts(settings):
+    if cleancloud.built and cleancloud.instance() is not None:
+        cleancloud.set_source_accounts(settings.source_accounts)
+
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Time from receiving a request to returning the response",
+    ["endpoint", "method", "status"])
+REDEEM_STAGE_SECONDS = REGISTRY.histogram(
+    "redeem_stage_seconds", "Time spent in each stage of /redeem", ["stage"])
+REDEEM_RESULTS = REGISTRY.counter(
+    "redeem_requests_total", "/redeem responses by outcome", ["outcome"])
+
+REGISTRY.gauge_callback(
+    "fulfillment_queue_jobs", "Fulfillment jobs by status", ["status"],
+    lambda: {(status,): n for status, n in fulfillment_queue.counts().items()})
+
+# HTTP status for each redeem_gift_code failure reason
+REDEEM_ERROR_STATUS = {
+    NOT_FOUND: 404,
+    ALREADY_REDEEMED: 409,
+    EXPIRED: 410,
+}
+
+
+def require_admin(endpoint):
+    """Only allow requests carrying an "Authorization: Bearer <ADMIN_API_TOKEN>" header"""
+    async def wrapper(request):
+        supplied = request.headers.get("Authorization", "")
+        admin_api_token = config.current().admin_api_token
+        if not admin_api_token or not hmac.compare_digest(supplied, f"Bearer {admin_api_token}"):
+            return JSONResponse({"success": False, "message": "Unauthorized"}, 401)
+        return await endpoint(request)
+    return wrapper
+
+
+def require_partner(endpoint):
+    """Like require_admin, also accepting the PARTNER_API_TOKENS"""
+    async def wrapper(request):
+        if not partner_authorized(request.headers.get("Authorization"), config.current()):
+            return JSONResponse({"success": False, "message": "Unauthorized"}, 401)
+        return await endpoint(request)
+    return wrapper
+
+
+async def redeem_endpoint(request):
+    if request.method == "OPTIONS":
+        return JSONResponse({"status": "OK"})
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        REDEEM_RESULTS.inc(outcome="invalid_request")
+        return JSONResponse({"success": False, "message": "Request body must be a JSON object"}, 400)
+
+    ip = client_ip(request.client.host if request.client else None,
+                   request.headers.get("X-Forwarded-For"), config.current().trusted_proxies)
+
+    key = request.headers.get("Idempotency-Key")
+    if not key or idempotency is None:
+        limited = await check_rate_limit(ip, data.get("code"))
+        if limited is not None:
+            return limited
+        body, status = await redeem(data, ip)
+        return JSONResponse(body, status)
+
+    if len(key) > MAX_KEY_LENGTH:
+        return JSONResponse({"success": False, "message": "Idempotency-Key is too long"}, 400)
+    fingerprint = request_fingerprint(data.get("code"), data.get("recipient_email"), data.get("recipient_phone"))
+    # a retry of a finished request is answered from the store before the limits count it
+    state, stored = await begin_idempotent(key, fingerprint)
+    if state != STARTED:
+        body, status = idempotent_response(state, stored)
+        return JSONResponse(body, status, headers={"Idempotent-Replayed": "true"} if state == REPLAY else None)
+    limited = await check_rate_limit(ip, data.get("code"))
+    if limited is not None:
+        await asyncio.to_thread(idempotency.release, key)
+        return limited
+
+    body, status = None, 500
+    try:
+        body, status = await redeem(data, ip)
+        return JSONResponse(body, status)
+    finally:
+        # server errors are not stored, so a retry runs the redemption again
+        if status < 500:
+            await asyncio.to_thread(idempotency.finish, key, body, status)
+        else:
+            await asyncio.to_thread(idempotency.release, key)
+
+
+async def begin_idempotent(key, fingerprint, wait_seconds=30, poll_interval=0.05):
+    """idempotency.begin without blocking the event loop while a duplicate is in flight"""
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        # the sqlite and redis stores do I/O, so each attempt runs in the default thread pool
+        state, stored = await asyncio.to_thread(idempotency.begin, key, fingerprint, 0)
+        if state != IN_PROGRESS or time.monotonic() >= deadline:
+            return state, stored
+        await asyncio.sleep(poll_interval)
+
+
+async def check_rate_limit(ip, code):
+    """429 response if the rate limiter turns this request away (before any Supabase call), else None"""
+    if rate_limiter is None:
+        return None
+    try:
+        # the redis store does I/O, so the check runs in the default thread pool
+        await asyncio.to_thread(rate_limiter.check, ip, code)
+    except RateLimited as e:
+        REDEEM_RESULTS.inc(outcome="rate_limited")
+        return JSONResponse({"success": False, "message": str(e), "reason": "rate_limited"}, 429,
+                            headers={"Retry-After": str(e.retry_after)})
+    return None
+
+
+def idempotent_response(state, stored):
+    """Response for a request whose Idempotency-Key was already used"""
+    if state == REPLAY:
+        REDEEM_RESULTS.inc(outcome="replayed")
+        return stored
+    if state == MISMATCH:
+        REDEEM_RESULTS.inc(outcome="idempotency_mismatch")
+        return {"success": False, "message": "Idempotency-Key was already used for a different request"}, 422
+    REDEEM_RESULTS.inc(outcome="idempotency_in_progress")
+    return {"success": False, "message": "A request with this Idempotency-Key is still being processed",
+            "reason": "in_progress"}, 409
+
+
+async def redeem(data, ip=None):
+    """Redeem a code and queue its gift card; returns (response body, HTTP status)"""
+    code = data.get("code")
+    recipient_email = data.get("recipient_email")
+    recipient_phone = data.get("recipient_phone")
+    metadata = data.get("metadata", {})
+
+    if not code or not recipient_email or not recipient_phone:
+        REDEEM_RESULTS.inc(outcome="invalid_request")
+        return {"success": False, "message": "Missing code or recipient information"}, 400
+
+    try:
+        with REDEEM_STAGE_SECONDS.time(stage="redeem_code"):
+            result = await supabase.redeem_code(code, recipient_email, recipient_phone, metadata=metadata)
+
+        settings = config.current()
+        amount = card_value(result, settings.gift_card_amount)
+        payloads = purchase_payloads(code, recipient_email, recipient_phone,
+                                     settings.denomination_table.split(amount), request_id_var.get())
+        with REDEEM_STAGE_SECONDS.time(stage="enqueue"):
+            job_ids = await asyncio.to_thread(fulfillment_queue.enqueue_many, code, payloads)
+        REDEEM_RESULTS.inc(outcome="redeemed")
+        logger.info("Code redeemed, gift card purchase queued",
+                    extra={"event": "redeem_succeeded", "code": code, "job_id": job_ids[0], "sample": True})
+        return {
+            "success": True,
+            "message": redeemed_message(code, amount, len(job_ids)),
+            "job_id": job_ids[0],
+            "job_ids": job_ids
+        }, 202
+
+    except RedeemError as e:
+        REDEEM_RESULTS.inc(outcome=e.reason)
+        if rate_limiter is not None:
+            await asyncio.to_thread(rate_limiter.record_failure, ip)
+        logger.info("Code rejected", extra={"event": "redeem_rejected", "code": code,
+                                             "reason": e.reason, "sample": True})
+        return {"success": False, "message": str(e), "reason": e.reason}, REDEEM_ERROR_STATUS[e.reason]
+    except Exception as e:
+        REDEEM_RESULTS.inc(outcome="error")
+        logger.exception("Error in redeem_endpoint", extra={"event": "redeem_error", "code": code})
+        return {"success": False, "message": f"Server error: {str(e)}"}, 500
+
+
+@require_partner
+async def redeem_batch_endpoint(request):
+    settings = config.current()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    items, error = parse_batch(data, settings.redeem_batch_max_items)
+    if error is not None:
+        return JSONResponse({"success": False, "message": error[0]}, error[1])
+    wait = request.query_params.get("wait", "").lower() in ("1", "true", "yes")
+
+    batch = BatchRedemption(items, REDEEM_ERROR_STATUS, request_id_var.get())
+    try:
+        # one redeem_gift_codes call and one queue transaction for the whole batch
+        with REDEEM_STAGE_SECONDS.time(stage="redeem_codes"):
+            outcomes = await supabase.redeem_codes(batch.to_redeem()) if batch.valid else []
+        code_payloads = batch.redeemed(outcomes, settings)
+        with REDEEM_STAGE_SECONDS.time(stage="enqueue"):
+            batch.queued(await asyncio.to_thread(fulfillment_queue.enqueue_codes, code_payloads))
+    except Exception as e:
+        logger.exception("Error in redeem_batch_endpoint", extra={"event": "redeem_batch_error"})
+        batch.failed(e)
+    logger.info("Batch redeemed", extra={"event": "redeem_batch", "items": len(items)})
+
+    async def stream():
+        for line in batch.lines:
+            yield json.dumps(line) + "\n"
+        deadline = time.monotonic() + settings.redeem_batch_wait_seconds
+        while wait and batch.waiting and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            statuses = await asyncio.to_thread(fulfillment_queue.statuses, batch.waiting_job_ids())
+            for line in batch.fulfillment_lines(statuses):
+                yield json.dumps(line) + "\n"
+        yield json.dumps(batch.summary()) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def redeem_status_endpoint(request):
+    job = await asyncio.to_thread(fulfillment_queue.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"success": False, "message": "Unknown job id"}, 404)
+    body = {"success": True, "job_id": job["id"], "status": job["status"], "attempts": job["attempts"]}
+    # job ids are random, but the code and upstream errors are only shown to partners and admins
+    if partner_authorized(request.headers.get("Authorization"), config.current()):
+        body.update(code=job["code"], last_error=job["last_error"])
+    return JSONResponse(body)
+
+
+async def metrics_endpoint(request):
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def healthz_endpoint(request):
+    body, status = lifecycle.liveness()
+    return JSONResponse(body, status_code=status)
+
+
+async def readyz_endpoint(request):
+    body, status = await lifecycle.async_readiness()
+    return JSONResponse(body, status_code=status)
+
+
+@require_admin
+async def account_stats_endpoint(request):
+    client = cleancloud.instance()
+    if not client:
+        return JSONResponse({"success": False, "message": "CleanCloud client not initialized"}, 503)
+    return JSONResponse({"success": True, "accounts": client.account_stats()})
+
+
+@require_admin
+async def code_index_stats_endpoint(request):
+    if supabase.code_index is None:
+        return JSONResponse({"success": False, "message": "Code index disabled"}, 404)
+    return JSONResponse({"success": True, "code_index": supabase.code_index.stats()})
+
+
+# Reporting reads page through Supabase on a worker thread with the sync client
+@require_admin
+async def stats_endpoint(request):
+    try:
+        since, until = parse_day(request.query_params.get("since")), parse_day(request.query_params.get("until"))
+    except ValueError:
+        return JSONResponse({"success": False, "message": "since and until must be YYYY-MM-DD dates"}, 400)
+    try:
+        stats = await asyncio.to_thread(stats_cache.get, sync_supabase, since, until,
+                                        request.query_params.get("distributed_to"),
+                                        config.current().gift_card_amount)
+    except Exception as e:
+        logger.exception("Error loading stats", extra={"event": "stats_error"})
+        return JSONResponse({"success": False, "message": f"Server error: {str(e)}"}, 500)
+    return JSONResponse({"success": True, **stats})
+
+
+@require_admin
+async def stats_export_endpoint(request):
+    distributed_to = request.query_params.get("distributed_to")
+    # a sync iterator, which Starlette steps through in its thread pool
+    return StreamingResponse(export_csv(sync_supabase, distributed_to), media_type="text/csv",
+                             headers={"Content-Disposition": f'attachment; filename="{export_filename(distributed_to)}"'})
+
+
+class RequestContextMiddleware:
+    """Request id and request timing, like the before/after_request hooks in app.py"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route = scope.get("route")
+            HTTP_SECONDS.observe(time.perf_counter() - started,
+                                 endpoint=route.path if route is not None else "unmatched",
+                                 method=scope["method"], status=status)
+            request_id_var.reset(token)
+
+
+async def warm_up_config():
+    config.current()
+
+
+async def warm_up_fulfillment_queue():
+    await asyncio.to_thread(fulfillment_queue.counts)
+
+
+async def warm_up_cleancloud():
+    if cleancloud.instance() is None:
+        raise RuntimeError("CleanCloud client not configured")
+    await cleancloud.warm_up()
+
+
+# uvicorn starts accepting connections once the lifespan startup below has run,
+# so the connections are open before the first request; see app.warm_up
+WARM_UP_STEPS = [
+    ("config", warm_up_config, True),
+    ("supabase", lambda: supabase.ping(), True),
+    ("fulfillment_queue", warm_up_fulfillment_queue, True),
+    ("cleancloud", warm_up_cleancloud, False),
+]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if supabase.code_index is not None:
+        supabase.code_index.start_background_refresh(config.current().code_index_refresh_seconds)
+    if fulfillment_workers.concurrency > 0:
+        fulfillment_workers.start()
+    watcher = config.watch_from_env()
+    await lifecycle.async_warm_up(WARM_UP_STEPS)
+    yield
+    # uvicorn has stopped accepting and finished in-flight requests; running purchases finish below
+    lifecycle.drain()
+    watcher.stop()
+    await fulfillment_workers.stop()
+    if cleancloud.instance() is not None:
+        await cleancloud.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/redeem", redeem_endpoint, methods=["POST", "OPTIONS"]),
+        Route("/redeem/batch", redeem_batch_endpoint, methods=["POST"]),
+        Route("/redeem/status/{job_id}", redeem_status_endpoint, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+        Route("/healthz", healthz_endpoint, methods=["GET"]),
+        Route("/readyz", readyz_endpoint, methods=["GET"]),
+        Route("/admin/accounts", account_stats_endpoint, methods=["GET"]),
+        Route("/admin/code-index", code_index_stats_endpoint, methods=["GET"]),
+        Route("/stats", stats_endpoint, methods=["GET"]),
+        Route("/stats/export", stats_export_endpoint, methods=["GET"]),
+    ],
+    middleware=([Middleware(StaticAssetsASGI, assets=static_assets)] if static_assets is not None else []) + [
+        Middleware(RequestContextMiddleware),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "PUT", "POST", "DELETE", "OPTIONS"],
+                   allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Idempotency-Key"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 5000))
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,124 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from dotenv import load_dotenv
+from supabase_tool import expiry_values, distribution_values
+from local_backend import supabase_client_from_env
+from log_config import setup_logging
+
+# Apply many serial-range operations at once, e.g. for a retail partner rollout.
+#
+#   python batch_operations.py ranges.csv --workers 8
+#
+# ranges.csv:
+#   operation,start_serial,end_serial,value
+#   distribute,1,500,Seven-Eleven
+#   distribute,501,1000,FairPrice
+#   expiry,1,1000,2025-12-31
+#
+# Ranges run concurrently on a bounded pool, each as a single UPDATE that only
+# returns a row count, and a JSON summary of rows affected per range is printed.
+# Overlapping ranges of the same operation (e.g. distribute 1-500 to one
+# partner, then 400-600 to another) run one after another in file order, so
+# the last row in the file wins as it would run serially.
+
+OPERATIONS = ("expiry", "distribute")
+
+
+def read_range_operations(filepath):
+    """Read range operations from a CSV file with headers"""
+    operations = []
+    with open(filepath, "r", newline="") as file:
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            operation = row["operation"].strip().lower()
+            if operation not in OPERATIONS:
+                raise ValueError(f"{filepath}:{line_number}: unknown operation '{operation}'")
+            operations.append({
+                "operation": operation,
+                "start_serial": int(row["start_serial"]),
+                "end_serial": int(row["end_serial"]),
+                "value": row["value"].strip(),
+            })
+    return operations
+
+
+def _operation_values(operation):
+    if operation["operation"] == "expiry":
+        return expiry_values(date.fromisoformat(operation["value"]))
+    return distribution_values(operation["value"])
+
+
+def overlap_groups(operations):
+    """Operation indexes grouped so that overlapping ranges of the same operation share a group, in file order"""
+    order = sorted(range(len(operations)),
+                   key=lambda i: (operations[i]["operation"], operations[i]["start_serial"]))
+    groups = []
+    group, group_operation, group_end = [], None, None
+    for i in order:
+        operation = operations[i]
+        if group and operation["operation"] == group_operation and operation["start_serial"] <= group_end:
+            group.append(i)
+            group_end = max(group_end, operation["end_serial"])
+        else:
+            if group:
+                groups.append(sorted(group))
+            group, group_operation, group_end = [i], operation["operation"], operation["end_serial"]
+    if group:
+        groups.append(sorted(group))
+    return groups
+
+
+def run_range_operations(client, operations, max_workers=8):
+    """Run range operations through client.update_range; returns a summary dict"""
+    def run(operation):
+        result = dict(operation)
+        started = time.perf_counter()
+        try:
+            result["rows_affected"] = client.update_range(
+                operation["start_serial"], operation["end_serial"], _operation_values(operation))
+            result["error"] = None
+        except Exception as e:
+            result["rows_affected"] = 0
+            result["error"] = e.message if hasattr(e, 'message') else str(e)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    results = [None] * len(operations)
+
+    def run_group(indexes):
+        for i in indexes:
+            results[i] = run(operations[i])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run_group, overlap_groups(operations)))
+
+    return {
+        "operations": results,
+        "ranges": len(results),
+        "failed": sum(1 for r in results if r["error"]),
+        "empty": sum(1 for r in results if not r["error"] and r["rows_affected"] == 0),
+        "total_rows_affected": sum(r["rows_affected"] for r in results),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run expiry/distribution updates for many serial ranges")
+    parser.add_argument("ranges_csv", help="CSV with operation,start_serial,end_serial,value")
+    parser.add_argument("--workers", type=int, default=8, help="ranges updated concurrently")
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging(fmt=os.getenv("LOG_FORMAT", "text"))
+    supabase = supabase_client_from_env()
+    summary = run_range_operations(supabase, read_range_operations(args.ranges_csv), args.workers)
+    print(json.dumps(summary, indent=2))
+    if summary["failed"]:
+        print(f"❌ {summary['failed']} of {summary['ranges']} ranges failed")
+    else:
+        print(f"✅ {summary['ranges']} ranges, {summary['total_rows_affected']} rows updated in {summary['seconds']}s")
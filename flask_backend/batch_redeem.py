@@ -0,0 +1,137 @@
+import hmac
+import time
+from metrics import REGISTRY
+from supabase_tool import RedeemError, card_value
+from fulfillment_queue import purchase_payloads, redeemed_message, PENDING, RUNNING, SUCCEEDED
+
+# POST /redeem/batch: partners redeem many codes in one request.
+#
+#   {"items": [{"code": "...", "recipient_email": "...", "recipient_phone": "...", "metadata": {...}}, ...]}
+#
+# All valid items are redeemed with one redeem_gift_codes call
+# (sql/redeem_gift_codes.sql) and their gift cards are queued in one SQLite
+# transaction. The fulfillment workers then buy them, at most
+# FULFILLMENT_WORKERS at a time. The response is NDJSON: one "redeem" line per
+# item, in request order, with the same status and message /redeem would give.
+# With ?wait=true a "fulfillment" line follows for each code as its purchases
+# finish, for up to REDEEM_BATCH_WAIT_SECONDS. A "summary" line comes last.
+#
+#   PARTNER_API_TOKENS=token1,token2   # Bearer tokens accepted besides ADMIN_API_TOKEN
+#   REDEEM_BATCH_MAX_ITEMS=500
+#   REDEEM_BATCH_WAIT_SECONDS=120     # ?wait on asgi_app.py; app.py caps it at THREAD_WAIT_SECONDS
+
+BATCH_ITEMS = REGISTRY.counter(
+    "redeem_batch_items_total", "/redeem/batch items by outcome", ["outcome"])
+
+POLL_INTERVAL = 0.5
+
+# a waiting batch holds one of a gunicorn worker's threads, so app.py waits at
+# most this long, well below GUNICORN_TIMEOUT; asgi_app.py waits on a coroutine
+THREAD_WAIT_SECONDS = 15
+
+
+def partner_authorized(authorization, settings):
+    """True if an Authorization header carries the admin token or a partner token"""
+    tokens = settings.partner_api_tokens + ((settings.admin_api_token,) if settings.admin_api_token else ())
+    # compare against every token, so the time taken doesn't tell which one was close
+    matches = [hmac.compare_digest(authorization or "", f"Bearer {token}") for token in tokens]
+    return any(matches)
+
+
+def parse_batch(data, max_items):
+    """(items, None) for a valid request body, or (None, (message, HTTP status))"""
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, ('Request body must be {"items": [...]} with at least one item', 400)
+    if len(items) > max_items:
+        return None, (f"At most {max_items} items per batch, got {len(items)}", 413)
+    return items, None
+
+
+def _valid_item(item):
+    return isinstance(item, dict) and all(isinstance(item.get(name), str) and item.get(name)
+                                          for name in ("code", "recipient_email", "recipient_phone"))
+
+
+class BatchRedemption:
+    """The state of one /redeem/batch request, from redemption to the lines streamed back"""
+
+    def __init__(self, items, error_status, request_id=None):
+        self.items = items
+        self.error_status = error_status  # RedeemError reason -> HTTP status, as for /redeem
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.lines = [None] * len(items)
+        self.valid = []
+        self.waiting = {}  # item index -> job ids not finished yet
+        self.finished = {SUCCEEDED: 0, "failed": 0}
+        self._queued = []
+        for i, item in enumerate(items):
+            if _valid_item(item):
+                self.valid.append(i)
+            else:
+                code = item.get("code") if isinstance(item, dict) else None
+                self._reject(i, code, "invalid_request", "Missing code or recipient information", 400)
+
+    def _reject(self, i, code, reason, message, status):
+        BATCH_ITEMS.inc(outcome=reason)
+        self.lines[i] = {"type": "redeem", "index": i, "code": code, "success": False, "status": status,
+                         "reason": reason, "message": message}
+
+    def to_redeem(self):
+        return [self.items[i] for i in self.valid]
+
+    def redeemed(self, outcomes, settings):
+        """Take redeem_codes outcomes (in to_redeem order); returns the [(code, payloads)] to queue"""
+        code_payloads = []
+        for i, outcome in zip(self.valid, outcomes):
+            item = self.items[i]
+            if isinstance(outcome, RedeemError):
+                self._reject(i, item["code"], outcome.reason, str(outcome), self.error_status[outcome.reason])
+                continue
+            amount = card_value(outcome, settings.gift_card_amount)
+            payloads = purchase_payloads(item["code"], item["recipient_email"], item["recipient_phone"],
+                                         settings.denomination_table.split(amount), self.request_id)
+            code_payloads.append((item["code"], payloads))
+            self._queued.append((i, amount, len(payloads)))
+        return code_payloads
+
+    def queued(self, job_ids_per_code):
+        """Take the job ids from FulfillmentQueue.enqueue_codes"""
+        for (i, amount, cards), job_ids in zip(self._queued, job_ids_per_code):
+            code = self.items[i]["code"]
+            BATCH_ITEMS.inc(outcome="redeemed")
+            self.lines[i] = {"type": "redeem", "index": i, "code": code, "success": True, "status": 202,
+                             "message": redeemed_message(code, amount, cards), "job_id": job_ids[0],
+                             "job_ids": job_ids}
+            self.waiting[i] = job_ids
+
+    def failed(self, error):
+        """Every item still unanswered gets a server error, e.g. when redeem_codes raised"""
+        for i in range(len(self.items)):
+            if self.lines[i] is None:
+                self._reject(i, self.items[i].get("code"), "error", f"Server error: {error}", 500)
+
+    def waiting_job_ids(self):
+        return [job_id for job_ids in self.waiting.values() for job_id in job_ids]
+
+    def fulfillment_lines(self, statuses):
+        """Lines for the codes whose jobs have all finished, given FulfillmentQueue.statuses"""
+        lines = []
+        for i, job_ids in list(self.waiting.items()):
+            job_statuses = [statuses.get(job_id) for job_id in job_ids]
+            if any(status in (PENDING, RUNNING) for status in job_statuses):
+                continue
+            del self.waiting[i]
+            outcome = SUCCEEDED if all(status == SUCCEEDED for status in job_statuses) else "failed"
+            self.finished[outcome] += 1
+            lines.append({"type": "fulfillment", "index": i, "code": self.items[i]["code"], "status": outcome,
+                          "job_ids": job_ids})
+        return lines
+
+    def summary(self):
+        redeemed = sum(1 for line in self.lines if line["success"])
+        return {"type": "summary", "items": len(self.items), "redeemed": redeemed,
+                "rejected": len(self.items) - redeemed, "fulfilled": self.finished[SUCCEEDED],
+                "fulfillment_failed": self.finished["failed"], "fulfillment_pending": len(self.waiting),
+                "seconds": round(time.perf_counter() - self.started, 3)}
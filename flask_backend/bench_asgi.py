@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from fake_supabase import FakeSupabaseClient
+from generate_codes import generate_gift_code
+from upstream_fakes import cleancloud_app, postgrest_app, serve_in_process
+
+# Load test of /redeem on the Flask server (app.py) vs the ASGI server (asgi_app.py),
+# both talking to the HTTP fakes in upstream_fakes.py instead of Supabase/CleanCloud.
+#
+#   python bench_asgi.py                                   # 2000 requests, 100 concurrent
+#   python bench_asgi.py --concurrency 50 200 500 --supabase-latency 0.05
+#   python bench_asgi.py --servers asgi --json results.json
+#
+# Every request is a distinct, valid code, so each one does the full
+# redeem RPC + enqueue; purchases are sent to the fake CleanCloud by each
+# server's fulfillment workers while the test runs.
+
+SERVERS = {
+    "flask": [sys.executable, "app.py"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+             "--log-level", "warning", "--no-access-log"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, env, timeout=30):
+    port = free_port()
+    command = SERVERS[name] + (["--port", str(port)] if name == "asgi" else [])
+    process = subprocess.Popen(command, env=dict(env, PORT=str(port)),
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} server exited with {process.returncode}")
+        try:
+            httpx.get(f"{url}/metrics", timeout=1)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{name} server did not start")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_load(url, codes, concurrency):
+    latencies = []
+    statuses = {}
+    pending = iter(codes)
+
+    async with httpx.AsyncClient(base_url=url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def user():
+            for code in pending:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/redeem", json={
+                        "code": code, "recipient_email": "bench@example.com", "recipient_phone": "+6500000000"})
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda item: str(item[0]))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask vs ASGI /redeem load test against fake upstreams")
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=["flask", "asgi"])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[100])
+    parser.add_argument("--supabase-latency", type=float, default=0.02, help="seconds per redeem RPC")
+    parser.add_argument("--cleancloud-latency", type=float, default=0.3, help="seconds per gift card purchase")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    store = FakeSupabaseClient()
+    runs = [(server, concurrency) for concurrency in args.concurrency for server in args.servers]
+    codes = [[generate_gift_code() for _ in range(args.requests)] for _ in runs]
+    for batch in codes:
+        store.upload_codes(batch)
+
+    postgrest = serve_in_process(postgrest_app(store, latency=args.supabase_latency))
+    cleancloud = serve_in_process(cleancloud_app(latency=args.cleancloud_latency))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for (server, concurrency), batch in zip(runs, codes):
+            env = dict(os.environ,
+                       SUPABASE_URL=postgrest.url, SUPABASE_KEY="bench",
+                       CLEANCLOUD_API_TOKEN="bench", CLEANCLOUD_API_URL=f"{cleancloud.url}/api/",
+                       CLEANCLOUD_POOL_SIZE=str(max(10, concurrency)),
+                       FULFILLMENT_QUEUE_PATH=os.path.join(tmp, f"{server}_{concurrency}.db"),
+                       CODE_INDEX_ENABLED="false", LOG_LEVEL="WARNING", RATE_LIMIT_BACKEND="none")
+            process, url = start_server(server, env)
+            try:
+                result = asyncio.run(run_load(url, batch, concurrency))
+            finally:
+                process.terminate()
+                process.wait(10)
+            result["server"] = server
+            results.append(result)
+            print(f"{server:>6} c={concurrency:<5} {result['requests_per_second']:>8,.1f} req/s  "
+                  f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  "
+                  f"p99 {result['p99_ms']:>7.1f} ms  {result['statuses']}")
+
+    postgrest.stop()
+    cleancloud.stop()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({
+                "requests": args.requests,
+                "supabase_latency": args.supabase_latency,
+                "cleancloud_latency": args.cleancloud_latency,
+                "results": results,
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import random
+import sys
+import time
+from code_index import CodeBloomFilter
+from generate_codes import generate_gift_code
+
+# Benchmark the code index against a plain Python set of codes.
+#   python bench_code_index.py --codes 1000000
+#   python bench_code_index.py --codes 5000000 --error-rate 0.0001
+
+
+def set_memory_bytes(codes_set):
+    return sys.getsizeof(codes_set) + sum(sys.getsizeof(code) for code in codes_set)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bloom filter code index benchmark")
+    parser.add_argument("--codes", type=int, default=1_000_000, help="number of codes in the index")
+    parser.add_argument("--probes", type=int, default=200_000, help="lookups per measurement")
+    parser.add_argument("--error-rate", type=float, default=0.001, help="target false positive rate")
+    args = parser.parse_args()
+
+    print(f"Generating {args.codes:,} codes...")
+    started = time.perf_counter()
+    codes = set()
+    while len(codes) < args.codes:
+        codes.add(generate_gift_code())
+    codes = list(codes)
+    print(f"  {time.perf_counter() - started:.1f}s")
+
+    bloom = CodeBloomFilter(args.codes, args.error_rate)
+    started = time.perf_counter()
+    for code in codes:
+        bloom.add(code)
+    build_seconds = time.perf_counter() - started
+
+    members = random.sample(codes, min(args.probes, len(codes)))
+    started = time.perf_counter()
+    false_negatives = sum(1 for code in members if code not in bloom)
+    member_seconds = time.perf_counter() - started
+
+    codes_set = set(codes)
+    strangers = []
+    while len(strangers) < args.probes:
+        code = generate_gift_code()
+        if code not in codes_set:
+            strangers.append(code)
+    started = time.perf_counter()
+    false_positives = sum(1 for code in strangers if code in bloom)
+    stranger_seconds = time.perf_counter() - started
+
+    stats = bloom.stats()
+    set_bytes = set_memory_bytes(codes_set)
+    print()
+    print(f"codes:                 {args.codes:,}")
+    print(f"bits / hashes:         {stats['num_bits']:,} / {stats['num_hashes']}")
+    print(f"bloom memory:          {stats['memory_bytes'] / 1e6:.1f} MB ({stats['bytes_per_code']} bytes/code)")
+    print(f"python set memory:     {set_bytes / 1e6:.1f} MB ({set_bytes / args.codes:.1f} bytes/code)")
+    print(f"build:                 {build_seconds:.2f}s ({args.codes / build_seconds:,.0f} codes/s)")
+    print(f"member lookups:        {member_seconds / len(members) * 1e6:.2f} us/lookup, {false_negatives} false negatives")
+    print(f"unknown-code lookups:  {stranger_seconds / len(strangers) * 1e6:.2f} us/lookup")
+    print(f"false positive rate:   measured {false_positives / len(strangers):.5f}, "
+          f"estimated {stats['estimated_false_positive_rate']:.5f}, target {args.error_rate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+
+# Benchmark the expiry sweeper and the status-based redeem path on a local
+# Postgres with a multi-million-row gift_codes fixture.
+#
+#   pip install "psycopg[binary]"
+#   DATABASE_URL=postgresql://postgres@localhost/postgres python bench_expiry.py --rows 5000000
+#   python bench_expiry.py --rows 2000000 --chunk 50000 --single
+#
+# The fixture lives in its own schema (bench_expiry, dropped first) and the
+# repo's sql/ files are applied to it unchanged. Reported:
+#   - finding the sweep range through the partial index vs. a date scan
+#   - the chunked sweep: total time and per-chunk latency (how long row locks are held)
+#   - redeem_gift_code latency on valid codes from another connection while the sweep runs
+#   - redeem_gift_code latency for valid, expired and already redeemed codes afterwards
+# --single also times one unchunked UPDATE over the same rows for comparison.
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql")
+SQL_FILES = ("fulfillment_status.sql", "code_status.sql", "redeem_gift_code.sql")
+SCHEMA = "bench_expiry"
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+
+def sql_statements(source):
+    """Split a sql/ file into statements, keeping $$ function bodies whole"""
+    statements, current, in_body = [], [], False
+    for line in source.splitlines():
+        if not current and (not line.strip() or line.lstrip().startswith("--")):
+            continue
+        current.append(line)
+        if line.count("$$") % 2:
+            in_body = not in_body
+        if not in_body and line.rstrip().endswith(";"):
+            statements.append("\n".join(current))
+            current = []
+    return statements
+
+
+def connect(dsn):
+    return psycopg.connect(dsn, autocommit=True, options=f"-c search_path={SCHEMA}")
+
+
+def build_fixture(conn, rows, expired_fraction, redeemed_fraction):
+    conn.execute(f"drop schema if exists {SCHEMA} cascade")
+    conn.execute(f"create schema {SCHEMA}")
+    conn.execute("""
+        create table gift_codes (
+            code text primary key,
+            serial_number bigint generated by default as identity unique,
+            uploaded_at timestamptz not null default now(),
+            expiry_date date,
+            distributed_to text,
+            distributed_at timestamptz,
+            is_redeemed boolean not null default false,
+            redeemed_at timestamptz,
+            recipient_email text,
+            recipient_phone text,
+            metadata jsonb,
+            card_value numeric
+        )""")
+    # expiry dates are set per block of 1000 serials, the way batch_operations.py sets them
+    conn.execute("""
+        insert into gift_codes (code, serial_number, expiry_date, is_redeemed, redeemed_at)
+        select code, s, expiry_date, redeemed, case when redeemed then now() end
+          from (select 'BENCH' || lpad(s::text, 10, '0') as code, s,
+                       case when abs(hashint8(s / 1000)) %% 1000 < %(expired)s * 1000
+                            then current_date - 30 else current_date + 365 end as expiry_date,
+                       random() < %(redeemed)s as redeemed
+                  from generate_series(1, %(rows)s) as s) fixture""",
+                 {"rows": rows, "expired": expired_fraction, "redeemed": redeemed_fraction})
+    for name in SQL_FILES:
+        with open(os.path.join(SQL_DIR, name), "r") as file:
+            for statement in sql_statements(file.read()):
+                conn.execute(statement)
+    # codes redeemed before the migration
+    conn.execute("update gift_codes set status = 'redeemed' where is_redeemed")
+    conn.execute("vacuum analyze gift_codes")
+
+
+def timed(conn, query, params=None):
+    started = time.perf_counter()
+    result = conn.execute(query, params).fetchone()
+    return time.perf_counter() - started, result
+
+
+def percentiles(samples):
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+
+    return (f"n={len(samples):,} p50={pick(0.5):.2f}ms p99={pick(0.99):.2f}ms "
+            f"max={samples[-1] * 1000:.2f}ms mean={statistics.mean(samples) * 1000:.2f}ms")
+
+
+class Redeemer(threading.Thread):
+    """Redeems valid codes on its own connection until stopped, recording latencies"""
+
+    def __init__(self, dsn, codes):
+        super().__init__(daemon=True)
+        self.conn = connect(dsn)
+        self.codes = codes
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        for code in self.codes:
+            if self.stop.is_set():
+                break
+            seconds, _ = timed(self.conn, "select redeem_gift_code(%s, 'bench@example.com', '00000000')", (code,))
+            self.latencies.append(seconds)
+
+
+def sweep_chunks(conn, first, last, chunk):
+    latencies, marked = [], 0
+    for start in range(first, last + 1, chunk):
+        seconds, (count,) = timed(conn, "select sweep_code_status(%s, %s)", (start, min(start + chunk - 1, last)))
+        latencies.append(seconds)
+        marked += count
+    return marked, latencies
+
+
+def sample_codes(conn, where, n):
+    rows = conn.execute(f"select code from gift_codes where {where} order by random() limit %s", (n,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expiry sweeper benchmark on a local Postgres")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="Postgres URL (default: $DATABASE_URL)")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="gift_codes rows in the fixture")
+    parser.add_argument("--expired", type=float, default=0.2, help="fraction of codes past their expiry date")
+    parser.add_argument("--redeemed", type=float, default=0.3, help="fraction of codes already redeemed")
+    parser.add_argument("--chunk", type=int, default=10000, help="serials per sweep_code_status call")
+    parser.add_argument("--probes", type=int, default=2000, help="redemptions timed per code kind")
+    parser.add_argument("--single", action="store_true", help="also time one unchunked sweep")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    if psycopg is None:
+        parser.error('psycopg is required: pip install "psycopg[binary]"')
+    if not args.dsn:
+        parser.error("pass --dsn or set DATABASE_URL")
+
+    conn = connect(args.dsn)
+    print(f"Building {args.rows:,} row fixture in schema {SCHEMA}...")
+    started = time.perf_counter()
+    build_fixture(conn, args.rows, args.expired, args.redeemed)
+    print(f"  {time.perf_counter() - started:.1f}s")
+
+    seconds, (found,) = timed(conn, "select expired_code_range()")
+    print(f"\nsweep range via partial index: {seconds * 1000:.1f}ms -> {found}")
+    seconds, (count,) = timed(conn, "select count(*) from gift_codes where not is_redeemed and expiry_date < current_date")
+    print(f"same count via date predicate: {seconds * 1000:.1f}ms -> {count:,}")
+
+    redeemer = Redeemer(args.dsn, sample_codes(conn, "status = 'available' and expiry_date >= current_date",
+                                               args.probes * 10))
+    redeemer.start()
+    time.sleep(1)
+    idle = list(redeemer.latencies)
+    started = time.perf_counter()
+    marked, chunk_latencies = sweep_chunks(conn, found["min"], found["max"], args.chunk)
+    sweep_seconds = time.perf_counter() - started
+    during = redeemer.latencies[len(idle):]
+    redeemer.stop.set()
+    redeemer.join()
+
+    print(f"\nchunked sweep ({args.chunk:,} serials/chunk): {marked:,} codes marked in {sweep_seconds:.2f}s "
+          f"({marked / max(sweep_seconds, 1e-9):,.0f} codes/s)")
+    print(f"  per chunk:             {percentiles(chunk_latencies)}")
+    print(f"  redeem before sweep:   {percentiles(idle)}")
+    print(f"  redeem during sweep:   {percentiles(during)}")
+
+    print("\nredeem_gift_code after the sweep:")
+    for kind, where in (("valid", "status = 'available' and expiry_date >= current_date"),
+                        ("expired", "status = 'expired'"),
+                        ("redeemed", "status = 'redeemed'")):
+        codes = sample_codes(conn, where, args.probes)
+        random.shuffle(codes)
+        latencies = [timed(conn, "select redeem_gift_code(%s, 'bench@example.com', '00000000')", (code,))[0]
+                     for code in codes]
+        print(f"  {kind:9} {percentiles(latencies)}")
+
+    if args.single:
+        conn.execute("update gift_codes set status = 'available' where status = 'expired'")
+        conn.execute("vacuum analyze gift_codes")
+        _, (found,) = timed(conn, "select expired_code_range()")
+        seconds, (count,) = timed(conn, "select sweep_code_status(%s, %s)", (found["min"], found["max"]))
+        print(f"\nunchunked sweep: {count:,} codes marked in one {seconds:.2f}s transaction")
+
+    if not args.keep:
+        conn.execute(f"drop schema {SCHEMA} cascade")
+
+
+if __name__ == "__main__":
+    main()
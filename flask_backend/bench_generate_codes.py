@@ -0,0 +1,50 @@
+import argparse
+import os
+import tempfile
+import time
+from generate_codes import generate_gift_cards, generate_gift_code
+
+# Benchmark code generation into an empty directory.
+#   python bench_generate_codes.py                     # 1M and 10M codes
+#   python bench_generate_codes.py --counts 1000000 --check-character
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gift code generator benchmark")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--check-character", action="store_true", help="append a check character")
+    parser.add_argument("--per-code-sample", type=int, default=100_000,
+                        help="codes generated one at a time with generate_gift_code, for comparison")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(args.per_code_sample):
+        generate_gift_code()
+    per_code = (time.perf_counter() - started) / args.per_code_sample
+    print(f"generate_gift_code one at a time: {1 / per_code:,.0f} codes/s")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.counts:
+            csv_file = os.path.join(tmp, f"codes_{count}.csv")
+            index_file = os.path.join(tmp, f"codes_{count}.idx")
+            started = time.perf_counter()
+            generate_gift_cards(count, csv_file, index_file, add_check_character=args.check_character)
+            fresh = time.perf_counter() - started
+
+            # a second run of the same size has to dedupe against everything written so far
+            started = time.perf_counter()
+            generate_gift_cards(count, csv_file, index_file, add_check_character=args.check_character)
+            append = time.perf_counter() - started
+
+            results.append((count, fresh, append, os.path.getsize(csv_file), os.path.getsize(index_file)))
+
+    print()
+    print(f"{'codes':>12} {'fresh s':>9} {'codes/s':>12} {'append s':>9} {'codes/s':>12} {'csv MB':>8} {'index MB':>9}")
+    for count, fresh, append, csv_size, index_size in results:
+        print(f"{count:>12,} {fresh:>9.2f} {count / fresh:>12,.0f} {append:>9.2f} {count / append:>12,.0f} "
+              f"{csv_size / 1e6:>8.1f} {index_size / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
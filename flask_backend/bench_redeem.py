@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+from datetime import date, timedelta, timezone, datetime
+import httpx
+from bench_asgi import SERVERS, percentile, start_server
+from fake_supabase import FakeSupabaseClient
+from generate_codes import generate_gift_code
+from supabase_tool import expiry_values
+from upstream_fakes import cleancloud_app, postgrest_app, serve_in_process
+
+# End-to-end /redeem benchmark. Boots the server (app.py by default) against
+# local fakes of PostgREST and CleanCloud, sends a mix of valid, invalid,
+# duplicate and expired codes at a fixed request rate, waits for the
+# fulfillment queue to drain, and writes throughput, latency percentiles and
+# upstream calls per redemption to bench_results/ as JSON.
+#
+#   python bench_redeem.py                                # Flask, 200 req/s for 20 s
+#   python bench_redeem.py --rps 500 --duration 60 --profile slow
+#   python bench_redeem.py --server asgi --mix valid=0.5,duplicate=0.5
+#   python bench_redeem.py --compare bench_results/redeem-flask-1a2b3c4.json
+#
+# Requests are scheduled open-loop (one every 1/rps seconds whether or not the
+# previous ones finished) and latency is measured from the scheduled send time,
+# so a server that falls behind shows it in the percentiles.
+
+# upstream latency (seconds), jitter (extra 0..jitter seconds) and failure rates
+PROFILES = {
+    "fast": {"supabase": {"latency": 0.005, "jitter": 0.005, "error_rate": 0.0},
+             "cleancloud": {"latency": 0.05, "jitter": 0.05, "error_rate": 0.0, "decline_rate": 0.0}},
+    "normal": {"supabase": {"latency": 0.02, "jitter": 0.02, "error_rate": 0.0},
+               "cleancloud": {"latency": 0.3, "jitter": 0.2, "error_rate": 0.0, "decline_rate": 0.02}},
+    "slow": {"supabase": {"latency": 0.1, "jitter": 0.2, "error_rate": 0.01},
+             "cleancloud": {"latency": 1.0, "jitter": 1.0, "error_rate": 0.02, "decline_rate": 0.05}},
+    "flaky": {"supabase": {"latency": 0.02, "jitter": 0.05, "error_rate": 0.05},
+              "cleancloud": {"latency": 0.3, "jitter": 0.3, "error_rate": 0.1, "decline_rate": 0.1}},
+}
+
+DEFAULT_MIX = "valid=0.6,invalid=0.2,duplicate=0.15,expired=0.05"
+KINDS = ("valid", "invalid", "duplicate", "expired")
+RESULTS_DIR = "bench_results"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown code kind '{kind}', expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class CodePicker:
+    """Picks the next request's (kind, code) following the mix"""
+
+    def __init__(self, mix, valid_codes, expired_codes, seed=None):
+        self.random = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.valid = iter(valid_codes)
+        self.expired = expired_codes
+        self.sent = []  # valid codes already posted, duplicates come from the most recent ones
+
+    def __call__(self):
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        if kind == "duplicate" and not self.sent:
+            kind = "valid"
+        if kind == "valid":
+            code = next(self.valid)
+            self.sent.append(code)
+        elif kind == "duplicate":
+            # recent codes, so some duplicates race the original request
+            code = self.random.choice(self.sent[-20:])
+        elif kind == "expired":
+            code = self.random.choice(self.expired)
+        else:
+            code = generate_gift_code()
+        return kind, code
+
+
+async def run_load(url, pick, rps, duration, max_in_flight):
+    latencies = {kind: [] for kind in KINDS}
+    statuses = {kind: {} for kind in KINDS}
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    async with httpx.AsyncClient(base_url=url, timeout=60,
+                                 limits=httpx.Limits(max_connections=max_in_flight)) as client:
+        async def send(kind, code, scheduled):
+            async with in_flight:
+                try:
+                    response = await client.post("/redeem", json={
+                        "code": code, "recipient_email": "bench@example.com", "recipient_phone": "+6500000000"})
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+            latencies[kind].append(time.perf_counter() - scheduled)
+            statuses[kind][status] = statuses[kind].get(status, 0) + 1
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(int(rps * duration)):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, code = pick()
+            tasks.append(asyncio.create_task(send(kind, code, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return latencies, statuses, elapsed
+
+
+def summarize(latencies, statuses):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def scrape_metrics(url):
+    """Samples from the server's /metrics as {name{labels}: value}"""
+    samples = {}
+    for line in httpx.get(f"{url}/metrics", timeout=10).text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def wait_for_code_index(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = httpx.get(f"{url}/admin/code-index", headers={"Authorization": "Bearer bench"}, timeout=10)
+        if response.status_code == 404 or response.json()["code_index"]["ready"]:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("Code index was not built in time")
+
+
+def wait_for_fulfillment(url, timeout):
+    """Wait until no fulfillment job is pending or running; returns False on timeout"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        samples = scrape_metrics(url)
+        busy = sum(samples.get(f'fulfillment_queue_jobs{{status="{status}"}}', 0) for status in ("pending", "running"))
+        if not busy:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def upstream_calls(before, after):
+    return {name: after.get(name, 0) - before.get(name, 0) for name in after if after.get(name, 0) != before.get(name, 0)}
+
+
+def labelled(samples, metric):
+    """{label values joined by ",": value} for one metric's samples"""
+    values = {}
+    for name, value in samples.items():
+        if name.startswith(metric + "{"):
+            values[",".join(re.findall(r'="([^"]*)"', name))] = value
+    return values
+
+
+def compare(result, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}):")
+    rows = [("throughput req/s", "throughput_rps"), ("p50 ms", "p50_ms"), ("p95 ms", "p95_ms"), ("p99 ms", "p99_ms")]
+    for label, key in rows:
+        old, new = baseline["overall"][key], result["overall"][key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {label:<18} {old:>10,.1f} -> {new:>10,.1f}  {change}")
+    for key in ("supabase_rpc_per_request", "cleancloud_calls_per_redemption"):
+        print(f"  {key:<34} {baseline['upstream'].get(key)} -> {result['upstream'].get(key)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/redeem benchmark against local upstream fakes")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    parser.add_argument("--rps", type=float, default=200, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"code kinds and weights (default {DEFAULT_MIX})")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="normal", help="upstream latency/failures")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="client-side connection limit")
+    parser.add_argument("--codes", type=int, default=100_000, help="codes in the fake database besides the test ones")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for gift card purchases")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the request mix")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra server environment, e.g. --env CODE_INDEX_ENABLED=false")
+    parser.add_argument("--json", help=f"result file (default {RESULTS_DIR}/redeem-<server>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    total_requests = int(args.rps * args.duration)
+    valid_needed = int(total_requests * args.mix.get("valid", 0) / sum(args.mix.values())) + total_requests // 10 + 100
+
+    store = FakeSupabaseClient()
+    store.upload_codes(generate_gift_code() for _ in range(args.codes))
+    valid_codes = [generate_gift_code() for _ in range(valid_needed)]
+    store.upload_codes(valid_codes)
+    expired_codes = [generate_gift_code() for _ in range(1000)]
+    expired_rows = store.upload_codes(expired_codes)
+    store.update_range(expired_rows[0]["serial_number"], expired_rows[-1]["serial_number"],
+                       expiry_values(date.today() - timedelta(days=1)))
+
+    postgrest = serve_in_process(postgrest_app(store, **profile["supabase"]))
+    cleancloud = serve_in_process(cleancloud_app(**profile["cleancloud"]))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   SUPABASE_URL=postgrest.url, SUPABASE_KEY="bench", ADMIN_API_TOKEN="bench",
+                   CLEANCLOUD_API_TOKEN="bench", CLEANCLOUD_API_URL=f"{cleancloud.url}/api/",
+                   FULFILLMENT_QUEUE_PATH=os.path.join(tmp, "fulfillment_queue.db"), LOG_LEVEL="WARNING",
+                   RATE_LIMIT_BACKEND="none")
+        env.update(item.split("=", 1) for item in args.env)
+        process, url = start_server(args.server, env)
+        try:
+            wait_for_code_index(url)
+            calls_before = {"supabase": httpx.get(f"{postgrest.url}/_calls").json(),
+                            "cleancloud": httpx.get(f"{cleancloud.url}/_calls").json()}
+            picker = CodePicker(args.mix, valid_codes, expired_codes, seed=args.seed)
+            latencies, statuses, elapsed = asyncio.run(
+                run_load(url, picker, args.rps, args.duration, args.max_in_flight))
+            drained = wait_for_fulfillment(url, args.drain_timeout)
+            samples = scrape_metrics(url)
+            calls = {"supabase": upstream_calls(calls_before["supabase"], httpx.get(f"{postgrest.url}/_calls").json()),
+                     "cleancloud": upstream_calls(calls_before["cleancloud"],
+                                                  httpx.get(f"{cleancloud.url}/_calls").json())}
+        finally:
+            process.terminate()
+            process.wait(10)
+    postgrest.stop()
+    cleancloud.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    all_statuses = {}
+    for kind_statuses in statuses.values():
+        for status, count in kind_statuses.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+    overall = summarize(all_latencies, all_statuses)
+    overall["seconds"] = round(elapsed, 3)
+    overall["throughput_rps"] = round(len(all_latencies) / elapsed, 1)
+
+    redemptions = all_statuses.get("202", 0)
+    rpc_calls = calls["supabase"].get("POST /rest/v1/rpc/redeem_gift_code", 0)
+    purchase_calls = calls["cleancloud"].get("POST /api/giftCardBuy", 0)
+    result = {
+        "benchmark": "redeem",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "server": args.server, "rps": args.rps, "duration": args.duration, "mix": args.mix,
+            "profile": args.profile, "upstreams": profile, "codes": args.codes, "seed": args.seed,
+            "env": args.env,
+        },
+        "overall": overall,
+        "by_kind": {kind: summarize(latencies[kind], statuses[kind]) for kind in KINDS if latencies[kind]},
+        "upstream": {
+            "calls": calls,
+            "supabase_rpc_per_request": round(rpc_calls / len(all_latencies), 3) if all_latencies else None,
+            "cleancloud_calls_per_redemption": round(purchase_calls / redemptions, 3) if redemptions else None,
+            "fulfillment_drained": drained,
+        },
+        "redeem_decided_by": labelled(samples, "gift_code_redeem_total"),
+        "fulfillment_jobs": labelled(samples, "fulfillment_jobs_total"),
+    }
+
+    print(f"{args.server} @ {args.rps:g} req/s for {args.duration:g}s, profile {args.profile}, commit {result['commit']}")
+    print(f"  overall   {overall['throughput_rps']:>8,.1f} req/s  p50 {overall['p50_ms']:>7.1f} ms  "
+          f"p95 {overall['p95_ms']:>7.1f} ms  p99 {overall['p99_ms']:>7.1f} ms  {overall['statuses']}")
+    for kind, summary in result["by_kind"].items():
+        print(f"  {kind:<9} {summary['requests']:>8} req    p50 {summary['p50_ms']:>7.1f} ms  "
+              f"p95 {summary['p95_ms']:>7.1f} ms  p99 {summary['p99_ms']:>7.1f} ms  {summary['statuses']}")
+    print(f"  upstream: {result['upstream']['supabase_rpc_per_request']} redeem RPCs per request, "
+          f"{result['upstream']['cleancloud_calls_per_redemption']} CleanCloud calls per redemption"
+          + ("" if drained else " (fulfillment queue not drained)"))
+
+    path = args.json or os.path.join(RESULTS_DIR, f"redeem-{args.server}-{result['commit']}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"  results written to {path}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+# Build the redeem page for production: minify, fingerprint and precompress.
+#
+#   python build_static.py                   # ../frontend -> ../frontend/dist
+#   python build_static.py --clean
+#
+# redeem.css and redeem.js are minified and written as redeem.<hash>.css/.js,
+# where the hash is of the content, so they can be cached forever: a changed
+# file gets a new name. The HTML pages are rewritten to point at those names.
+# Every file also gets a .gz variant, and a .br variant when the brotli package
+# is installed (pip install brotli). dist/manifest.json maps source names to
+# built names. Hashed files from earlier builds are kept unless --clean, so
+# pages cached before a deploy can still load their assets.
+#
+# static_assets.py serves dist/ from memory; nginx or a CDN can serve it directly.
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend")
+ASSETS = ("redeem.css", "redeem.js")
+PAGES = ("redeem.html", "index.html")
+HASH_LENGTH = 10
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def minify_css(source):
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+    source = re.sub(r"\s+", " ", source)
+    # no space before ":", which would turn "a :hover" into "a:hover"
+    source = re.sub(r"\s*([{};,>])\s*", r"\1", source)
+    source = re.sub(r":\s+", ":", source)
+    return source.replace(";}", "}").strip()
+
+
+# after these characters a "/" starts a regex literal rather than a division
+_REGEX_PREFIX = set("(,=:[!&|?{;+-*%<>~^")
+
+
+def _strip_js_comments(source):
+    out = []
+    last = ""  # last non-space character copied
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in "'\"`":
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == "\\" else 1
+            out.append(source[i:j + 1])
+            last, i = c, j + 1
+        elif source.startswith("//", i):
+            j = source.find("\n", i)
+            i = n if j < 0 else j
+        elif source.startswith("/*", i):
+            j = source.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+        elif c == "/" and (last == "" or last in _REGEX_PREFIX):
+            j, in_class = i + 1, False
+            while j < n and (source[j] != "/" or in_class):
+                if source[j] == "\\":
+                    j += 1
+                elif source[j] == "[":
+                    in_class = True
+                elif source[j] == "]":
+                    in_class = False
+                j += 1
+            out.append(source[i:j + 1])
+            last, i = "/", j + 1
+        else:
+            out.append(c)
+            if not c.isspace():
+                last = c
+            i += 1
+    return "".join(out)
+
+
+def minify_js(source):
+    """Drop comments, indentation and blank lines
+
+    Line breaks are kept, so automatic semicolon insertion works as before.
+    Not a full parser: enough for the handwritten redeem.js.
+    """
+    lines = (line.strip() for line in _strip_js_comments(source).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def minify_html(source):
+    source = re.sub(r"<!--.*?-->", "", source, flags=re.S)
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js, ".html": minify_html}
+
+
+def hashed_name(name, content):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def write_variants(dist_dir, name, content):
+    """Write name and its precompressed variants; returns {variant name: size}"""
+    variants = {name: content, name + ".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[name + ".br"] = brotli.compress(content, quality=11)
+    for variant, data in variants.items():
+        with open(os.path.join(dist_dir, variant), "wb") as file:
+            file.write(data)
+    return {variant: len(data) for variant, data in variants.items()}
+
+
+def build(frontend_dir=FRONTEND_DIR, dist_dir=None, clean=False):
+    """Build frontend_dir into dist_dir (default frontend_dir/dist); returns the manifest"""
+    dist_dir = dist_dir or os.path.join(frontend_dir, "dist")
+    os.makedirs(dist_dir, exist_ok=True)
+    if clean:
+        for name in os.listdir(dist_dir):
+            os.remove(os.path.join(dist_dir, name))
+
+    manifest, sizes = {}, {}
+    for name in ASSETS:
+        with open(os.path.join(frontend_dir, name), "r", encoding="utf-8") as file:
+            content = MINIFIERS[os.path.splitext(name)[1]](file.read()).encode("utf-8")
+        manifest[name] = hashed_name(name, content)
+        sizes.update(write_variants(dist_dir, manifest[name], content))
+
+    for name in PAGES:
+        path = os.path.join(frontend_dir, name)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as file:
+            html = file.read()
+        for asset, built in manifest.items():
+            html = re.sub(rf'(src|href)="{re.escape(asset)}"', rf'\1="{built}"', html)
+        manifest[name] = name
+        sizes.update(write_variants(dist_dir, name, minify_html(html).encode("utf-8")))
+
+    with open(os.path.join(dist_dir, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest, sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minify, fingerprint and precompress the redeem page")
+    parser.add_argument("--frontend", default=FRONTEND_DIR, help="directory with the source files")
+    parser.add_argument("--dist", help="output directory (default: <frontend>/dist)")
+    parser.add_argument("--clean", action="store_true", help="remove earlier builds first")
+    args = parser.parse_args()
+
+    manifest, sizes = build(args.frontend, args.dist, args.clean)
+    for name, size in sizes.items():
+        print(f"  {name:32} {size:>8} bytes")
+    if brotli is None:
+        print("⚠️ brotli not installed, only .gz variants written (pip install brotli)")
+    print(f"✅ Built {len(manifest)} files into {args.dist or os.path.join(args.frontend, 'dist')}")
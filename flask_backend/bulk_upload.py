@@ -0,0 +1,114 @@
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Streaming bulk upload of gift codes. Codes are read lazily from any iterable,
+# sent in fixed-size batches with several batches in flight at once, and the
+# number of rows committed so far is checkpointed to a small JSON file so a
+# crashed run resumes where it stopped. Batches are inserted with
+# "on conflict do nothing", so replaying a batch after a crash is harmless and
+# codes that already exist are counted as skipped instead of failing the run.
+
+
+class UploadCheckpoint:
+    """Highest row number below which every batch has been committed"""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.committed_rows = 0
+        if path and os.path.exists(path):
+            with open(path, "r") as file:
+                saved = json.load(file)
+            if saved.get("source") == source:
+                self.committed_rows = saved.get("committed_rows", 0)
+
+    def save(self, committed_rows):
+        self.committed_rows = committed_rows
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"source": self.source, "committed_rows": committed_rows,
+                       "updated_at": time.time()}, file)
+        os.replace(tmp_path, self.path)  # atomic, a crash never leaves a torn checkpoint
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _batches(codes, batch_size, first_row):
+    iterator = iter(codes)
+    start = first_row
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield start, batch
+        start += len(batch)
+
+
+def upload_stream(client, codes, source, batch_size=1000, max_in_flight=4,
+                  checkpoint_path=None, metadata=None, card_value=None,
+                  max_retries=3, retry_delay=2.0):
+    """Upload codes from an iterable through client.insert_codes_batch
+
+    source identifies the input (e.g. the CSV path) so a checkpoint is only
+    reused for the same file. Returns a summary dict with row counts and rows/sec.
+    """
+    checkpoint = UploadCheckpoint(checkpoint_path, source)
+    skip = checkpoint.committed_rows
+    if skip:
+        print(f"↩️ Resuming {source} after row {skip} from checkpoint {checkpoint_path}")
+
+    lock = threading.Lock()
+    done_batches = {}  # start row -> end row, for batches finished out of order
+    totals = {"rows": 0, "inserted": 0, "skipped": 0}
+    committed = [skip]
+
+    def send(start, batch):
+        for attempt in range(1, max_retries + 1):
+            try:
+                return start, len(batch), client.insert_codes_batch(batch, metadata=metadata, card_value=card_value)
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                print(f"⚠️ Batch at row {start} failed (attempt {attempt}): {e}, retrying")
+                time.sleep(retry_delay * 2 ** (attempt - 1))
+
+    def finished(start, size, inserted):
+        with lock:
+            totals["rows"] += size
+            totals["inserted"] += inserted
+            totals["skipped"] += size - inserted
+            done_batches[start] = start + size
+            # advance the checkpoint over every contiguous finished batch
+            while committed[0] in done_batches:
+                committed[0] = done_batches.pop(committed[0])
+            checkpoint.save(committed[0])
+
+    started = time.perf_counter()
+    remaining = itertools.islice(codes, skip, None)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = set()
+        for start, batch in _batches(remaining, batch_size, skip):
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(*future.result())
+            in_flight.add(executor.submit(send, start, batch))
+        for future in in_flight:
+            finished(*future.result())
+
+    elapsed = time.perf_counter() - started
+    checkpoint.clear()
+    summary = dict(totals, resumed_from=skip, seconds=round(elapsed, 3),
+                   rows_per_second=round(totals["rows"] / elapsed, 1) if elapsed > 0 else None)
+    print(f"✅ Uploaded {summary['rows']} rows from {source}: {summary['inserted']} new, "
+          f"{summary['skipped']} already existed, {summary['seconds']}s "
+          f"({summary['rows_per_second']} rows/sec)")
+    return summary
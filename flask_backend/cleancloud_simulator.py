@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import httpx
+import requests
+from cleancloud_tool import myCleancloudClient, AsyncCleancloudClient, session_options_from_env, CLEANCLOUD_SECONDS
+
+# Local stand-in for CleanCloud's giftCardBuy, so load tests and profiling
+# spend no money from the source accounts:
+#
+#   CLEANCLOUD_BACKEND=simulator        # default "api"
+#   CLEANCLOUD_SIM_LATENCY=0.3          # seconds per call
+#   CLEANCLOUD_SIM_JITTER=0.1           # up to this much extra, uniformly
+#   CLEANCLOUD_SIM_ERROR_RATE=0.01      # connect errors: the purchase certainly didn't happen
+#   CLEANCLOUD_SIM_TIMEOUT_RATE=0.001   # read timeouts after charging: it did, but the caller can't tell
+#   CLEANCLOUD_SIM_BALANCE=500          # dollars per source account, unset for unlimited
+#   CLEANCLOUD_SIM_SEED=42              # repeatable error and jitter draws
+#
+# The simulated clients replace only make_request, so account routing,
+# retries, metrics and logs are those of the real clients. An account whose
+# balance can't cover a card declines it like CleanCloud does (a 200 without
+# "Success"), and the router moves on to the next account. Balances live in
+# process memory: each server process has its own.
+
+logger = logging.getLogger(__name__)
+
+
+class CleanCloudSimulator:
+    """giftCardBuy outcomes: latency, failures and per-account balances"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0, balance=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.balance = balance
+        self._balances = {}
+        self._random = random.Random(seed)
+        self._gift_card_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def gift_card_buy(self, data):
+        """Returns ("ok", response), ("connect_error", None) or ("timeout", response)"""
+        account = data.get("customerID")
+        amount = float(data.get("amount") or 0)
+        with self._lock:
+            draw = self._random.random()
+            if draw < self.error_rate:
+                return "connect_error", None
+            if self.balance is not None:
+                remaining = self._balances.get(account, self.balance)
+                if amount > remaining:
+                    return "ok", {"Error": "Insufficient balance", "customerID": account,
+                                  "balance": round(remaining, 2)}
+                self._balances[account] = remaining - amount
+            response = {"Success": "Gift card sent", "giftCardID": next(self._gift_card_ids),
+                        "customerID": account}
+            # charged, but the answer is lost on the way back
+            if draw < self.error_rate + self.timeout_rate:
+                return "timeout", response
+            return "ok", response
+
+    def remaining(self, account):
+        if self.balance is None:
+            return None
+        with self._lock:
+            return round(self._balances.get(account, self.balance), 2)
+
+
+class SimulatedCleancloudClient(myCleancloudClient):
+    """myCleancloudClient whose requests are answered by a CleanCloudSimulator"""
+
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super().__init__("simulated", *args, **kwargs)
+
+    def _build_session(self, pool_size, keep_alive, max_retries, backoff_factor):
+        return None
+
+    def connection_stats(self):
+        return {}
+
+    def account_stats(self):
+        stats = super().account_stats()
+        for account in stats:
+            account["simulated_balance"] = self.simulator.remaining(account["account"])
+        return stats
+
+    def close(self):
+        pass
+
+    def warm_up(self):
+        pass
+
+    def make_request(self, api_suffix, data):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            time.sleep(self.simulator.delay())
+            outcome, response = self.simulator.gift_card_buy(data)
+            if outcome == "connect_error":
+                raise requests.exceptions.ConnectTimeout("Simulated connect timeout")
+            if outcome == "timeout":
+                raise requests.exceptions.ReadTimeout("Simulated read timeout")
+            result = "ok"
+            return response
+        finally:
+            CLEANCLOUD_SECONDS.observe(time.perf_counter() - started, endpoint=api_suffix,
+                                       account=data.get("customerID"), result=result)
+
+
+class AsyncSimulatedCleancloudClient(AsyncCleancloudClient):
+    """AsyncCleancloudClient whose requests are answered by a CleanCloudSimulator"""
+
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super().__init__("simulated", *args, **kwargs)
+
+    def _build_session(self, pool_size, keep_alive, max_retries, backoff_factor):
+        return None
+
+    def account_stats(self):
+        return SimulatedCleancloudClient.account_stats(self)
+
+    async def close(self):
+        pass
+
+    async def warm_up(self):
+        pass
+
+    async def make_request(self, api_suffix, data):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            await asyncio.sleep(self.simulator.delay())
+            outcome, response = self.simulator.gift_card_buy(data)
+            if outcome == "connect_error":
+                raise httpx.ConnectTimeout("Simulated connect timeout")
+            if outcome == "timeout":
+                raise httpx.ReadTimeout("Simulated read timeout")
+            result = "ok"
+            return response
+        finally:
+            CLEANCLOUD_SECONDS.observe(time.perf_counter() - started, endpoint=api_suffix,
+                                       account=data.get("customerID"), result=result)
+
+
+def simulator_from_env():
+    """A CleanCloudSimulator if CLEANCLOUD_BACKEND=simulator, else None"""
+    backend = os.getenv("CLEANCLOUD_BACKEND", "api").lower()
+    if backend not in ("api", "simulator"):
+        raise ValueError(f"CLEANCLOUD_BACKEND must be api or simulator, got '{backend}'")
+    if backend == "api":
+        return None
+    balance = os.getenv("CLEANCLOUD_SIM_BALANCE")
+    seed = os.getenv("CLEANCLOUD_SIM_SEED")
+    simulator = CleanCloudSimulator(
+        latency=float(os.getenv("CLEANCLOUD_SIM_LATENCY", "0.3")),
+        jitter=float(os.getenv("CLEANCLOUD_SIM_JITTER", "0")),
+        error_rate=float(os.getenv("CLEANCLOUD_SIM_ERROR_RATE", "0")),
+        timeout_rate=float(os.getenv("CLEANCLOUD_SIM_TIMEOUT_RATE", "0")),
+        balance=float(balance) if balance else None,
+        seed=int(seed) if seed else None,
+    )
+    logger.warning("CleanCloud simulator in use, no real gift cards are bought")
+    return simulator
+
+
+def simulated_cleancloud_from_env(source_accounts, async_client=False):
+    """The simulated client selected by CLEANCLOUD_BACKEND, or None for the real API"""
+    simulator = simulator_from_env()
+    if simulator is None:
+        return None
+    cls = AsyncSimulatedCleancloudClient if async_client else SimulatedCleancloudClient
+    return cls(simulator, print_gift_card_source_accounts=False, source_accounts=source_accounts,
+               **session_options_from_env())
@@ -1,61 +1,176 @@
-import datetime
-from enum import Enum
+import httpx
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
+import logging
 import os
-import sys
+import time
+from account_router import AccountRouter
+from config import read_source_accounts, DEFAULT_SOURCE_ACCOUNTS_FILE
+from metrics import REGISTRY
 
-gift_card_file_path = "gift_card_source_accounts.txt"
+# overridable (CLEANCLOUD_API_URL) to point at a staging or simulated CleanCloud
+DEFAULT_API_URL = "https://cleancloudapp.com/api/"
 
-def print_dict(dictionary, indentation=0):
-    for key, value in dictionary.items():
-        if value is dict:
-            print_dict(value, indentation + 1)
-        else:
-            print("\t" * indentation + f"{key}: {value}")
+logger = logging.getLogger(__name__)
+
+CLEANCLOUD_SECONDS = REGISTRY.histogram(
+    "cleancloud_request_seconds", "Latency of CleanCloud API calls", ["endpoint", "account", "result"])
+PURCHASE_ATTEMPTS = REGISTRY.counter(
+    "gift_card_purchase_attempts_total", "Gift card purchase attempts per source account", ["account", "outcome"])
+
+def request_was_sent(error):
+    """False if a make_request error shows the request never reached CleanCloud
+
+    Only then is it safe to buy again; after a read timeout, dropped
+    connection or gateway error the gift card may have been bought.
+    """
+    if isinstance(error, (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return False
+    # 503 Service Unavailable: turned away before the purchase was processed
+    response = getattr(error, "response", None)
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)) and response is not None:
+        return response.status_code != 503
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return not isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+    return True
+
+def gift_card_reference(response):
+    """CleanCloud's id for a bought gift card, if the giftCardBuy response carries one"""
+    if isinstance(response, dict):
+        for key in ("giftCardID", "GiftCardID", "id"):
+            if response.get(key) is not None:
+                return str(response[key])
+    return None
+
+def session_options_from_env():
+    """Connection pool settings for myCleancloudClient, read from the environment"""
+    return {
+        "pool_size": int(os.getenv("CLEANCLOUD_POOL_SIZE", "10")),
+        "keep_alive": os.getenv("CLEANCLOUD_KEEP_ALIVE", "true").lower() != "false",
+        "connect_timeout": float(os.getenv("CLEANCLOUD_CONNECT_TIMEOUT", "3.05")),
+        "read_timeout": float(os.getenv("CLEANCLOUD_READ_TIMEOUT", "20")),
+        "max_retries": int(os.getenv("CLEANCLOUD_MAX_RETRIES", "3")),
+        "backoff_factor": float(os.getenv("CLEANCLOUD_BACKOFF_FACTOR", "0.5")),
+        "failure_threshold": int(os.getenv("ACCOUNT_FAILURE_THRESHOLD", "3")),
+        "cooldown_seconds": float(os.getenv("ACCOUNT_COOLDOWN_SECONDS", "300")),
+        "api_url": os.getenv("CLEANCLOUD_API_URL", DEFAULT_API_URL),
+    }
 
 class myCleancloudClient:
-    GIFT_CARD_SOURCE_ACCOUNTS = []
     headers = {"Content-Type": "application/json"}
 
-    def __init__(self, API_TOKEN, print_gift_card_source_accounts=True):
+    def __init__(self, API_TOKEN, print_gift_card_source_accounts=True,
+                 pool_size=10, keep_alive=True, connect_timeout=3.05, read_timeout=20,
+                 max_retries=3, backoff_factor=0.5, failure_threshold=3, cooldown_seconds=300,
+                 api_url=DEFAULT_API_URL, source_accounts=None):
         self.API_TOKEN = API_TOKEN
-        self.API_URL = "https://cleancloudapp.com/api/"
+        self.API_URL = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._build_session(pool_size, keep_alive, max_retries, backoff_factor)
 
-        current_dir = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
+        # source_accounts is normally config.current().source_accounts; read the file for standalone use
+        if source_accounts is None:
+            try:
+                source_accounts = read_source_accounts(DEFAULT_SOURCE_ACCOUNTS_FILE)
+            except FileNotFoundError:
+                logger.error("File %s not found", DEFAULT_SOURCE_ACCOUNTS_FILE)
+                source_accounts = ()
+        self.GIFT_CARD_SOURCE_ACCOUNTS = list(source_accounts)
+        if print_gift_card_source_accounts:
+            logger.info("Gift card source accounts: %s", self.GIFT_CARD_SOURCE_ACCOUNTS)
+        else:
+            logger.info("%d gift card source accounts", len(self.GIFT_CARD_SOURCE_ACCOUNTS))
 
-        try:
-            with open(os.path.join(current_dir, gift_card_file_path), "r") as file:
-                for line in file:
-                    account_number = line.strip()
-                    # Skip empty lines and comments (lines starting with #)
-                    if account_number and not account_number.startswith('#'):
-                        self.GIFT_CARD_SOURCE_ACCOUNTS.append(account_number)
-            if print_gift_card_source_accounts:
-                print(f"Gift card source accounts loaded from {gift_card_file_path}:")
-                print("Gift card source accounts:")
-                print(self.GIFT_CARD_SOURCE_ACCOUNTS)
-            else:
-                print(f"Gift card source accounts loaded from {gift_card_file_path}, but not printed.")
-        except FileNotFoundError:
-            print(f"File {gift_card_file_path} not found")
-        
-        print()
+        self.router = AccountRouter(self.GIFT_CARD_SOURCE_ACCOUNTS,
+                                    failure_threshold=failure_threshold,
+                                    cooldown_seconds=cooldown_seconds)
+
+    def set_source_accounts(self, accounts):
+        """Swap the source accounts (on config reload); accounts that stay keep their health history"""
+        accounts = list(accounts)
+        if accounts != self.GIFT_CARD_SOURCE_ACCOUNTS:
+            self.GIFT_CARD_SOURCE_ACCOUNTS = accounts
+            self.router.set_accounts(accounts)
+            logger.info("%d gift card source accounts after reload", len(accounts))
+
+    # One session (and connection pool) is shared by every thread using this client,
+    # so purchases reuse open TLS connections instead of handshaking each time.
+    def _build_session(self, pool_size, keep_alive, max_retries, backoff_factor):
+        # Only retry failed connects, where the request never reached CleanCloud.
+        # giftCardBuy is not idempotent: after a read timeout, a 500 or a gateway's
+        # 502/504 the gift card may have been bought, so none of those are retried.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def connection_stats(self):
+        """Requests sent and how many of them opened a new connection vs reused one"""
+        requests_sent = 0
+        new_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                new_connections += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "reused_connections": requests_sent - new_connections,
+        }
+
+    def account_stats(self):
+        """Per-account success rate, latency, recent failures and cooldown"""
+        return self.router.stats()
+
+    def close(self):
+        self.session.close()
+
+    def warm_up(self):
+        """Open a pooled connection to CleanCloud (TCP and TLS) with a HEAD request, so the first purchase reuses it"""
+        self.session.head(self.API_URL, timeout=self.timeout)
 
     def make_request(self, api_suffix, data):
         data["api_token"] = self.API_TOKEN
-        response = requests.post(
-            f"{self.API_URL}{api_suffix}", json=data, headers=self.headers
-        )
-        response_body = response.text
-        response_json = json.loads(response_body)
-        return response_json
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = self.session.post(
+                f"{self.API_URL}{api_suffix}", json=data, timeout=self.timeout
+            )
+            # a 5xx body is not CleanCloud's answer, so it must not be read as a decline
+            if response.status_code >= 500:
+                response.raise_for_status()
+            response_json = response.json()
+            result = "ok"
+            return response_json
+        finally:
+            CLEANCLOUD_SECONDS.observe(time.perf_counter() - started, endpoint=api_suffix,
+                                       account=data.get("customerID"), result=result)
 
-    # The customerID is the ID of the customer that is buying the gift card which will charge their saved card.
-    def gift_card_buy(self, to_name, to_email, to_tel, 
-                      amount, send_date, send_hour, message, notify_by=2):
-        api_suffix = "giftCardBuy"
-        data = {
+    @staticmethod
+    def _gift_card_data(to_name, to_email, to_tel, amount, send_date, send_hour, message, notify_by):
+        return {
             "customerID": None,
             "toName": to_name,
             "toEmail": to_email,
@@ -67,22 +182,124 @@ class myCleancloudClient:
             "notifyBy": notify_by
         }
 
-        print(f"Attempting to buy gift card for {to_name} ({to_email}, {to_tel}) ")
-        print(f"Amount: ${amount}, Send Date: {send_date}, Send Hour: {send_hour}, Message: {message}, Notify By: {notify_by}")
+    def _purchase_errored(self, account_number, latency, e):
+        # the purchase may or may not have gone through, so the caller doesn't try another account
+        self.router.record_failure(account_number, latency, f"{type(e).__name__}: {e}")
+        PURCHASE_ATTEMPTS.inc(account=account_number, outcome="error")
+
+    def _purchase_succeeded(self, account_number, latency, response):
+        """Record one account's response; True if the gift card was bought"""
+        # if success, it should contain "Success" in the response
+        if "Success" in str(response):
+            self.router.record_success(account_number, latency)
+            PURCHASE_ATTEMPTS.inc(account=account_number, outcome="success")
+            logger.info("Gift card bought", extra={"event": "gift_card_bought", "account": account_number,
+                                                   "latency_ms": round(latency * 1000), "sample": True})
+            return True
+        self.router.record_failure(account_number, latency, response)
+        PURCHASE_ATTEMPTS.inc(account=account_number, outcome="declined")
+        logger.warning("Gift card buy failed", extra={"event": "gift_card_buy_failed", "account": account_number,
+                                                      "response": str(response)[:500]})
+        return False
+
+    # The customerID is the ID of the customer that is buying the gift card which will charge their saved card.
+    def gift_card_buy(self, to_name, to_email, to_tel, 
+                      amount, send_date, send_hour, message, notify_by=2, account_offset=0):
+        return self.purchase(to_name, to_email, to_tel, amount, send_date, send_hour, message,
+                             notify_by, account_offset)[1]
+
+    def purchase(self, to_name, to_email, to_tel,
+                 amount, send_date, send_hour, message, notify_by=2, account_offset=0):
+        """gift_card_buy that also says which account bought it: (account, response), account None if none did"""
+        api_suffix = "giftCardBuy"
+        data = self._gift_card_data(to_name, to_email, to_tel, amount, send_date, send_hour, message, notify_by)
+
+        logger.debug("Buying $%s gift card for %s, send %s %s, notify by %s",
+                     amount, to_name, send_date, send_hour, notify_by)
 
         response = "Default response before any account is tried"
-        for account_number in self.GIFT_CARD_SOURCE_ACCOUNTS:
-            print(f"Trying to buy gift card with account {account_number}")
+        # healthiest accounts first, accounts on cooldown last
+        for account_number in self.router.ordered_accounts(account_offset):
             data["customerID"] = account_number
             # Try to buy gift card with each account number
-            response = self.make_request(api_suffix, data)
-            # if success, it should contain "Success" in the response
-            if "Success" in str(response):
-                print(f"Gift card bought successfully with account {account_number}")
-                return response
-            else:
-                print(f"Gift card buy failed with account {account_number}. Response: {response}")
+            started = time.monotonic()
+            try:
+                response = self.make_request(api_suffix, data)
+            except Exception as e:
+                self._purchase_errored(account_number, time.monotonic() - started, e)
+                raise
+            if self._purchase_succeeded(account_number, time.monotonic() - started, response):
+                return account_number, response
         
         # all failed
-        print(f"Gift card buy failed with all accounts.")
-        return response
+        logger.error("Gift card buy failed with all accounts", extra={"event": "gift_card_buy_exhausted"})
+        return None, response
+
+
+class AsyncCleancloudClient(myCleancloudClient):
+    """myCleancloudClient for asyncio callers (asgi_app.py), on a pooled httpx.AsyncClient
+
+    Same accounts, router and metrics; make_request, gift_card_buy, purchase and close are coroutines.
+    httpx only retries failed connects, like myCleancloudClient's session.
+    """
+
+    def _build_session(self, pool_size, keep_alive, max_retries, backoff_factor):
+        limits = httpx.Limits(max_connections=pool_size,
+                              max_keepalive_connections=pool_size if keep_alive else 0)
+        connect_timeout, read_timeout = self.timeout
+        return httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries, limits=limits),
+            headers=self.headers,
+        )
+
+    def connection_stats(self):
+        # httpx doesn't count connections opened vs reused
+        return {}
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def warm_up(self):
+        await self.session.head(self.API_URL)
+
+    async def make_request(self, api_suffix, data):
+        data["api_token"] = self.API_TOKEN
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await self.session.post(f"{self.API_URL}{api_suffix}", json=data)
+            if response.status_code >= 500:
+                response.raise_for_status()
+            response_json = response.json()
+            result = "ok"
+            return response_json
+        finally:
+            CLEANCLOUD_SECONDS.observe(time.perf_counter() - started, endpoint=api_suffix,
+                                       account=data.get("customerID"), result=result)
+
+    async def gift_card_buy(self, to_name, to_email, to_tel,
+                            amount, send_date, send_hour, message, notify_by=2, account_offset=0):
+        return (await self.purchase(to_name, to_email, to_tel, amount, send_date, send_hour, message,
+                                    notify_by, account_offset))[1]
+
+    async def purchase(self, to_name, to_email, to_tel,
+                       amount, send_date, send_hour, message, notify_by=2, account_offset=0):
+        api_suffix = "giftCardBuy"
+        data = self._gift_card_data(to_name, to_email, to_tel, amount, send_date, send_hour, message, notify_by)
+
+        response = "Default response before any account is tried"
+        for account_number in self.router.ordered_accounts(account_offset):
+            data["customerID"] = account_number
+            started = time.monotonic()
+            try:
+                response = await self.make_request(api_suffix, data)
+            except Exception as e:
+                self._purchase_errored(account_number, time.monotonic() - started, e)
+                raise
+            if self._purchase_succeeded(account_number, time.monotonic() - started, response):
+                return account_number, response
+
+        logger.error("Gift card buy failed with all accounts", extra={"event": "gift_card_buy_exhausted"})
+        return None, response
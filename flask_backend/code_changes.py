@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+# Journal of gift_codes changes that in-process caches must hear about: codes
+# uploaded, codes reset and expiry dates changed. These are usually made by
+# the CLI tools (worker.py, bulk_upload.py, batch_operations.py), in another
+# process than the servers whose code index and outcome cache they affect.
+#
+# Writers append one JSON line per change after it is committed. Readers keep
+# a position in the file and stat it on every lookup, which costs one os.stat
+# while nothing changed; new lines are read and applied before the cache is
+# trusted again. All writers and servers must share CODE_CHANGES_PATH, i.e.
+# run on one host like the fulfillment queue. Changes made any other way (the
+# SQL editor, another host) are only seen by the periodic refresh.
+#
+# The file only grows, by one short line per upload batch, reset or range
+# update; it can be deleted while the servers are running, which makes every
+# reader assume that everything changed.
+
+DEFAULT_CODE_CHANGES_PATH = "code_changes.log"
+
+# change kinds
+UPLOADED = "uploaded"  # after_serial: every inserted row has a larger serial_number
+RESET = "reset"        # codes: redeemable again
+EXPIRY = "expiry"      # start_serial, end_serial: expiry date changed
+
+
+class CodeChanges:
+
+    def __init__(self, path=DEFAULT_CODE_CHANGES_PATH):
+        self.path = path
+        open(path, "ab").close()
+
+    def record(self, kind, **fields):
+        line = (json.dumps({"kind": kind, **fields}) + "\n").encode()
+        # one write() in append mode, so lines of concurrent writers never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def position(self):
+        """(inode, size) of the journal, None if it was deleted"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def read(self, position):
+        """(changes after position, new position); changes is None if the journal was replaced"""
+        current = self.position()
+        if current == position:
+            return [], position
+        if position is None or current is None or current[0] != position[0] or current[1] < position[1]:
+            if current is None:
+                open(self.path, "ab").close()
+                current = self.position()
+            return None, current
+        with open(self.path, "rb") as file:
+            file.seek(position[1])
+            data = file.read(current[1] - position[1])
+        # a line still being written has no newline yet, it is read next time
+        end = data.rfind(b"\n") + 1
+        changes = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return changes, (position[0], position[1] + end)
+
+    def follow(self, position=None):
+        """A ChangeFeed from position, by default the current end of the journal"""
+        return ChangeFeed(self, self.position() if position is None else position)
+
+
+class ChangeFeed:
+    """One reader's position in a CodeChanges journal"""
+
+    def __init__(self, changes, position):
+        self.changes = changes
+        self.position = position
+        self._lock = threading.Lock()
+
+    def poll(self):
+        """Changes since the last poll ([] if none), or None if everything must be assumed changed"""
+        if self.changes.position() == self.position:
+            return []
+        with self._lock:
+            changes, self.position = self.changes.read(self.position)
+        return changes
+
+
+def code_changes_from_env():
+    """CodeChanges at CODE_CHANGES_PATH, or None if that is set to none"""
+    path = os.getenv("CODE_CHANGES_PATH", DEFAULT_CODE_CHANGES_PATH)
+    if path.lower() == "none":
+        return None
+    return CodeChanges(path)
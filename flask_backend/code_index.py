@@ -0,0 +1,345 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from code_changes import UPLOADED
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process builds its own filter
+    fcntl = None
+
+# Compact membership index of every code in gift_codes. /redeem consults it
+# before any database call: a Bloom filter never says "no" for a code it
+# holds, so a miss means the code definitely does not exist and can be
+# rejected locally. Hits still go to the database (false positive rate is
+# configurable, 0.1% by default, ~1.8 bytes per code).
+#
+# A miss is only trusted while the filter holds every uploaded code. Uploads
+# from other processes are announced in the code_changes journal; until the
+# index has read the rows they added, misses go to the database.
+
+logger = logging.getLogger(__name__)
+
+
+class CodeBloomFilter:
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, code):
+        # double hashing: one 128-bit digest gives two independent 64-bit hashes
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, code):
+        positions = self._positions(code)
+        bits = self.bits
+        # read-modify-write of shared bytes, so writers are serialized
+        with self._lock:
+            for p in positions:
+                bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def __contains__(self, code):
+        bits = self.bits
+        for p in self._positions(code):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    @classmethod
+    def from_bits(cls, capacity, error_rate, bits, count):
+        bloom = cls(capacity, error_rate)
+        if len(bits) != len(bloom.bits):
+            raise ValueError("filter size does not match its capacity and error rate")
+        bloom.bits = bytearray(bits)
+        bloom.count = count
+        return bloom
+
+    def estimated_false_positive_rate(self):
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+            "memory_bytes": len(self.bits),
+            "bytes_per_code": round(len(self.bits) / self.count, 3) if self.count else None,
+            "target_false_positive_rate": self.error_rate,
+            "estimated_false_positive_rate": self.estimated_false_positive_rate(),
+        }
+
+
+class CodeIndex:
+    """Bloom filter over gift_codes, built and refreshed by serial_number watermark
+
+    iter_codes(after_serial) must yield rows with "code" and "serial_number" in
+    serial order (SupabaseClient.iter_codes) and count_codes() return the number
+    of rows. Until the first build finishes the index answers "maybe" for
+    everything, so it never blocks redemptions.
+
+    Serials are handed out when a row is inserted but become visible when its
+    transaction commits, so concurrent upload batches can commit out of order.
+    Uploads announced in changes (code_changes.CodeChanges) carry a serial that
+    all their rows are above, and the refresh reads from there; for uploads
+    made any other way each refresh re-reads the last rescan_serials serials
+    below the watermark, and the whole table is re-read every rebuild_seconds.
+
+    With snapshot_path, the processes of one host take turns building: the
+    first writes its filter there and the others load it instead of paging
+    through the table again.
+    """
+
+    def __init__(self, iter_codes, count_codes, error_rate=0.001, headroom=2.0, min_capacity=100_000,
+                 rescan_serials=10_000, rebuild_seconds=21600, changes=None, snapshot_path=None):
+        self.iter_codes = iter_codes
+        self.count_codes = count_codes
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self.min_capacity = min_capacity
+        self.rescan_serials = rescan_serials
+        self.rebuild_seconds = rebuild_seconds
+        self.changes = changes
+        self.snapshot_path = snapshot_path
+        self.ready = False
+        self.last_serial = 0
+        self.last_refresh_at = None
+        self.last_build_at = None
+        self._filter = CodeBloomFilter(min_capacity, error_rate)
+        self._next_filter = None  # filter being built, also receives add()
+        self._feed = changes.follow() if changes is not None else None
+        self._pending_after = None  # uploads announced but not read yet: every new row is above this serial
+        self._add_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def might_contain(self, code):
+        """False only if the code is certainly not in gift_codes"""
+        if not self.ready or not self._complete():
+            return True
+        return code in self._filter
+
+    def _complete(self):
+        """Whether every upload announced in the journal has been read into the filter"""
+        self._poll_changes()
+        if self._pending_after is None:
+            return True
+        self._wake.set()
+        return False
+
+    def _poll_changes(self):
+        if self._feed is None:
+            return
+        changes = self._feed.poll()
+        if changes is None:
+            # the journal was replaced, so anything may have been uploaded
+            floors = [0]
+        else:
+            floors = [change["after_serial"] for change in changes if change["kind"] == UPLOADED]
+        if floors:
+            with self._add_lock:
+                if self._pending_after is not None:
+                    floors.append(self._pending_after)
+                self._pending_after = min(floors)
+
+    def add(self, codes):
+        """Add freshly uploaded codes without waiting for the next refresh"""
+        with self._add_lock:
+            for code in codes:
+                self._filter.add(code)
+                if self._next_filter is not None:
+                    self._next_filter.add(code)
+
+    def build(self):
+        """(Re)build the filter from the whole table, sized from the current row count
+
+        Loads the snapshot instead if another process built one since this
+        index was last built; returns the number of codes in the filter.
+        """
+        with self._refresh_lock, self._snapshot_lock():
+            if self._load_snapshot():
+                self._refresh()
+                return self._filter.count
+            capacity = max(self.min_capacity, int(self.count_codes() * self.headroom))
+            bloom = CodeBloomFilter(capacity, self.error_rate)
+            # uploads announced from here on may have committed after the scan passed them
+            feed = self.changes.follow() if self.changes is not None else None
+            position = feed.position if feed is not None else None
+            with self._add_lock:
+                self._next_filter = bloom
+            last_serial = 0
+            for row in self.iter_codes(0):
+                bloom.add(row["code"])
+                last_serial = row["serial_number"]
+            with self._add_lock:
+                self._filter = bloom
+                self._next_filter = None
+                self._feed = feed
+                self._pending_after = None
+                self.last_serial = last_serial
+                self.ready = True
+                self.last_refresh_at = self.last_build_at = time.time()
+            self._save_snapshot(position)
+            return bloom.count
+
+    def refresh(self):
+        """Add codes uploaded since the last build/refresh (by serial_number)"""
+        if not self.ready:
+            return self.build()
+        if self._filter.count > self._filter.capacity:
+            # past capacity the false positive rate climbs, so resize
+            return self.build()
+        if self.rebuild_seconds and time.time() - self.last_build_at >= self.rebuild_seconds:
+            return self.build()
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self._poll_changes()
+        with self._add_lock:
+            pending, self._pending_after = self._pending_after, None
+        last_serial = self.last_serial
+        after = max(0, last_serial - self.rescan_serials)
+        if pending is not None:
+            after = min(after, pending)
+        added = 0
+        try:
+            for row in self.iter_codes(after):
+                # rows below the watermark are usually there already; re-adding them would inflate count
+                if row["code"] not in self._filter:
+                    self._filter.add(row["code"])
+                    added += 1
+                last_serial = max(last_serial, row["serial_number"])
+        except Exception:
+            # misses stay untrusted until a refresh gets through
+            with self._add_lock:
+                if pending is not None and (self._pending_after is None or pending < self._pending_after):
+                    self._pending_after = pending
+            raise
+        self.last_serial = last_serial
+        self.last_refresh_at = time.time()
+        return added
+
+    @contextmanager
+    def _snapshot_lock(self):
+        # one process builds at a time; the others wait, then load its snapshot
+        if self.snapshot_path is None or fcntl is None:
+            yield
+            return
+        with open(self.snapshot_path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_snapshot(self, changes_position):
+        if self.snapshot_path is None:
+            return
+        bloom = self._filter
+        header = {"capacity": bloom.capacity, "error_rate": bloom.error_rate, "count": bloom.count,
+                  "last_serial": self.last_serial, "built_at": self.last_build_at,
+                  "changes_position": changes_position}
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                file.write(json.dumps(header).encode() + b"\n")
+                file.write(bloom.bits)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning("Could not save the code index snapshot: %s", e)
+
+    def _load_snapshot(self):
+        """Install a snapshot built after ours and less than rebuild_seconds ago; True if one was loaded"""
+        if self.snapshot_path is None:
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                header = json.loads(file.readline())
+                bits = file.read()
+        except (OSError, ValueError):
+            return False
+        built_at = header["built_at"]
+        if self.last_build_at is not None and built_at <= self.last_build_at:
+            return False
+        if self.rebuild_seconds and time.time() - built_at >= self.rebuild_seconds:
+            return False
+        if header["error_rate"] != self.error_rate or header["count"] > header["capacity"]:
+            return False
+        try:
+            bloom = CodeBloomFilter.from_bits(header["capacity"], header["error_rate"], bits, header["count"])
+        except ValueError:
+            return False
+        position = header["changes_position"]
+        with self._add_lock:
+            self._filter = bloom
+            if self.changes is not None:
+                # a journal position from another journal file reads as "replaced": everything is rescanned
+                self._feed = self.changes.follow(tuple(position) if position else (None, 0))
+            self._pending_after = None
+            self.last_serial = header["last_serial"]
+            self.ready = True
+            self.last_refresh_at = self.last_build_at = built_at
+        return True
+
+    def start_background_refresh(self, interval_seconds=60):
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning("Code index refresh failed: %s", e)
+                # a lookup that found announced uploads not read yet wakes this early
+                self._wake.wait(interval_seconds)
+                self._wake.clear()
+
+        threading.Thread(target=run, name="code-index-refresh", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        stats = self._filter.stats()
+        stats.update({
+            "ready": self.ready,
+            "last_serial": self.last_serial,
+            "last_refresh_at": self.last_refresh_at,
+            "last_build_at": self.last_build_at,
+            "pending_uploads": self._pending_after is not None,
+        })
+        return stats
+
+
+def code_index_from_env(client):
+    """CodeIndex over a SupabaseClient, configured from CODE_INDEX_* variables, or None when disabled"""
+    if os.getenv("CODE_INDEX_ENABLED", "true").lower() == "false":
+        return None
+    snapshot_path = os.getenv("CODE_INDEX_SNAPSHOT_PATH", "code_index.snapshot")
+    return CodeIndex(
+        client.iter_codes,
+        client.count_codes,
+        error_rate=float(os.getenv("CODE_INDEX_ERROR_RATE", "0.001")),
+        rescan_serials=int(os.getenv("CODE_INDEX_RESCAN_SERIALS", "10000")),
+        rebuild_seconds=float(os.getenv("CODE_INDEX_REBUILD_SECONDS", "21600")),
+        changes=client.changes,
+        snapshot_path=None if snapshot_path.lower() == "none" else snapshot_path,
+    )
@@ -0,0 +1,225 @@
+import logging
+import os
+import signal
+import sys
+import threading
+from dataclasses import dataclass
+from dotenv import dotenv_values, find_dotenv
+from denominations import DenominationTable, parse_denominations
+
+# Application settings, parsed once into a Settings object instead of calling
+# os.getenv on every request. reload() re-reads the .env file and the gift card
+# source accounts file; ConfigWatcher does that on SIGHUP or when either file changes,
+# so source accounts can be swapped without a restart:
+#
+#   CONFIG_WATCH_SECONDS=5    # how often to check the files for changes, 0 disables
+#
+# Variables set in the real environment win over .env, on reload too. Only gift
+# card amounts and splits, the admin and partner API tokens, the batch limits and
+# source_accounts take effect on reload; the rest are read when clients are
+# built, at startup.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_ACCOUNTS_FILE = os.path.join(
+    os.path.dirname(sys.executable if getattr(sys, "frozen", False) else os.path.abspath(__file__)),
+    "gift_card_source_accounts.txt")
+
+# captured before anything loads .env into os.environ
+_PROCESS_ENV = dict(os.environ)
+
+
+@dataclass(frozen=True)
+class Settings:
+    supabase_url: str
+    supabase_key: str
+    cleancloud_api_token: str
+    admin_api_token: str
+    partner_api_tokens: tuple
+    gift_card_amount: float
+    denomination_table: DenominationTable
+    trusted_proxies: int
+    fulfillment_workers: int
+    redeem_batch_max_items: int
+    redeem_batch_wait_seconds: float
+    code_index_refresh_seconds: float
+    config_watch_seconds: float
+    source_accounts_file: str
+    source_accounts: tuple
+
+
+def read_source_accounts(path):
+    """Customer IDs from the accounts file, one per line; blank lines and # comments skipped"""
+    with open(path, "r") as file:
+        accounts = (line.strip() for line in file)
+        return tuple(dict.fromkeys(a for a in accounts if a and not a.startswith("#")))
+
+
+def load_settings(env=None):
+    """Parse Settings from env (default: the process environment over the .env file)"""
+    if env is None:
+        env = {**dotenv_values(find_dotenv()), **_PROCESS_ENV}
+    source_accounts_file = env.get("GIFT_CARD_SOURCE_ACCOUNTS_FILE") or DEFAULT_SOURCE_ACCOUNTS_FILE
+    try:
+        source_accounts = read_source_accounts(source_accounts_file)
+    except FileNotFoundError:
+        logger.error("File %s not found", source_accounts_file)
+        source_accounts = ()
+    gift_card_amount = float(env.get("GIFT_CARD_AMOUNT", "10.0"))
+    denomination_table = DenominationTable(parse_denominations(env.get("GIFT_CARD_DENOMINATIONS")),
+                                           max_amount=env.get("GIFT_CARD_MAX_AMOUNT") or None)
+    # codes without a card_value are worth GIFT_CARD_AMOUNT: raises ValueError if it can't be bought
+    denomination_table.split(gift_card_amount)
+    return Settings(
+        supabase_url=env.get("SUPABASE_URL"),
+        supabase_key=env.get("SUPABASE_KEY"),
+        cleancloud_api_token=env.get("CLEANCLOUD_API_TOKEN"),
+        admin_api_token=env.get("ADMIN_API_TOKEN"),
+        partner_api_tokens=tuple(t.strip() for t in (env.get("PARTNER_API_TOKENS") or "").split(",") if t.strip()),
+        gift_card_amount=gift_card_amount,
+        denomination_table=denomination_table,
+        trusted_proxies=int(env.get("RATE_LIMIT_TRUSTED_PROXIES", "0")),
+        fulfillment_workers=int(env.get("FULFILLMENT_WORKERS", "4")),
+        redeem_batch_max_items=int(env.get("REDEEM_BATCH_MAX_ITEMS", "500")),
+        redeem_batch_wait_seconds=float(env.get("REDEEM_BATCH_WAIT_SECONDS", "120")),
+        code_index_refresh_seconds=float(env.get("CODE_INDEX_REFRESH_SECONDS", "60")),
+        config_watch_seconds=float(env.get("CONFIG_WATCH_SECONDS", "5")),
+        source_accounts_file=source_accounts_file,
+        source_accounts=source_accounts,
+    )
+
+
+_current = None
+_current_lock = threading.Lock()
+_reload_callbacks = []
+
+
+def current():
+    """The loaded Settings; a plain global read after the first call"""
+    if _current is None:
+        with _current_lock:
+            if _current is None:
+                _set(load_settings())
+    return _current
+
+
+def _set(settings):
+    global _current
+    _current = settings
+
+
+def on_reload(callback):
+    """Call callback(settings) after every successful reload"""
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def reload():
+    """Re-read .env and the source accounts file; on a parse error the old settings stay"""
+    try:
+        settings = load_settings()
+    except Exception:
+        logger.exception("Config reload failed, keeping the current settings")
+        return current()
+    with _current_lock:
+        _set(settings)
+    logger.info("Config reloaded, %d gift card source accounts", len(settings.source_accounts))
+    for callback in _reload_callbacks:
+        try:
+            callback(settings)
+        except Exception:
+            logger.exception("Config reload callback %r failed", callback)
+    return settings
+
+
+class ConfigWatcher:
+    """Reloads the config when .env or the source accounts file changes, or on SIGHUP"""
+
+    def __init__(self, interval_seconds=5):
+        self.interval = interval_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._reload_requested = False
+        self._mtimes = self._file_mtimes()
+
+    def _file_mtimes(self):
+        mtimes = {}
+        for path in (find_dotenv(), current().source_accounts_file):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns if path else None
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def request_reload(self, *_):
+        # safe from a signal handler: the reload itself runs on the watcher thread
+        self._reload_requested = True
+        self._wake.set()
+
+    def start(self):
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        threading.Thread(target=self._run, name="config-watcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            mtimes = self._file_mtimes()
+            if self._reload_requested or mtimes != self._mtimes:
+                self._reload_requested = False
+                self._mtimes = mtimes
+                reload()
+
+
+def watch_from_env():
+    """Start a ConfigWatcher; SIGHUP is handled when called from the main thread"""
+    watcher = ConfigWatcher(current().config_watch_seconds)
+    watcher.start()
+    return watcher
+
+
+_UNSET = object()
+
+
+class ProcessLocal:
+    """Builds its value on first use in each process; instance() returns it, other attributes proxy to it
+
+    With a pre-forking server (gunicorn --preload) the app is imported once in
+    the master; nothing here opens sockets or starts threads until a worker
+    uses it, and a forked child builds its own value instead of inheriting the
+    parent's connections.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = _UNSET
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._value = _UNSET
+
+    def instance(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    self._value = self._factory()
+                value = self._value
+        return value
+
+    @property
+    def built(self):
+        return self._value is not _UNSET
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
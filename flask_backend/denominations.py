@@ -0,0 +1,90 @@
+import math
+
+# Splitting a code's card_value into the gift cards actually bought. CleanCloud
+# sells one card per giftCardBuy call, so a $120 code with a $50 per-purchase
+# cap becomes 50 + 50 + 20, each a separate fulfillment job.
+#
+#   GIFT_CARD_MAX_AMOUNT=50            # largest single purchase, unset for no cap
+#   GIFT_CARD_DENOMINATIONS=5,10,25,50 # card sizes to buy, unset for any amount
+#
+# With denominations the fewest-cards split of every amount up to max_value is
+# precomputed once (coin change), so a split at redeem time is a table walk and
+# is then cached per amount. Amounts the denominations can't make exactly, and
+# amounts that aren't positive, raise ValueError: no cards can be bought for them.
+
+
+def _cents(amount):
+    return int(round(float(amount) * 100))
+
+
+class DenominationTable:
+
+    def __init__(self, denominations=(), max_amount=None, max_value=1000):
+        self.max_amount = float(max_amount) if max_amount else None
+        max_cents = _cents(max_amount) if max_amount else None
+        self.denominations = tuple(sorted(
+            {_cents(d) for d in denominations if _cents(d) > 0 and (max_cents is None or _cents(d) <= max_cents)}))
+        # the table is indexed in steps of the denominations' gcd, e.g. $5 for 5,10,25,50
+        self._unit = math.gcd(*self.denominations) if self.denominations else 1
+        self._size = _cents(max_value) // self._unit
+        self._last_piece = self._build() if self.denominations else None
+        self._splits = {}
+
+    def _build(self):
+        # last_piece[n]: a denomination (in units) ending a fewest-pieces split of n units, 0 if none exists
+        units = [d // self._unit for d in self.denominations]
+        pieces = [0] + [math.inf] * self._size
+        last_piece = [0] * (self._size + 1)
+        for n in range(1, self._size + 1):
+            for denomination in units:
+                if denomination > n:
+                    break
+                if pieces[n - denomination] + 1 < pieces[n]:
+                    pieces[n] = pieces[n - denomination] + 1
+                    last_piece[n] = denomination
+        return last_piece
+
+    def split(self, amount):
+        """Card amounts to buy for amount, largest first, e.g. 120 -> (50.0, 50.0, 20.0)
+
+        Raises ValueError if amount is not positive or the denominations can't make it exactly.
+        """
+        cents = _cents(amount)
+        split = self._splits.get(cents)
+        if split is None:
+            if cents <= 0:
+                raise ValueError(f"Gift card amount must be positive, got {amount}")
+            split = self._split_denominations(cents) if self.denominations else self._split_max(cents)
+            if split is None:
+                raise ValueError(f"Gift card amount {amount} can't be made up of the denominations "
+                                 f"{', '.join(str(d / 100) for d in self.denominations)}")
+            self._splits[cents] = split
+        return split
+
+    def _split_denominations(self, cents):
+        if cents % self._unit:
+            return None
+        n = cents // self._unit
+        pieces = []
+        # beyond the table, the largest denomination until the rest fits
+        largest = self.denominations[-1] // self._unit
+        while n > self._size:
+            pieces.append(largest)
+            n -= largest
+        if n and not self._last_piece[n]:
+            return None
+        while n > 0:
+            pieces.append(self._last_piece[n])
+            n -= self._last_piece[n]
+        return tuple(sorted((p * self._unit / 100 for p in pieces), reverse=True))
+
+    def _split_max(self, cents):
+        if self.max_amount is None or cents <= _cents(self.max_amount):
+            return (cents / 100,)
+        full, remainder = divmod(cents, _cents(self.max_amount))
+        return (self.max_amount,) * full + ((remainder / 100,) if remainder else ())
+
+
+def parse_denominations(value):
+    """"5,10,25" -> (5.0, 10.0, 25.0)"""
+    return tuple(float(d) for d in (value or "").split(",") if d.strip())
@@ -0,0 +1,95 @@
+import argparse
+import json
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from local_backend import supabase_client_from_env
+from log_config import setup_logging
+
+# Mark expired unredeemed codes in bulk, so gift_codes.status stays current
+# (sql/code_status.sql) and redemption rejects them on status alone.
+#
+#   python expiry_sweeper.py                      # one sweep, e.g. from cron after midnight UTC
+#   python expiry_sweeper.py --every 3600         # keep sweeping, once an hour
+#   python expiry_sweeper.py --backfill           # once after the migration: every serial
+#
+# A sweep asks the partial expiry index for the serial range of available codes
+# past their expiry date, then walks it in chunks of --chunk serials. Each
+# chunk is one sweep_code_status call: a single UPDATE in its own transaction,
+# so row locks are held for one chunk at a time and /redeem keeps running. A
+# code redeemed while the sweep runs is skipped (its status is no longer
+# available). --pause seconds between chunks limit the write load.
+#
+# --backfill walks every serial instead, marking codes redeemed before the
+# migration as redeemed as well as expired ones as expired.
+
+logger = logging.getLogger(__name__)
+
+
+def sweep(client, chunk_size=10000, pause_seconds=0.0, backfill=False):
+    """Mark expired (and, with backfill, redeemed) codes chunk by chunk; returns a summary dict"""
+    started = time.perf_counter()
+    if backfill:
+        first, last = 1, client.max_serial()
+        candidates = None
+    else:
+        found = client.expired_code_range() or {}
+        first, last, candidates = found.get("min"), found.get("max"), found.get("count", 0)
+
+    chunks = failed = marked = 0
+    if first is not None and last is not None:
+        for start in range(first, last + 1, chunk_size):
+            end = min(start + chunk_size - 1, last)
+            if chunks and pause_seconds:
+                time.sleep(pause_seconds)
+            chunks += 1
+            try:
+                marked += client.sweep_code_status(start, end)
+            except Exception as e:
+                # later chunks are independent; the next sweep retries this one
+                failed += 1
+                logger.error("Sweeping serials %s to %s failed: %s", start, end,
+                             e.message if hasattr(e, 'message') else str(e))
+
+    return {
+        "backfill": backfill,
+        "candidates": candidates,
+        "from_serial": first,
+        "to_serial": last,
+        "chunks": chunks,
+        "failed_chunks": failed,
+        "marked": marked,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def report(summary):
+    print(json.dumps(summary, indent=2))
+    if summary["failed_chunks"]:
+        print(f"❌ {summary['failed_chunks']} of {summary['chunks']} chunks failed, "
+              f"{summary['marked']} codes marked in {summary['seconds']}s")
+    elif summary["marked"]:
+        print(f"✅ {summary['marked']} codes marked in {summary['chunks']} chunks, {summary['seconds']}s")
+    else:
+        print(f"✅ Nothing to sweep ({summary['seconds']}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mark expired unredeemed gift codes in bulk")
+    parser.add_argument("--chunk", type=int, default=10000, help="serials updated per transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between chunks")
+    parser.add_argument("--every", type=float, help="sweep again every N seconds instead of exiting")
+    parser.add_argument("--backfill", action="store_true",
+                        help="walk every serial, also marking codes redeemed before the migration")
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging(fmt=os.getenv("LOG_FORMAT", "text"))
+    supabase = supabase_client_from_env()
+    while True:
+        summary = sweep(supabase, args.chunk, args.pause, args.backfill)
+        report(summary)
+        if args.every is None:
+            break
+        time.sleep(args.every)
@@ -0,0 +1,200 @@
+import threading
+from datetime import date, datetime, timezone
+from supabase_tool import (RedeemError, AVAILABLE, REDEEMED, NOT_FOUND, ALREADY_REDEEMED, EXPIRED, FULFILLMENT_PENDING, FULFILLMENT_FAILED,
+                           redeemed_or_raise, expiry_values, distribution_values, fulfillment_values)
+
+# In-process stand-in for SupabaseClient, for tests and local runs without
+# Supabase credentials. Rows live in a dict keyed by code and follow the
+# gift_codes columns; redeem_gift_code mirrors sql/redeem_gift_code.sql.
+
+
+class FakeSupabaseClient:
+
+    def __init__(self):
+        self.rows = {}
+        self.stats_rows = []
+        self._next_serial = 1
+        self._lock = threading.Lock()
+
+    def upload_codes(self, codes, metadata=None, card_value=None):
+        inserted = []
+        with self._lock:
+            for code in codes:
+                if code in self.rows:
+                    raise ValueError(f"duplicate key value violates unique constraint: {code}")
+                row = {
+                    "code": code,
+                    "serial_number": self._next_serial,
+                    "uploaded_at": datetime.now(timezone.utc).isoformat(),
+                    "expiry_date": None,
+                    "distributed_to": None,
+                    "distributed_at": None,
+                    "is_redeemed": False,
+                    "status": AVAILABLE,
+                    "redeemed_at": None,
+                    "recipient_email": None,
+                    "recipient_phone": None,
+                    "metadata": metadata,
+                    "card_value": card_value,
+                    "fulfillment_status": None,
+                    "fulfillment_account": None,
+                    "fulfillment_reference": None,
+                    "fulfilled_at": None,
+                }
+                self._next_serial += 1
+                self.rows[code] = row
+                inserted.append(dict(row))
+        return inserted
+
+    def insert_codes_batch(self, codes, metadata=None, card_value=None):
+        with self._lock:
+            new_codes = [code for code in dict.fromkeys(codes) if code not in self.rows]
+        return len(self.upload_codes(new_codes, metadata=metadata, card_value=card_value))
+
+    def redeem_gift_code(self, p_code, p_recipient_email, p_recipient_phone, p_metadata=None):
+        """Same contract as the redeem_gift_code SQL function"""
+        with self._lock:
+            row = self.rows.get(p_code)
+            if row is None:
+                return {"status": NOT_FOUND, "code": p_code}
+            if row["is_redeemed"]:
+                return {"status": ALREADY_REDEEMED, "code": p_code, "redeemed_at": row["redeemed_at"]}
+            # ISO dates compare as strings
+            if row["status"] == EXPIRED or (row["expiry_date"] and row["expiry_date"] < date.today().isoformat()):
+                row["status"] = EXPIRED
+                return {"status": EXPIRED, "code": p_code, "serial_number": row["serial_number"],
+                        "expiry_date": row["expiry_date"]}
+            row.update({
+                "is_redeemed": True,
+                "status": REDEEMED,
+                "redeemed_at": datetime.now(timezone.utc).isoformat(),
+                "recipient_email": p_recipient_email,
+                "recipient_phone": p_recipient_phone,
+                "metadata": p_metadata,
+                "fulfillment_status": FULFILLMENT_PENDING,
+            })
+            return {
+                "status": REDEEMED,
+                "code": p_code,
+                "serial_number": row["serial_number"],
+                "redeemed_at": row["redeemed_at"],
+                "expiry_date": row["expiry_date"],
+                "card_value": row["card_value"],
+            }
+
+    def redeem_gift_codes(self, p_items):
+        """Same contract as the redeem_gift_codes SQL function, one item at a time"""
+        return [self.redeem_gift_code(item["code"], item["recipient_email"], item["recipient_phone"],
+                                      item.get("metadata")) for item in p_items]
+
+    def redeem_codes(self, items):
+        outcomes = []
+        for item, result in zip(items, self.redeem_gift_codes(items)):
+            try:
+                outcomes.append(redeemed_or_raise(item["code"], result))
+            except RedeemError as e:
+                outcomes.append(e)
+        return outcomes
+
+    def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
+        result = self.redeem_gift_code(code, recipient_email, recipient_phone, metadata)
+        return redeemed_or_raise(code, result)
+
+    def iter_codes(self, after_serial=0, page_size=1000, columns="code, serial_number", distributed_to=None):
+        names = [c.strip() for c in columns.split(",")]
+        with self._lock:
+            rows = sorted((r for r in self.rows.values() if r["serial_number"] > after_serial
+                           and (distributed_to is None or r["distributed_to"] == distributed_to)),
+                          key=lambda r: r["serial_number"])
+            rows = [dict(r) if names == ["*"] else {name: r[name] for name in names} for r in rows]
+        yield from rows
+
+    def ping(self):
+        pass
+
+    def count_codes(self):
+        return len(self.rows)
+
+    def refresh_code_stats(self, full=False):
+        """Always a full rebuild, the fake's tables are small"""
+        counts = {}
+        with self._lock:
+            for row in self.rows.values():
+                events = [("uploaded", row["uploaded_at"]), ("distributed", row["distributed_at"]),
+                          ("redeemed", row["redeemed_at"] if row["is_redeemed"] else None)]
+                for event, at in events:
+                    if at:
+                        key = (at[:10], row["distributed_to"], row["card_value"])
+                        bucket = counts.setdefault(key, {"uploaded": 0, "distributed": 0, "redeemed": 0})
+                        bucket[event] += 1
+            self.stats_rows = [{"day": day, "distributed_to": distributed_to, "card_value": value, **bucket}
+                               for (day, distributed_to, value), bucket in counts.items()]
+        days = {row["day"] for row in self.stats_rows}
+        return {"refreshed": True, "days": len(days), "refreshed_at": datetime.now(timezone.utc).isoformat()}
+
+    def iter_code_stats(self, since=None, until=None, page_size=1000):
+        rows = [dict(row) for row in self.stats_rows
+                if (since is None or row["day"] >= since) and (until is None or row["day"] <= until)]
+        yield from sorted(rows, key=lambda r: (r["day"], r["distributed_to"] or "", r["card_value"] or 0))
+
+    def record_fulfillment(self, code, status, account=None, reference=None):
+        with self._lock:
+            row = self.rows.get(code)
+            if row is not None:
+                row.update(fulfillment_values(status, account, reference))
+
+    def iter_unfulfilled(self, since=None, before=None, page_size=500):
+        with self._lock:
+            rows = sorted((dict(r) for r in self.rows.values()
+                           if r["is_redeemed"] and r["fulfillment_status"] in (FULFILLMENT_PENDING, FULFILLMENT_FAILED)
+                           and (since is None or r["redeemed_at"] >= since)
+                           and (before is None or r["redeemed_at"] < before)),
+                          key=lambda r: (r["redeemed_at"], r["code"]))
+        yield from rows
+
+    def reset_code(self, code):
+        with self._lock:
+            row = self.rows.get(code)
+            if row is not None:
+                row.update({"is_redeemed": False, "status": AVAILABLE, "recipient_email": None,
+                            "recipient_phone": None, "redeemed_at": None,
+                            **fulfillment_values(None), "fulfilled_at": None})
+
+    def update_range(self, start_serial, end_serial, values):
+        with self._lock:
+            rows = [row for row in self.rows.values()
+                    if start_serial <= row["serial_number"] <= end_serial and not row["is_redeemed"]]
+            for row in rows:
+                row.update(values)
+        return len(rows)
+
+    def max_serial(self):
+        with self._lock:
+            return max((row["serial_number"] for row in self.rows.values()), default=0)
+
+    def _sweepable(self, row, today):
+        return row["status"] == AVAILABLE and (row["is_redeemed"] or (row["expiry_date"] or today) < today)
+
+    def expired_code_range(self):
+        """Same contract as the expired_code_range SQL function"""
+        today = date.today().isoformat()
+        with self._lock:
+            serials = [row["serial_number"] for row in self.rows.values()
+                       if not row["is_redeemed"] and self._sweepable(row, today)]
+        return {"min": min(serials, default=None), "max": max(serials, default=None), "count": len(serials)}
+
+    def sweep_code_status(self, start_serial, end_serial):
+        """Same contract as the sweep_code_status SQL function"""
+        today = date.today().isoformat()
+        with self._lock:
+            rows = [row for row in self.rows.values()
+                    if start_serial <= row["serial_number"] <= end_serial and self._sweepable(row, today)]
+            for row in rows:
+                row["status"] = REDEEMED if row["is_redeemed"] else EXPIRED
+        return len(rows)
+
+    def update_expiry(self, start_serial, end_serial, new_expiry_date):
+        return self.update_range(start_serial, end_serial, expiry_values(new_expiry_date))
+
+    def distribute_cards(self, start_serial, end_serial, distributed_to, distributed_at=None):
+        return self.update_range(start_serial, end_serial, distribution_values(distributed_to, distributed_at))
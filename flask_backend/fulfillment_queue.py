@@ -0,0 +1,756 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from cleancloud_tool import request_was_sent, gift_card_reference
+from log_config import request_id_var
+from metrics import REGISTRY
+from supabase_tool import FULFILLED, FULFILLMENT_FAILED, FULFILLMENT_REVIEW
+
+# Durable queue of gift card purchase jobs. /redeem only marks the code as
+# redeemed and enqueues a job here; a pool of workers (in the Flask process
+# or a separate `python fulfillment_queue.py` process) drains the queue and
+# talks to CleanCloud, so slow vendor calls never hold an HTTP worker.
+#
+# The queue lives in a local SQLite file (WAL mode), so jobs survive restarts
+# and several processes can share one queue file.
+#
+# The same file holds a purchase ledger: a row is written before each job sends
+# its purchase and marked bought after. A job that finds an unfinished row from
+# an earlier attempt (timeout, crash) fails for review instead of buying again.
+#
+# Once all of a code's jobs are done, the worker writes the outcome to the
+# code's gift_codes row (fulfillment_status, account, CleanCloud id), where
+# reconcile.py finds redemptions that were never fulfilled.
+#
+# Codes whose jobs all succeeded more than retention_seconds ago are pruned,
+# with their ledger rows, while the workers are idle. Failed jobs are kept for
+# review. Job counts per status (for /metrics) are kept up to date by
+# triggers, so reading them doesn't scan the table.
+
+DEFAULT_QUEUE_PATH = "fulfillment_queue.db"
+
+logger = logging.getLogger(__name__)
+
+FULFILLMENT_JOBS = REGISTRY.counter(
+    "fulfillment_jobs_total", "Fulfillment job runs by outcome", ["outcome"])
+FULFILLMENT_SECONDS = REGISTRY.histogram(
+    "fulfillment_job_seconds", "Time to run one fulfillment job, including all account attempts")
+
+# job statuses
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# purchase ledger statuses
+PURCHASE_STARTED = "started"
+PURCHASE_BOUGHT = "bought"
+
+
+class FulfillmentError(Exception):
+    """Raised by a job handler when nothing was bought and the purchase should be retried"""
+
+
+class FulfillmentQueue:
+
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH, max_attempts=5,
+                 retry_delay=5.0, lease_seconds=300, retention_seconds=30 * 86400, prune_interval=3600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+        self._local = threading.local()
+        self._create_tables()
+        self._create_counts()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self):
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS fulfillment_jobs (
+                id TEXT PRIMARY KEY,
+                code TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                last_error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_fulfillment_jobs_ready
+                ON fulfillment_jobs (status, available_at);
+            CREATE INDEX IF NOT EXISTS idx_fulfillment_jobs_code
+                ON fulfillment_jobs (code);
+            CREATE TABLE IF NOT EXISTS purchase_ledger (
+                job_id TEXT PRIMARY KEY,
+                code TEXT NOT NULL,
+                status TEXT NOT NULL,
+                response TEXT,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reconcile_watermarks (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+
+    def _create_counts(self):
+        # the counts start from the jobs already in the file, in the same transaction
+        # as the triggers, so a queue file from before this table is counted correctly
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fulfillment_job_counts'"
+            ).fetchone()
+            if exists is None:
+                conn.execute("CREATE TABLE fulfillment_job_counts (status TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+                conn.execute("INSERT INTO fulfillment_job_counts (status, n) "
+                             "SELECT status, COUNT(*) FROM fulfillment_jobs GROUP BY status")
+                conn.execute("""
+                    CREATE TRIGGER fulfillment_jobs_count_insert AFTER INSERT ON fulfillment_jobs BEGIN
+                        INSERT INTO fulfillment_job_counts (status, n) VALUES (NEW.status, 1)
+                            ON CONFLICT (status) DO UPDATE SET n = n + 1;
+                    END""")
+                conn.execute("""
+                    CREATE TRIGGER fulfillment_jobs_count_update AFTER UPDATE OF status ON fulfillment_jobs
+                    WHEN OLD.status <> NEW.status BEGIN
+                        UPDATE fulfillment_job_counts SET n = n - 1 WHERE status = OLD.status;
+                        INSERT INTO fulfillment_job_counts (status, n) VALUES (NEW.status, 1)
+                            ON CONFLICT (status) DO UPDATE SET n = n + 1;
+                    END""")
+                conn.execute("""
+                    CREATE TRIGGER fulfillment_jobs_count_delete AFTER DELETE ON fulfillment_jobs BEGIN
+                        UPDATE fulfillment_job_counts SET n = n - 1 WHERE status = OLD.status;
+                    END""")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, code, payload):
+        return self.enqueue_many(code, [payload])[0]
+
+    def enqueue_many(self, code, payloads):
+        """Add one job per payload for code in a single transaction; returns the job ids"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            job_ids = self._insert_jobs(conn, code, payloads)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def enqueue_codes(self, code_payloads):
+        """enqueue_many for several codes in one transaction: [(code, payloads)] -> job ids per code"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            job_ids = [self._insert_jobs(conn, code, payloads) for code, payloads in code_payloads]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    @staticmethod
+    def _insert_jobs(conn, code, payloads):
+        job_ids = [uuid.uuid4().hex for _ in payloads]
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO fulfillment_jobs (id, code, payload, status, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(job_id, code, json.dumps(payload), PENDING, now, now, now)
+             for job_id, payload in zip(job_ids, payloads)],
+        )
+        return job_ids
+
+    def jobs_for_code(self, code):
+        """All jobs of a code, each with purchase_status from the ledger (None if no entry)"""
+        return self._jobs_for_code(self._connection(), code)
+
+    def _jobs_for_code(self, conn, code):
+        rows = conn.execute(
+            "SELECT j.*, l.status AS purchase_status FROM fulfillment_jobs j "
+            "LEFT JOIN purchase_ledger l ON l.job_id = j.id WHERE j.code = ? ORDER BY j.created_at",
+            (code,),
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def requeue(self, code, payloads):
+        """Run an unfulfilled code's purchases again; returns the ids of the jobs made pending
+
+        Failed jobs that certainly bought nothing are reset; a code with no jobs
+        at all (e.g. a lost queue file) gets new ones from payloads. Nothing
+        changes while one of its jobs is queued or running, or if an earlier
+        purchase may have gone through. Atomic, so concurrent callers can't
+        both requeue a code.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            jobs = self._jobs_for_code(conn, code)
+            if not jobs:
+                job_ids = self._insert_jobs(conn, code, payloads)
+            elif any(job["status"] in (PENDING, RUNNING) or job["purchase_status"] == PURCHASE_STARTED
+                     for job in jobs):
+                job_ids = []
+            else:
+                job_ids = [job["id"] for job in jobs if job["status"] == FAILED]
+                now = time.time()
+                conn.executemany(
+                    "UPDATE fulfillment_jobs SET status = ?, attempts = 0, available_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    [(PENDING, now, now, job_id) for job_id in job_ids],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def get_watermark(self, name):
+        row = self._connection().execute(
+            "SELECT value FROM reconcile_watermarks WHERE name = ?", (name,)
+        ).fetchone()
+        return row["value"] if row else None
+
+    def set_watermark(self, name, value):
+        self._connection().execute(
+            "INSERT INTO reconcile_watermarks (name, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (name, value, time.time()),
+        )
+
+    def claim(self):
+        """Atomically take the next ready job, or return None"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # running jobs whose lease expired belong to a worker that died
+            row = conn.execute(
+                "SELECT * FROM fulfillment_jobs "
+                "WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?) "
+                "ORDER BY available_at LIMIT 1",
+                (PENDING, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                self._maybe_prune()
+                return None
+            conn.execute(
+                "UPDATE fulfillment_jobs SET status = ?, attempts = attempts + 1, "
+                "lease_until = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, now + self.lease_seconds, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = self._to_dict(row)
+        job["status"] = RUNNING
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id, result=None):
+        self._connection().execute(
+            "UPDATE fulfillment_jobs SET status = ?, result = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+            (SUCCEEDED, json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id, attempts, error, retry=True):
+        """Reschedule the job with exponential backoff, or give up after max_attempts"""
+        now = time.time()
+        if not retry or attempts >= self.max_attempts:
+            status, available_at = FAILED, now
+        else:
+            status, available_at = PENDING, now + self.retry_delay * (2 ** (attempts - 1))
+        self._connection().execute(
+            "UPDATE fulfillment_jobs SET status = ?, available_at = ?, lease_until = NULL, "
+            "last_error = ?, updated_at = ? WHERE id = ?",
+            (status, available_at, str(error), now, job_id),
+        )
+        return status
+
+    def statuses(self, job_ids, chunk_size=500):
+        """{job_id: status} for many jobs, a query per chunk_size ids"""
+        job_ids = list(job_ids)
+        statuses = {}
+        conn = self._connection()
+        for start in range(0, len(job_ids), chunk_size):
+            chunk = job_ids[start:start + chunk_size]
+            rows = conn.execute(
+                f"SELECT id, status FROM fulfillment_jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            statuses.update((row["id"], row["status"]) for row in rows)
+        return statuses
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT * FROM fulfillment_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def start_purchase(self, job_id, code):
+        """Record that the job is about to buy; returns the earlier ledger entry instead if there is one"""
+        now = time.time()
+        conn = self._connection()
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO purchase_ledger (job_id, code, status, started_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (job_id, code, PURCHASE_STARTED, now, now),
+        ).rowcount
+        if inserted:
+            return None
+        row = conn.execute("SELECT * FROM purchase_ledger WHERE job_id = ?", (job_id,)).fetchone()
+        entry = dict(row)
+        entry["response"] = json.loads(entry["response"]) if entry["response"] else None
+        return entry
+
+    def finish_purchase(self, job_id, response):
+        self._connection().execute(
+            "UPDATE purchase_ledger SET status = ?, response = ?, updated_at = ? WHERE job_id = ?",
+            (PURCHASE_BOUGHT, json.dumps(response), time.time(), job_id),
+        )
+
+    def cancel_purchase(self, job_id):
+        """Forget a purchase that certainly did not happen, so the job may try again"""
+        self._connection().execute("DELETE FROM purchase_ledger WHERE job_id = ?", (job_id,))
+
+    def counts(self):
+        rows = self._connection().execute("SELECT status, n FROM fulfillment_job_counts").fetchall()
+        return {row["status"]: row["n"] for row in rows if row["n"]}
+
+    def _maybe_prune(self):
+        if not self.retention_seconds or time.monotonic() - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = time.monotonic()
+        try:
+            pruned = self.prune(time.time() - self.retention_seconds)
+        except sqlite3.OperationalError as e:
+            logger.warning("Could not prune fulfillment jobs: %s", e)
+            return
+        if pruned:
+            logger.info("Pruned %d fulfilled codes from the fulfillment queue", pruned)
+
+    def prune(self, before, batch_size=500):
+        """Delete codes whose jobs all succeeded before the given time, with their ledger rows
+
+        Returns the number of codes deleted. Works in batches of batch_size
+        codes so the write lock is never held for long.
+        """
+        conn = self._connection()
+        pruned = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                codes = [row["code"] for row in conn.execute(
+                    "SELECT code FROM fulfillment_jobs GROUP BY code "
+                    "HAVING SUM(status <> ?) = 0 AND MAX(updated_at) < ? LIMIT ?",
+                    (SUCCEEDED, before, batch_size),
+                ).fetchall()]
+                placeholders = ",".join("?" * len(codes))
+                if codes:
+                    conn.execute(f"DELETE FROM purchase_ledger WHERE code IN ({placeholders})", codes)
+                    conn.execute(f"DELETE FROM fulfillment_jobs WHERE code IN ({placeholders})", codes)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            pruned += len(codes)
+            if len(codes) < batch_size:
+                return pruned
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class FulfillmentWorkerPool:
+    """Fixed number of threads draining a FulfillmentQueue
+
+    recorder(code), if given, is called after every job, e.g. to write the
+    code's fulfillment outcome to Supabase (see record_code_fulfillment).
+    """
+
+    def __init__(self, queue, handler, concurrency=4, poll_interval=0.5, recorder=None):
+        self.queue = queue
+        self.handler = handler
+        self.recorder = recorder
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"fulfillment-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.OperationalError as e:
+                logger.warning("Could not claim fulfillment job: %s", e)
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        # log under the id of the /redeem request that queued the job
+        token = request_id_var.set(job["payload"].get("request_id"))
+        started = time.perf_counter()
+        try:
+            if _settled_by_ledger(self.queue, job):
+                return
+            result = self.handler(job["payload"])
+            _job_succeeded(self.queue, job, result, started)
+        except Exception as e:
+            _job_failed(self.queue, job, e, started)
+        finally:
+            _record_outcome(self.recorder, job)
+            request_id_var.reset(token)
+
+
+class AsyncFulfillmentWorkerPool:
+    """Fixed number of asyncio tasks draining a FulfillmentQueue, for asgi_app.py
+
+    The handler is a coroutine function; SQLite calls and the (sync) recorder
+    run in the default thread pool.
+    """
+
+    def __init__(self, queue, handler, concurrency=4, poll_interval=0.5, recorder=None):
+        self.queue = queue
+        self.handler = handler
+        self.recorder = recorder
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stop = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._run(), name=f"fulfillment-{i}"))
+
+    async def stop(self, timeout=30):
+        self._stop.set()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        self._tasks = []
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except sqlite3.OperationalError as e:
+                logger.warning("Could not claim fulfillment job: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run_job(job)
+
+    async def run_job(self, job):
+        token = request_id_var.set(job["payload"].get("request_id"))
+        started = time.perf_counter()
+        try:
+            if await asyncio.to_thread(_settled_by_ledger, self.queue, job):
+                return
+            result = await self.handler(job["payload"])
+            await asyncio.to_thread(_job_succeeded, self.queue, job, result, started)
+        except Exception as e:
+            await asyncio.to_thread(_job_failed, self.queue, job, e, started)
+        finally:
+            await asyncio.to_thread(_record_outcome, self.recorder, job)
+            request_id_var.reset(token)
+
+
+def _settled_by_ledger(queue, job):
+    """Check the purchase ledger before buying; True if the job was finished here instead"""
+    entry = queue.start_purchase(job["id"], job["code"])
+    if entry is None:
+        return False
+    if entry["status"] == PURCHASE_BOUGHT:
+        # bought, but the job was not marked done (e.g. the worker died in between)
+        queue.complete(job["id"], entry["response"])
+        FULFILLMENT_JOBS.inc(outcome="already_bought")
+        logger.info("Gift card already bought for this job", extra={"event": "fulfillment_already_bought",
+                                                                    "job_id": job["id"], "code": job["code"]})
+        return True
+    error = "An earlier purchase attempt may have gone through, check CleanCloud before retrying this job"
+    queue.fail(job["id"], job["attempts"], error, retry=False)
+    FULFILLMENT_JOBS.inc(outcome="unknown")
+    logger.error("Fulfillment job needs review", extra={"event": "fulfillment_unknown", "job_id": job["id"],
+                                                        "code": job["code"], "attempt": job["attempts"]})
+    return True
+
+
+def _job_succeeded(queue, job, result, started):
+    FULFILLMENT_SECONDS.observe(time.perf_counter() - started)
+    queue.finish_purchase(job["id"], result)
+    queue.complete(job["id"], result)
+    FULFILLMENT_JOBS.inc(outcome=SUCCEEDED)
+    logger.info("Fulfillment job succeeded", extra={"event": "fulfillment_succeeded", "job_id": job["id"],
+                                                    "code": job["code"], "attempt": job["attempts"],
+                                                    "sample": True})
+
+
+def _job_failed(queue, job, error, started):
+    FULFILLMENT_SECONDS.observe(time.perf_counter() - started)
+    # FulfillmentError means nothing was bought, so the job can safely run again.
+    # Anything else (timeouts, dropped connections) may have bought the card: the
+    # ledger entry stays and the job fails for review instead of being retried.
+    retry = isinstance(error, FulfillmentError)
+    if retry:
+        queue.cancel_purchase(job["id"])
+    else:
+        error = f"Purchase outcome unknown, check CleanCloud before retrying this job: {error}"
+    status = queue.fail(job["id"], job["attempts"], error, retry=retry)
+    FULFILLMENT_JOBS.inc(outcome="retry" if status == PENDING else FAILED)
+    logger.warning("Fulfillment job failed: %s", error, extra={"event": "fulfillment_failed", "job_id": job["id"],
+                                                               "code": job["code"], "attempt": job["attempts"],
+                                                               "status": status})
+
+
+def _record_outcome(recorder, job):
+    if recorder is None:
+        return
+    try:
+        recorder(job["code"])
+    except Exception as e:
+        # the reconcile job picks the code up again from its row
+        logger.warning("Could not record fulfillment outcome: %s", e,
+                       extra={"event": "fulfillment_record_failed", "job_id": job["id"], "code": job["code"]})
+
+
+def code_fulfillment(jobs):
+    """A code's fulfillment outcome from its jobs: (status, accounts, references)
+
+    status is None while any job is still queued or running. accounts and
+    references are comma-joined over the cards bought so far, None if none.
+    """
+    if not jobs or any(job["status"] in (PENDING, RUNNING) for job in jobs):
+        return None, None, None
+    if any(job["status"] == FAILED and job.get("purchase_status") == PURCHASE_STARTED for job in jobs):
+        status = FULFILLMENT_REVIEW
+    elif any(job["status"] == FAILED for job in jobs):
+        status = FULFILLMENT_FAILED
+    else:
+        status = FULFILLED
+    accounts, references = [], []
+    for job in jobs:
+        result = job["result"] if job["status"] == SUCCEEDED and isinstance(job["result"], dict) else {}
+        if result.get("account"):
+            accounts.append(str(result["account"]))
+        reference = gift_card_reference(result.get("response"))
+        if reference:
+            references.append(reference)
+    return status, ",".join(accounts) or None, ",".join(references) or None
+
+
+def record_code_fulfillment(client, queue, code):
+    """Write code's outcome to its gift_codes row once none of its jobs is queued; returns the status written"""
+    status, accounts, references = code_fulfillment(queue.jobs_for_code(code))
+    if status is not None:
+        client.record_fulfillment(code, status, accounts, references)
+    return status
+
+
+def purchase_payloads(code, recipient_email, recipient_phone, amounts, request_id=None):
+    """Job payloads for a redeemed code, one per gift card in amounts"""
+    return [{
+        "code": code,
+        "recipient_email": recipient_email,
+        "recipient_phone": recipient_phone,
+        "amount": amount,
+        "part": part,
+        "parts": len(amounts),
+        "request_id": request_id,
+    } for part, amount in enumerate(amounts)]
+
+
+def redeemed_message(code, amount, cards):
+    if cards == 1:
+        return f"Code {code} redeemed successfully! A ${amount} gift card is being sent to your email."
+    return f"Code {code} redeemed successfully! {cards} gift cards worth ${amount} in total are being sent to your email."
+
+
+def _gift_card_args(payload):
+    code = payload["code"]
+    recipient_email = payload["recipient_email"]
+    part, parts = payload.get("part", 0), payload.get("parts", 1)
+
+    # Extract recipient name from email (before @) or use "Valued Customer"
+    to_name = recipient_email.split('@')[0].title() if '@' in recipient_email else "Valued Customer"
+
+    # Send immediately
+    today = datetime.now()
+    if parts > 1:
+        message = (f"Congratulations! Your redemption code {code} has been processed. "
+                   f"This is gift card {part + 1} of {parts}, enjoy!")
+    else:
+        message = f"Congratulations! Your redemption code {code} has been processed. Enjoy your gift card!"
+
+    return {
+        "to_name": to_name,
+        "to_email": recipient_email,
+        "to_tel": payload["recipient_phone"],
+        "amount": payload["amount"],
+        "send_date": today.strftime("%Y-%m-%d"),
+        "send_hour": today.strftime("%H:%M"),
+        "message": message,
+        "notify_by": 2,  # Email notification
+        "account_offset": part,
+    }
+
+
+def _check_purchase(account, response):
+    if "Success" not in str(response):
+        raise FulfillmentError(f"CleanCloud gift card purchase failed: {response}")
+    return {"account": account, "response": response}
+
+
+def purchase_gift_card(cleancloud, payload):
+    """Buy and send the CleanCloud gift card described by a job payload; returns the account used and the response"""
+    try:
+        account, response = cleancloud.purchase(**_gift_card_args(payload))
+    except Exception as e:
+        if not request_was_sent(e):
+            raise FulfillmentError(f"Could not reach CleanCloud: {e}") from e
+        raise
+    return _check_purchase(account, response)
+
+
+async def purchase_gift_card_async(cleancloud, payload):
+    """purchase_gift_card for cleancloud_tool.AsyncCleancloudClient"""
+    try:
+        account, response = await cleancloud.purchase(**_gift_card_args(payload))
+    except Exception as e:
+        if not request_was_sent(e):
+            raise FulfillmentError(f"Could not reach CleanCloud: {e}") from e
+        raise
+    return _check_purchase(account, response)
+
+
+def make_handler(cleancloud):
+    def handler(payload):
+        if cleancloud is None:
+            raise FulfillmentError("CleanCloud client not initialized, check CLEANCLOUD_API_TOKEN")
+        return purchase_gift_card(cleancloud, payload)
+    return handler
+
+
+def make_async_handler(cleancloud):
+    async def handler(payload):
+        if cleancloud is None:
+            raise FulfillmentError("CleanCloud client not initialized, check CLEANCLOUD_API_TOKEN")
+        return await purchase_gift_card_async(cleancloud, payload)
+    return handler
+
+
+def queue_from_env():
+    return FulfillmentQueue(
+        db_path=os.getenv("FULFILLMENT_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+        max_attempts=int(os.getenv("FULFILLMENT_MAX_ATTEMPTS", "5")),
+        retry_delay=float(os.getenv("FULFILLMENT_RETRY_DELAY", "5")),
+        retention_seconds=float(os.getenv("FULFILLMENT_RETENTION_DAYS", "30")) * 86400,
+    )
+
+
+def standalone_worker_count(requested=None):
+    """Threads for the standalone pool: requested (--workers), FULFILLMENT_QUEUE_WORKERS, or FULFILLMENT_WORKERS
+
+    FULFILLMENT_WORKERS=0 turns off the app's own workers so that this process
+    drains the queue, and usually sits in the same .env, so 0 means the default of 4 here.
+    """
+    if requested is None:
+        requested = int(os.getenv("FULFILLMENT_QUEUE_WORKERS") or os.getenv("FULFILLMENT_WORKERS") or 4)
+    if requested < 0:
+        raise ValueError(f"worker count must not be negative, got {requested}")
+    return requested or 4
+
+
+# run a standalone worker pool: python fulfillment_queue.py [--workers N]
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from cleancloud_tool import myCleancloudClient, session_options_from_env
+    from cleancloud_simulator import simulated_cleancloud_from_env
+    from local_backend import supabase_client_from_env
+    from log_config import setup_logging
+    import config
+
+    parser = argparse.ArgumentParser(description="Drain the fulfillment queue")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="purchase threads (default: FULFILLMENT_QUEUE_WORKERS, else FULFILLMENT_WORKERS if set "
+                             "above 0, else 4)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging()
+    settings = config.current()
+    cleancloud = simulated_cleancloud_from_env(settings.source_accounts) or myCleancloudClient(
+        settings.cleancloud_api_token, print_gift_card_source_accounts=False,
+        source_accounts=settings.source_accounts, **session_options_from_env())
+    config.on_reload(lambda settings: cleancloud.set_source_accounts(settings.source_accounts))
+    config.watch_from_env()
+    queue = queue_from_env()
+    supabase = supabase_client_from_env()
+    pool = FulfillmentWorkerPool(
+        queue,
+        make_handler(cleancloud),
+        concurrency=standalone_worker_count(args.workers),
+        # same as app.py: each code's outcome goes to its gift_codes row
+        recorder=lambda code: record_code_fulfillment(supabase, queue, code),
+    )
+    pool.start()
+    print(f"🎁 Fulfillment workers running ({pool.concurrency} threads), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping fulfillment workers...")
+        pool.stop()
@@ -1,15 +1,81 @@
-import random
+import secrets
 import string
 import csv
+import heapq
 import os
+import shutil
+import time
 
 GIFT_CODE_LENGTH = 16  # Common for gift cards
 CSV_FILE = "gift_cards.csv"
+# Sorted file of every code generated so far, 12 bytes per code, used to avoid duplicates
+INDEX_FILE = "gift_cards.idx"
+INDEX_KEY_BYTES = 12  # 36^16 < 2^96
+BATCH_SIZE = 1_000_000
+
+CHARS = string.ascii_uppercase + string.digits
+CHAR_VALUES = {char: i for i, char in enumerate(CHARS)}
+
+# os.urandom bytes -> code characters. 252 = 7 * 36, so bytes 252..255 are
+# thrown away and every character stays equally likely (no modulo bias).
+_BYTE_TO_CHAR = bytes.maketrans(bytes(range(252)), (CHARS * 7).encode())
+_REJECTED_BYTES = bytes(range(252, 256))
 
 
 def generate_gift_code(length=GIFT_CODE_LENGTH):
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(chars, k=length))
+    return ''.join(secrets.choice(CHARS) for _ in range(length))
+
+
+def generate_code_batch(count, length=GIFT_CODE_LENGTH):
+    """Generate count random codes from one os.urandom read, translated in bulk"""
+    needed = count * length
+    chars = b""
+    while len(chars) < needed:
+        raw = os.urandom((needed - len(chars)) * 256 // 252 + 64)
+        chars += raw.translate(_BYTE_TO_CHAR, _REJECTED_BYTES)
+    text = chars[:needed].decode("ascii")
+    return [text[i:i + length] for i in range(0, needed, length)]
+
+
+def check_character(code):
+    """Luhn mod 36 check character, catches any single typo and most transpositions"""
+    factor = 2
+    total = 0
+    for char in reversed(code):
+        addend = factor * CHAR_VALUES[char]
+        factor = 1 if factor == 2 else 2
+        total += addend // 36 + addend % 36
+    return CHARS[(36 - total % 36) % 36]
+
+
+def is_valid_check_character(code):
+    return len(code) > 1 and code[-1] == check_character(code[:-1])
+
+
+def index_key(code):
+    """Fixed-width big-endian key of the code's base-36 value
+
+    Byte order of keys is numeric order, not CHARS order (int() ranks 0-9
+    before A-Z); the index only needs one consistent order to find duplicates.
+    """
+    return int(code[:GIFT_CODE_LENGTH], 36).to_bytes(INDEX_KEY_BYTES, "big")
+
+
+def _iter_index(path, block_keys=65536):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(INDEX_KEY_BYTES * block_keys)
+            if not block:
+                return
+            for i in range(0, len(block), INDEX_KEY_BYTES):
+                yield block[i:i + INDEX_KEY_BYTES]
+
+
+def _iter_packed(packed):
+    for i in range(0, len(packed), INDEX_KEY_BYTES):
+        yield packed[i:i + INDEX_KEY_BYTES]
 
 
 def load_existing_codes(filepath=CSV_FILE):
@@ -26,43 +92,94 @@ def load_existing_codes(filepath=CSV_FILE):
     return existing_codes
 
 
-def generate_gift_cards(count, output_file=CSV_FILE):
-    existing_codes = load_existing_codes(output_file)
-    new_codes = []
-
-    print(f"Found {len(existing_codes)} existing gift codes")
-
-    attempts = 0
-    max_attempts = count * 10  # Prevent infinite loops
-
-    while len(new_codes) < count and attempts < max_attempts:
-        new_code = generate_gift_code()
-
-        if new_code not in existing_codes:
-            new_codes.append({'gift_code': new_code})
-            existing_codes.add(new_code)
-
-        attempts += 1
-
-    if attempts >= max_attempts and len(new_codes) < count:
-        print(f"⚠️ Warning: Only generated {len(new_codes)} unique codes after {max_attempts} attempts")
-
-    if new_codes:
-        # Check if file exists and has content
-        file_exists = os.path.exists(output_file)
-        write_header = not file_exists or os.path.getsize(output_file) == 0
-
-        with open(output_file, 'a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=['gift_code'])
-            
-            if write_header:
-                writer.writeheader()
-            
-            writer.writerows(new_codes)
-
-        print(f"✅ Generated and saved {len(new_codes)} gift codes to {output_file}")
-    else:
-        print("❌ No new gift codes were generated")
+def build_index_from_csv(csv_file=CSV_FILE, index_file=INDEX_FILE):
+    """One-time migration for a CSV written before the index existed"""
+    keys = sorted(set(index_key(code) for code in load_existing_codes(csv_file)))
+    with open(index_file, "wb") as file:
+        file.write(b"".join(keys))
+    print(f"Indexed {len(keys)} existing gift codes into {index_file}")
+
+
+def _merge_into_index(index_file, runs):
+    """Merge sorted runs of new keys into the index; return keys that already existed"""
+    duplicates = set()
+    tmp_path = f"{index_file}.tmp"
+    previous = None
+    buffer = []
+    with open(tmp_path, "wb") as out:
+        for key in heapq.merge(_iter_index(index_file), *(_iter_packed(run) for run in runs)):
+            if key == previous:
+                duplicates.add(key)
+                continue
+            previous = key
+            buffer.append(key)
+            if len(buffer) >= 65536:
+                out.write(b"".join(buffer))
+                buffer = []
+        out.write(b"".join(buffer))
+    os.replace(tmp_path, index_file)
+    return duplicates
+
+
+def generate_gift_cards(count, output_file=CSV_FILE, index_file=INDEX_FILE,
+                        add_check_character=False, batch_size=BATCH_SIZE):
+    """Append count new unique codes to output_file
+
+    Codes are generated in batches of batch_size, spooled to a temporary file,
+    and deduplicated against the sorted on-disk index with a single merge pass,
+    so existing codes are never re-parsed from the CSV.
+    """
+    started = time.perf_counter()
+    if not os.path.exists(index_file) and os.path.exists(output_file):
+        build_index_from_csv(output_file, index_file)
+
+    existing = os.path.getsize(index_file) // INDEX_KEY_BYTES if os.path.exists(index_file) else 0
+    print(f"Found {existing} existing gift codes")
+
+    spool_path = f"{output_file}.new"
+    runs = []
+    with open(spool_path, "w", newline="", buffering=1 << 20) as spool:
+        remaining = count
+        while remaining > 0:
+            batch = generate_code_batch(min(batch_size, remaining))
+            # keep each sorted run packed, 12 bytes per code
+            runs.append(b"".join(sorted(index_key(code) for code in batch)))
+            if add_check_character:
+                batch = [code + check_character(code) for code in batch]
+            spool.write("\r\n".join(batch))
+            spool.write("\r\n")
+            remaining -= len(batch)
+
+    duplicates = _merge_into_index(index_file, runs)
+    runs = None
+
+    # Check if file exists and has content
+    file_exists = os.path.exists(output_file)
+    write_header = not file_exists or os.path.getsize(output_file) == 0
+    written = 0
+    with open(output_file, "a", newline="", buffering=1 << 20) as file, open(spool_path, "r", newline="") as spool:
+        if write_header:
+            file.write("gift_code\r\n")
+        if not duplicates:
+            shutil.copyfileobj(spool, file, 1 << 20)
+            written = count
+        else:
+            for line in spool:
+                if index_key(line.rstrip("\r\n")) not in duplicates:
+                    file.write(line)
+                    written += 1
+    os.remove(spool_path)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Generated and saved {written} gift codes to {output_file} "
+          f"in {elapsed:.1f}s ({written / elapsed:,.0f} codes/s)")
+
+    if written < count:
+        # a collision with an existing code (or within the run) was dropped; top up
+        print(f"⚠️ Dropped {count - written} duplicate codes, generating replacements")
+        written += generate_gift_cards(count - written, output_file, index_file,
+                                       add_check_character, batch_size)
+    return written
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+
+# Production server for app.py:
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Pre-forks WEB_CONCURRENCY worker processes, each serving GUNICORN_THREADS
+# requests at a time (defaults from the CPU count, see default_sizing). The app
+# is imported once in the master (preload_app); clients, the code index and
+# the fulfillment workers are built per worker (config.ProcessLocal).
+#
+# Each worker warms up before it takes traffic (app.warm_up: config, Supabase
+# and CleanCloud connections, fulfillment workers). On SIGTERM a worker turns
+# /readyz to 503, keeps serving for SHUTDOWN_DELAY_SECONDS so the load balancer
+# can take it out of rotation, then stops accepting and finishes in-flight
+# requests. Running fulfillment jobs finish and record their outcome before
+# it exits. All of this must fit in GRACEFUL_TIMEOUT, after which the master
+# kills the worker; a /redeem killed mid-way can leave a code redeemed but
+# unfulfilled until reconcile.py picks it up.
+#
+#   WEB_CONCURRENCY=4            # worker processes (default: CPUs, at least 2)
+#   GUNICORN_THREADS=8           # threads per worker
+#   GUNICORN_TIMEOUT=60          # seconds a silent worker (including warm-up) is allowed
+#   GRACEFUL_TIMEOUT=30          # seconds from SIGTERM to kill
+#   SHUTDOWN_DELAY_SECONDS=0     # seconds to keep serving after /readyz turns 503
+#   METRICS_DIR=/var/run/giftcard-metrics  # where workers share /metrics (default: a temp dir)
+
+load_dotenv()
+
+
+def available_cpus():
+    # CPUs this process may run on, which is fewer than os.cpu_count() under taskset or cpusets
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_sizing(cpus):
+    """(workers, threads) for this many CPUs
+
+    /redeem mostly waits on Supabase, so threads cover the waiting and one
+    process per CPU lets the Python work use every core. Every worker holds
+    its own code index and runs its own FULFILLMENT_WORKERS purchase threads,
+    so extra processes cost memory and CleanCloud concurrency, not throughput.
+    """
+    return max(2, cpus), 8
+
+
+_workers, _threads = default_sizing(available_cpus())
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", _workers))
+threads = int(os.getenv("GUNICORN_THREADS", _threads))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+shutdown_delay = float(os.getenv("SHUTDOWN_DELAY_SECONDS", "0"))
+
+# Idempotency keys must be seen by every worker: default to the SQLite store,
+# and let idempotency_store_from_env refuse a per-process one at preload.
+if workers > 1:
+    os.environ.setdefault("IDEMPOTENCY_BACKEND", "sqlite")
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# /metrics sums every worker's counters through files here (metrics.py)
+_own_metrics_dir = workers > 1 and not os.getenv("METRICS_DIR")
+if _own_metrics_dir:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="giftcard-metrics-")
+
+_terminated_at = None
+
+
+def on_starting(server):
+    import metrics
+
+    if os.getenv("METRICS_DIR"):
+        metrics.clear_shared_dir(os.environ["METRICS_DIR"])
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+def when_ready(server):
+    server.log.info("Serving with %d workers x %d threads (%d CPUs available)", workers, threads, available_cpus())
+
+
+def post_worker_init(worker):
+    import app
+
+    # on the worker's main thread, after gunicorn has reset its signal handlers,
+    # so the config watcher's SIGHUP handler sticks (post_fork would be too early)
+    app.config_watcher.instance()
+    app.warm_up()
+
+    stop_worker = worker.handle_exit
+
+    def drain_then_exit(signum, frame):
+        global _terminated_at
+        _terminated_at = time.monotonic()
+        app.lifecycle.drain()
+        if shutdown_delay > 0:
+            threading.Timer(shutdown_delay, stop_worker, (signum, frame)).start()
+        else:
+            stop_worker(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain_then_exit)
+
+
+def worker_exit(server, worker):
+    import app
+
+    # in-flight requests are done; spend what is left of graceful_timeout on running purchases
+    elapsed = time.monotonic() - _terminated_at if _terminated_at is not None else 0
+    app.shutdown(timeout=max(1.0, graceful_timeout - elapsed - 1))
+    # keep this worker's last counts in the /metrics totals
+    app.REGISTRY.write_snapshot()
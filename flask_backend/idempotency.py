@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Idempotency keys for /redeem. A client that retries with the same
+# Idempotency-Key header gets the stored response of the first request
+# instead of "already redeemed", and a duplicate that arrives while the first
+# request is still running waits for it and shares its response.
+#
+# Only final answers (2xx/4xx) are stored, for IDEMPOTENCY_TTL seconds; on a
+# server error the key is released so the retry runs again. A key reused with
+# a different code or recipient is rejected.
+#
+# The memory and local_redis stores live in one process, so with several
+# server processes (gunicorn workers, uvicorn --workers) a retry reaching
+# another process would run again: use sqlite (one host) or redis.
+
+# begin() outcomes
+STARTED = "started"        # the caller owns the key and must finish() or release() it
+REPLAY = "replay"          # a stored response is returned
+IN_PROGRESS = "in_progress"  # still running elsewhere after waiting wait_seconds
+MISMATCH = "mismatch"      # key already used for a different request
+
+MAX_KEY_LENGTH = 255
+
+DEFAULT_IDEMPOTENCY_PATH = "idempotency.db"
+PER_PROCESS_BACKENDS = ("memory", "local_redis")
+
+
+def request_fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """In-process store, key -> fingerprint and (body, status) once finished"""
+
+    def __init__(self, ttl_seconds=86400, max_entries=100_000):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}  # key -> {"fingerprint", "response", "done": Event, "expires_at"}
+        self._lock = threading.Lock()
+
+    def begin(self, key, fingerprint, wait_seconds=30):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry["expires_at"] <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self._prune()
+                    self._entries[key] = {"fingerprint": fingerprint, "response": None,
+                                          "done": threading.Event(), "expires_at": float("inf")}
+                    return STARTED, None
+            if entry["fingerprint"] != fingerprint:
+                return MISMATCH, None
+            if entry["response"] is not None:
+                return REPLAY, entry["response"]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return IN_PROGRESS, None
+            # released keys wake the waiters too; they loop and one of them takes the key over
+            entry["done"].wait(remaining)
+
+    def finish(self, key, body, status):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["response"] = (body, status)
+            entry["expires_at"] = time.monotonic() + self.ttl
+        entry["done"].set()
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry["done"].set()
+
+    def _prune(self):
+        if len(self._entries) < self.max_entries:
+            return
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry["expires_at"] <= now]:
+            del self._entries[key]
+        # still full: drop the oldest finished entries
+        finished = [k for k, entry in self._entries.items() if entry["response"] is not None]
+        for key in finished[:len(self._entries) - self.max_entries + 1]:
+            del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries)}
+
+
+class RedisIdempotencyStore:
+    """Shared store on a Redis-compatible client (redis.Redis or local_redis.LocalRedis)
+
+    The key is claimed with SET NX; duplicates in other processes poll until the
+    response is written. An in-progress claim expires after lock_seconds in case
+    its process dies.
+    """
+
+    def __init__(self, client, ttl_seconds=86400, lock_seconds=60, poll_interval=0.05,
+                 prefix="gift_codes:idempotency:"):
+        self.client = client
+        self.ttl = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+
+    def begin(self, key, fingerprint, wait_seconds=30):
+        redis_key = self.prefix + key
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            if self.client.set(redis_key, json.dumps({"fingerprint": fingerprint}), ex=self.lock_seconds, nx=True):
+                return STARTED, None
+            value = self.client.get(redis_key)
+            if value is not None:
+                entry = json.loads(value)
+                if entry["fingerprint"] != fingerprint:
+                    return MISMATCH, None
+                if "body" in entry:
+                    return REPLAY, (entry["body"], entry["status"])
+            if time.monotonic() >= deadline:
+                return IN_PROGRESS, None
+            time.sleep(self.poll_interval)
+
+    def finish(self, key, body, status):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            # the claim expired and may belong to someone else by now
+            return
+        entry = json.loads(value)
+        entry.update(body=body, status=status)
+        self.client.set(self.prefix + key, json.dumps(entry), ex=self.ttl)
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class SqliteIdempotencyStore:
+    """Store in a SQLite file, shared by every server process on one host
+
+    Same protocol as RedisIdempotencyStore: a key is claimed with one upsert that
+    only succeeds if the key is free or its claim expired (lock_seconds), and
+    duplicates poll until the response is written.
+    """
+
+    def __init__(self, db_path=DEFAULT_IDEMPOTENCY_PATH, ttl_seconds=86400, lock_seconds=60, poll_interval=0.05,
+                 prune_seconds=60):
+        self.db_path = db_path
+        self.ttl = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        self.prune_seconds = prune_seconds
+        self._pruned_at = time.monotonic()
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            # built at import, so under gunicorn --preload the master's connection must not reach the workers
+            os.register_at_fork(after_in_child=self._after_fork)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                body TEXT,
+                status INTEGER,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+        """)
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, key, fingerprint, wait_seconds=30):
+        conn = self._connection()
+        deadline = time.monotonic() + wait_seconds
+        self._prune(conn)
+        while True:
+            now = time.time()
+            claimed = conn.execute(
+                "INSERT INTO idempotency_keys (key, fingerprint, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, body = NULL, status = NULL, "
+                "expires_at = excluded.expires_at WHERE idempotency_keys.expires_at <= ?",
+                (key, fingerprint, now + self.lock_seconds, now)).rowcount
+            if claimed:
+                return STARTED, None
+            row = conn.execute("SELECT fingerprint, body, status FROM idempotency_keys WHERE key = ?",
+                               (key,)).fetchone()
+            if row is not None:
+                if row[0] != fingerprint:
+                    return MISMATCH, None
+                if row[2] is not None:
+                    return REPLAY, (json.loads(row[1]), row[2])
+            if time.monotonic() >= deadline:
+                return IN_PROGRESS, None
+            time.sleep(self.poll_interval)
+
+    def finish(self, key, body, status):
+        # no row if the claim expired and was taken over; that request answers for itself
+        self._connection().execute(
+            "UPDATE idempotency_keys SET body = ?, status = ?, expires_at = ? WHERE key = ? AND status IS NULL",
+            (json.dumps(body), status, time.time() + self.ttl, key))
+
+    def release(self, key):
+        self._connection().execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
+
+    def _prune(self, conn):
+        if time.monotonic() - self._pruned_at < self.prune_seconds:
+            return
+        self._pruned_at = time.monotonic()
+        conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (time.time(),))
+
+    def stats(self):
+        count = self._connection().execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+        return {"backend": "sqlite", "entries": count}
+
+
+def idempotency_store_from_env():
+    """Build the store selected by IDEMPOTENCY_BACKEND (memory, sqlite, redis, local_redis or none)"""
+    backend = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+    ttl = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+    # WEB_CONCURRENCY is the process count for gunicorn (gunicorn.conf.py) and uvicorn --workers
+    processes = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if backend in PER_PROCESS_BACKENDS and processes > 1:
+        raise ValueError(f"IDEMPOTENCY_BACKEND={backend} keeps keys in one process, but WEB_CONCURRENCY={processes} "
+                         "processes serve /redeem; use sqlite (one host) or redis")
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        return SqliteIdempotencyStore(os.getenv("IDEMPOTENCY_PATH", DEFAULT_IDEMPOTENCY_PATH), ttl)
+    if backend == "memory":
+        return IdempotencyStore(ttl, max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000")))
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("IDEMPOTENCY_BACKEND=redis requires the redis package: pip install redis")
+        return RedisIdempotencyStore(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")), ttl)
+    if backend == "local_redis":
+        from local_redis import LocalRedis
+        return RedisIdempotencyStore(LocalRedis(), ttl)
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {backend}")
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from metrics import REGISTRY
+
+# Readiness of a server process, for the /healthz and /readyz endpoints.
+#
+#   starting -> ready     once every required warm-up step has passed
+#   ready    -> draining  on SIGTERM: /readyz answers 503 so the load balancer
+#                         stops routing here while in-flight requests finish
+#
+# Warm-up steps are (name, function, required) and run in the worker process
+# before it takes traffic: gunicorn.conf.py's post_worker_init for app.py,
+# the lifespan for asgi_app.py. A failed optional step (e.g. CleanCloud, which
+# only the fulfillment workers call) is reported but doesn't block readiness.
+# Failed required steps are retried by /readyz, at most every RETRY_SECONDS.
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+
+RETRY_SECONDS = 5.0
+
+WARM_UP_SECONDS = REGISTRY.histogram(
+    "warm_up_step_seconds", "Time taken by each warm-up step", ["step", "result"])
+
+
+class Lifecycle:
+    """State of this process: starting, ready or draining, with the warm-up checks behind it"""
+
+    def __init__(self):
+        self.state = STARTING
+        self.checks = {}  # step name -> {"ok", "required", "seconds", "error"}
+        self.started_at = time.time()
+        self.ready_at = None
+        self._steps = []
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, name, required, started, error):
+        seconds = time.perf_counter() - started
+        WARM_UP_SECONDS.observe(seconds, step=name, result="error" if error else "ok")
+        self.checks[name] = {"ok": error is None, "required": required, "seconds": round(seconds, 3),
+                             "error": error}
+        if error is not None:
+            logger.warning("Warm-up step %s failed: %s", name, error,
+                           extra={"event": "warm_up_failed", "step": name})
+
+    def _pending(self):
+        return [(name, step, required) for name, step, required in self._steps
+                if name not in self.checks or (required and not self.checks[name]["ok"])]
+
+    def _finish(self):
+        self._last_attempt = time.monotonic()
+        if self.state == STARTING and all(check["ok"] for check in self.checks.values() if check["required"]):
+            self.state = READY
+            self.ready_at = time.time()
+            logger.info("Ready after %.2fs", self.ready_at - self.started_at, extra={"event": "ready"})
+
+    def warm_up(self, steps):
+        """Run the steps in order; ready once every required one has passed"""
+        with self._lock:
+            self._steps = list(steps)
+            for name, step, required in self._pending():
+                started = time.perf_counter()
+                try:
+                    step()
+                    error = None
+                except Exception as e:
+                    error = str(e)
+                self._record(name, required, started, error)
+            self._finish()
+
+    async def async_warm_up(self, steps):
+        """warm_up for coroutine functions, from an event loop"""
+        self._steps = list(steps)
+        for name, step, required in self._pending():
+            started = time.perf_counter()
+            try:
+                await step()
+                error = None
+            except Exception as e:
+                error = str(e)
+            self._record(name, required, started, error)
+        self._finish()
+
+    def _retry_due(self):
+        return self.state == STARTING and self._steps and time.monotonic() - self._last_attempt >= RETRY_SECONDS
+
+    def drain(self):
+        if self.state != DRAINING:
+            self.state = DRAINING
+            logger.info("Draining: no longer ready, finishing in-flight requests", extra={"event": "draining"})
+
+    def liveness(self):
+        """(body, HTTP status) for /healthz: the process is up and answering"""
+        return {"status": "ok", "state": self.state, "uptime_seconds": round(time.time() - self.started_at, 1)}, 200
+
+    def readiness(self):
+        """(body, HTTP status) for /readyz, retrying failed warm-up steps first when due"""
+        if self._retry_due():
+            self.warm_up(self._steps)
+        return self._readiness()
+
+    async def async_readiness(self):
+        if self._retry_due():
+            await self.async_warm_up(self._steps)
+        return self._readiness()
+
+    def _readiness(self):
+        body = {"status": self.state, "checks": self.checks}
+        return body, 200 if self.state == READY else 503
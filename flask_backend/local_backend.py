@@ -0,0 +1,165 @@
+import asyncio
+import csv
+import logging
+import os
+import config
+from code_changes import code_changes_from_env
+from fake_supabase import FakeSupabaseClient
+from sqlite_gift_codes import SqliteGiftCodes, DEFAULT_GIFT_CODES_PATH
+from single_flight import SingleFlight, AsyncSingleFlight
+from supabase_tool import SupabaseClient, AsyncSupabaseClient, RedeemPathMixin, SUPABASE_SECONDS
+
+# Local gift_codes backends, for profiling and load tests without Supabase:
+#
+#   GIFT_CODES_BACKEND=supabase   # default, SUPABASE_URL / SUPABASE_KEY
+#   GIFT_CODES_BACKEND=memory     # FakeSupabaseClient, per process
+#   GIFT_CODES_BACKEND=sqlite     # SqliteGiftCodes at GIFT_CODES_SQLITE_PATH, shared by processes
+#   GIFT_CODES_SEED_CSV=gift_cards.csv   # optional, codes (gift_code column) loaded at startup
+#
+# LocalSupabaseClient wraps either store in the same redeem path as
+# SupabaseClient (code index, outcome cache, request coalescing, metrics), so
+# only the database round trip changes. Fill the SQLite file with
+# `GIFT_CODES_BACKEND=sqlite python worker.py`, like Supabase.
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("supabase", "memory", "sqlite")
+
+
+def _read_seed_codes(path):
+    with open(path, "r", newline="") as file:
+        return [row["gift_code"] for row in csv.DictReader(file) if row.get("gift_code")]
+
+
+def _build_store():
+    backend = os.getenv("GIFT_CODES_BACKEND", "supabase").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"GIFT_CODES_BACKEND must be one of {', '.join(BACKENDS)}, got '{backend}'")
+    if backend == "supabase":
+        return None
+    if backend == "memory":
+        store = FakeSupabaseClient()
+    else:
+        store = SqliteGiftCodes(os.getenv("GIFT_CODES_SQLITE_PATH", DEFAULT_GIFT_CODES_PATH))
+    seed_csv = os.getenv("GIFT_CODES_SEED_CSV")
+    if seed_csv:
+        inserted = store.insert_codes_batch(_read_seed_codes(seed_csv))
+        logger.info("Seeded %d codes from %s", inserted, seed_csv)
+    logger.info("gift_codes backend: %s", backend)
+    return store
+
+
+# one store per process, shared by the sync and async clients
+local_store = config.ProcessLocal(_build_store)
+
+
+class LocalSupabaseClient(RedeemPathMixin):
+    """SupabaseClient on a local store; methods it doesn't define go straight to the store"""
+
+    def __init__(self, store, outcome_cache=None, changes=None):
+        self.store = store
+        self._init_redeem_path(outcome_cache, SingleFlight(), changes)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def upload_codes(self, codes, metadata=None, card_value=None):
+        floor = self._upload_floor()
+        inserted = self.store.upload_codes(codes, metadata=metadata, card_value=card_value)
+        self._codes_uploaded(codes, floor)
+        return inserted
+
+    def insert_codes_batch(self, codes, metadata=None, card_value=None):
+        floor = self._upload_floor()
+        inserted = self.store.insert_codes_batch(codes, metadata=metadata, card_value=card_value)
+        self._codes_uploaded(codes, floor)
+        return inserted
+
+    def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
+        self._check_known_outcome(code)
+
+        def call():
+            with SUPABASE_SECONDS.time(operation="redeem_gift_code"):
+                return self.store.redeem_gift_code(**self._redeem_params(
+                    code, recipient_email, recipient_phone, metadata))
+
+        data, shared = self.single_flight.do(code, call)
+        return self._finish_redeem(code, data, shared)
+
+    def redeem_codes(self, items):
+        """SupabaseClient.redeem_codes"""
+        outcomes = self._known_outcomes(items)
+        pending = [item for item, outcome in zip(items, outcomes) if outcome is None]
+        data = []
+        if pending:
+            with SUPABASE_SECONDS.time(operation="redeem_gift_codes"):
+                data = self.store.redeem_gift_codes(**self._batch_params(pending))
+        return self._finish_batch(items, outcomes, data)
+
+    def reset_code(self, code):
+        self.store.reset_code(code)
+        self._codes_reset([code])
+
+    def update_range(self, start_serial, end_serial, values):
+        updated = self.store.update_range(start_serial, end_serial, values)
+        if "expiry_date" in values:
+            self._expiry_changed(start_serial, end_serial)
+        return updated
+
+    def update_expiry(self, start_serial, end_serial, new_expiry_date):
+        return SupabaseClient.update_expiry(self, start_serial, end_serial, new_expiry_date)
+
+    def distribute_cards(self, start_serial, end_serial, distributed_to, distributed_at=None):
+        return SupabaseClient.distribute_cards(self, start_serial, end_serial, distributed_to, distributed_at)
+
+
+class AsyncLocalSupabaseClient(RedeemPathMixin):
+    """AsyncSupabaseClient on a local store; store calls run in the default thread pool"""
+
+    def __init__(self, store, outcome_cache=None, changes=None):
+        self.store = store
+        self._init_redeem_path(outcome_cache, AsyncSingleFlight(), changes)
+
+    async def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
+        await asyncio.to_thread(self._check_known_outcome, code)
+
+        async def call():
+            with SUPABASE_SECONDS.time(operation="redeem_gift_code"):
+                return await asyncio.to_thread(self.store.redeem_gift_code, **self._redeem_params(
+                    code, recipient_email, recipient_phone, metadata))
+
+        data, shared = await self.single_flight.do(code, call)
+        return await asyncio.to_thread(self._finish_redeem, code, data, shared)
+
+    async def redeem_codes(self, items):
+        """SupabaseClient.redeem_codes"""
+        outcomes = await asyncio.to_thread(self._known_outcomes, items)
+        pending = [item for item, outcome in zip(items, outcomes) if outcome is None]
+        data = []
+        if pending:
+            with SUPABASE_SECONDS.time(operation="redeem_gift_codes"):
+                data = await asyncio.to_thread(self.store.redeem_gift_codes, **self._batch_params(pending))
+        return await asyncio.to_thread(self._finish_batch, items, outcomes, data)
+
+    async def ping(self):
+        await asyncio.to_thread(self.store.ping)
+
+
+def supabase_client_from_env(outcome_cache=None):
+    """SupabaseClient, or LocalSupabaseClient when GIFT_CODES_BACKEND selects a local store"""
+    store = local_store.instance()
+    if store is not None:
+        return LocalSupabaseClient(store, outcome_cache=outcome_cache, changes=code_changes_from_env())
+    settings = config.current()
+    return SupabaseClient(settings.supabase_url, settings.supabase_key, outcome_cache=outcome_cache,
+                          changes=code_changes_from_env())
+
+
+def async_supabase_client_from_env(outcome_cache=None):
+    """AsyncSupabaseClient, or AsyncLocalSupabaseClient on the same store as supabase_client_from_env"""
+    store = local_store.instance()
+    if store is not None:
+        return AsyncLocalSupabaseClient(store, outcome_cache=outcome_cache, changes=code_changes_from_env())
+    settings = config.current()
+    return AsyncSupabaseClient(settings.supabase_url, settings.supabase_key, outcome_cache=outcome_cache,
+                               changes=code_changes_from_env())
@@ -0,0 +1,86 @@
+import fnmatch
+import threading
+import time
+
+# Minimal in-process stand-in for the subset of the redis-py client used by
+# the shared cache backends, so they can run in tests and local setups
+# without a Redis server.
+
+
+class LocalRedis:
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def _get_live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return item
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def get(self, key):
+        with self._lock:
+            item = self._get_live(key, time.time())
+            return item[0] if item else None
+
+    def mget(self, keys):
+        now = time.time()
+        with self._lock:
+            return [item[0] if item else None for item in (self._get_live(k, now) for k in keys)]
+
+    def set(self, key, value, ex=None, nx=False):
+        now = time.time()
+        with self._lock:
+            if nx and self._get_live(key, now) is not None:
+                return None
+            self._data[key] = (self._encode(value), now + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def incr(self, key, amount=1):
+        now = time.time()
+        with self._lock:
+            item = self._get_live(key, now)
+            value, expires_at = item if item else (b"0", None)
+            value = int(value) + amount
+            self._data[key] = (self._encode(value), expires_at)
+            return value
+
+    def expire(self, key, seconds):
+        now = time.time()
+        with self._lock:
+            item = self._get_live(key, now)
+            if item is None:
+                return False
+            self._data[key] = (item[0], now + seconds)
+            return True
+
+    def ttl(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._get_live(key, now)
+            if item is None:
+                return -2
+            if item[1] is None:
+                return -1
+            return int(item[1] - now)
+
+    def scan_iter(self, match="*"):
+        now = time.time()
+        with self._lock:
+            keys = [k for k in list(self._data) if self._get_live(k, now) is not None]
+        return iter([k for k in keys if fnmatch.fnmatchcase(k, match)])
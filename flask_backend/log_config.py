@@ -0,0 +1,125 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Logging for the backend. Records are JSON lines carrying the current request
+# id, and are handed to a queue so formatting and stdout I/O happen on a
+# listener thread instead of the request thread.
+#
+# The listener thread doesn't survive fork() (gunicorn preload_app), so a
+# forked child starts its own listener on a fresh queue.
+#
+# High-volume success events are logged with extra={"sample": True} and only a
+# LOG_SUCCESS_SAMPLE_RATE fraction of them is kept; warnings and errors always are.
+#
+#   LOG_LEVEL=INFO                 # DEBUG, INFO, WARNING, ERROR
+#   LOG_FORMAT=json                # json or text
+#   LOG_SUCCESS_SAMPLE_RATE=1.0    # e.g. 0.01 keeps 1% of successful redemptions
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SuccessSampler(logging.Filter):
+    """Keep only sample_rate of the records logged with extra={"sample": True}"""
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            return random.random() < self.sample_rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key != "sample" and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=None, fmt=None, sample_rate=None):
+    """Route all logging through a background queue listener; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    fmt = fmt or os.getenv("LOG_FORMAT", "json")
+    if sample_rate is None:
+        sample_rate = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "1.0"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # filters run on the calling thread, so the request id is captured before queueing
+    # and sampled-out records never reach the queue
+    queue_handler.addFilter(SuccessSampler(sample_rate))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def _restart_after_fork():
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
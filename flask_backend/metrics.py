@@ -0,0 +1,252 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics: counters, histograms and callback gauges,
+# rendered in the text exposition format by /metrics. Recording is a dict
+# lookup plus a short lock per observation, so instrumenting the hot path costs
+# microseconds; all formatting work happens at scrape time.
+#
+# Values live in process memory. With several server processes, set
+# METRICS_DIR: each process writes its counters and histograms to
+# <METRICS_DIR>/<pid>.json every METRICS_FLUSH_SECONDS, and /metrics sums the
+# files, so any process answers for all of them. Files of exited processes are
+# kept so totals never go down; empty the directory before starting the server
+# (gunicorn.conf.py does). Callback gauges are read by the answering process.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, samples=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        if samples is None:
+            with self._lock:
+                samples = dict(self._values)
+        for key, value in samples.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._series.items()]
+
+    def render(self, samples=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if samples is None:
+            with self._lock:
+                samples = {key: list(series) for key, series in self._series.items()}
+        for key, series in samples.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', repr(float(bound))))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """Gauge whose samples are computed at scrape time: fn() -> {label tuple: value}"""
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.fn().items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, tuple(str(k) for k in key))} {value}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.shared_dir = None
+        self.flush_seconds = 5.0
+
+    def share(self, directory, flush_seconds=5.0):
+        """Sum counters and histograms with the other processes writing to directory"""
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+        self.flush_seconds = flush_seconds
+        self._start_flusher()
+
+    def _start_flusher(self):
+        def flush():
+            while True:
+                time.sleep(self.flush_seconds)
+                try:
+                    self.write_snapshot()
+                except OSError:
+                    pass
+
+        threading.Thread(target=flush, name="metrics-flush", daemon=True).start()
+
+    def _after_fork(self):
+        # the flusher thread does not survive fork, and the child writes its own file
+        if self.shared_dir is not None:
+            self._start_flusher()
+
+    def write_snapshot(self):
+        """Write this process's counters and histograms to the shared directory"""
+        if self.shared_dir is None:
+            return
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {metric.name: metric.snapshot() for metric in metrics if hasattr(metric, "snapshot")}
+        path = os.path.join(self.shared_dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+
+    def _shared_samples(self):
+        self.write_snapshot()
+        merged = {}
+        for filename in os.listdir(self.shared_dir):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, samples in snapshot.items():
+                target = merged.setdefault(name, {})
+                for key, value in samples:
+                    key = tuple(key)
+                    previous = target.get(key)
+                    if previous is None:
+                        target[key] = value
+                    elif isinstance(value, list):
+                        target[key] = [a + b for a, b in zip(previous, value)]
+                    else:
+                        target[key] = previous + value
+        return merged
+
+    def _register(self, metric):
+        with self._lock:
+            # modules can be imported more than once (e.g. app reloads); keep the first
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, labelnames, fn):
+        with self._lock:
+            metric = CallbackGauge(name, documentation, labelnames, fn)
+            self._metrics[name] = metric
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        shared = self._shared_samples() if self.shared_dir is not None else None
+        lines = []
+        for metric in metrics:
+            try:
+                if shared is not None and hasattr(metric, "snapshot"):
+                    lines.extend(metric.render(shared.get(metric.name, {})))
+                else:
+                    lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+
+def clear_shared_dir(directory):
+    """Remove the snapshots of a previous run"""
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith((".json", ".json.tmp")):
+            os.remove(os.path.join(directory, filename))
+
+
+def share_metrics_from_env():
+    """Share REGISTRY through METRICS_DIR, if set"""
+    directory = os.getenv("METRICS_DIR")
+    if directory and REGISTRY.shared_dir is None:
+        REGISTRY.share(directory, float(os.getenv("METRICS_FLUSH_SECONDS", "5")))
@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from supabase_tool import NOT_FOUND, ALREADY_REDEEMED, EXPIRED
+from code_changes import UPLOADED, RESET, EXPIRY, code_changes_from_env
+
+# Cache of terminal redeem outcomes (not found, already redeemed, expired) so
+# repeated submissions of a bad code are answered without a database call.
+#
+# Entries are invalidated by SupabaseClient when reset_code, update_range or
+# upload_codes can change the outcome. Those calls usually run in another
+# process (batch_operations.py, bulk_upload.py, another gunicorn worker), so
+# every cache also follows the code_changes journal and applies the changes
+# recorded there before answering: uploads drop the "not found" entries,
+# resets drop their codes and expiry changes drop the "expired" entries of
+# their serial range. Changes made outside SupabaseClient (the SQL editor)
+# are only seen when the entries expire.
+
+CACHED_REASONS = (NOT_FOUND, ALREADY_REDEEMED, EXPIRED)
+
+
+class ChangeFollower:
+    """Applies the code_changes journal to a cache before it is read"""
+
+    def _follow(self, changes):
+        self._changes = changes
+        self._position = changes.position() if changes is not None else None
+        self._sync_lock = threading.Lock()
+
+    def _sync(self):
+        # one os.stat while nothing changed; the position only moves once the
+        # changes are applied, so no thread trusts an entry about to be dropped
+        if self._changes is None or self._changes.position() == self._position:
+            return
+        with self._sync_lock:
+            changes, position = self._changes.read(self._position)
+            if changes is None:
+                self.clear()
+            else:
+                for change in changes:
+                    self._apply(change)
+            self._position = position
+
+    def _apply(self, change):
+        kind = change["kind"]
+        if kind == UPLOADED:
+            self.invalidate_reason(NOT_FOUND)
+        elif kind == RESET:
+            self.invalidate(change["codes"])
+        elif kind == EXPIRY:
+            self.invalidate_serials(change["start_serial"], change["end_serial"])
+
+
+class OutcomeCache(ChangeFollower):
+    """In-process TTL + LRU cache, code -> (reason, message)"""
+
+    def __init__(self, max_entries=100_000, ttl_seconds=3600, not_found_ttl_seconds=60, changes=None):
+        self.max_entries = max_entries
+        self.ttl = {NOT_FOUND: not_found_ttl_seconds, ALREADY_REDEEMED: ttl_seconds, EXPIRED: ttl_seconds}
+        self._entries = OrderedDict()  # code -> (reason, message, expires_at, serial_number)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._follow(changes)
+
+    def get(self, code):
+        self._sync()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    del self._entries[code]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(code)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, code, reason, message, serial_number=None):
+        if reason not in CACHED_REASONS:
+            return
+        with self._lock:
+            self._entries[code] = (reason, message, time.monotonic() + self.ttl[reason], serial_number)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, codes):
+        with self._lock:
+            for code in codes:
+                self._entries.pop(code, None)
+
+    def invalidate_reason(self, reason):
+        with self._lock:
+            for code in [c for c, entry in self._entries.items() if entry[0] == reason]:
+                del self._entries[code]
+
+    def invalidate_serials(self, start_serial, end_serial):
+        """Drop the expired entries in a serial range (and those without a serial)"""
+        with self._lock:
+            for code in [c for c, entry in self._entries.items()
+                         if entry[0] == EXPIRED and (entry[3] is None or start_serial <= entry[3] <= end_serial)]:
+                del self._entries[code]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class RedisOutcomeCache(ChangeFollower):
+    """Shared cache on a Redis-compatible client (redis.Redis or local_redis.LocalRedis)
+
+    Keys are "<prefix><reason>:<code>" so a lookup is one MGET and a whole reason
+    can be dropped by pattern. Values are JSON [message, serial_number].
+    """
+
+    def __init__(self, client, ttl_seconds=3600, not_found_ttl_seconds=60, prefix="gift_codes:outcome:",
+                 changes=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = {NOT_FOUND: not_found_ttl_seconds, ALREADY_REDEEMED: ttl_seconds, EXPIRED: ttl_seconds}
+        self._follow(changes)
+
+    def _key(self, reason, code):
+        return f"{self.prefix}{reason}:{code}"
+
+    @staticmethod
+    def _decode(value):
+        """(message, serial_number) of a stored value; plain messages predate the serial"""
+        value = value.decode() if isinstance(value, bytes) else value
+        if value.startswith("["):
+            message, serial_number = json.loads(value)
+            return message, serial_number
+        return value, None
+
+    def get(self, code):
+        self._sync()
+        values = self.client.mget([self._key(reason, code) for reason in CACHED_REASONS])
+        for reason, value in zip(CACHED_REASONS, values):
+            if value is not None:
+                return reason, self._decode(value)[0]
+        return None
+
+    def put(self, code, reason, message, serial_number=None):
+        if reason in CACHED_REASONS:
+            self.client.set(self._key(reason, code), json.dumps([message, serial_number]), ex=self.ttl[reason])
+
+    def invalidate(self, codes, chunk_size=1000):
+        keys = [self._key(reason, code) for code in codes for reason in CACHED_REASONS]
+        for i in range(0, len(keys), chunk_size):
+            self.client.delete(*keys[i:i + chunk_size])
+
+    def invalidate_reason(self, reason):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}{reason}:*"))
+        for i in range(0, len(keys), 1000):
+            self.client.delete(*keys[i:i + 1000])
+
+    def invalidate_serials(self, start_serial, end_serial):
+        """Drop the expired entries in a serial range (and those without a serial)"""
+        keys = list(self.client.scan_iter(match=f"{self.prefix}{EXPIRED}:*"))
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            stale = []
+            for key, value in zip(chunk, self.client.mget(chunk)):
+                if value is None:
+                    continue
+                serial_number = self._decode(value)[1]
+                if serial_number is None or start_serial <= serial_number <= end_serial:
+                    stale.append(key)
+            if stale:
+                self.client.delete(*stale)
+
+    def clear(self):
+        for reason in CACHED_REASONS:
+            self.invalidate_reason(reason)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+def outcome_cache_from_env():
+    """Build the cache selected by OUTCOME_CACHE_BACKEND (memory, redis, local_redis or none)"""
+    backend = os.getenv("OUTCOME_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("OUTCOME_CACHE_TTL", "3600"))
+    not_found_ttl = float(os.getenv("OUTCOME_CACHE_NOT_FOUND_TTL", "60"))
+
+    if backend == "none":
+        return None
+    changes = code_changes_from_env()
+    if backend == "memory":
+        return OutcomeCache(
+            max_entries=int(os.getenv("OUTCOME_CACHE_MAX_ENTRIES", "100000")),
+            ttl_seconds=ttl,
+            not_found_ttl_seconds=not_found_ttl,
+            changes=changes,
+        )
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("OUTCOME_CACHE_BACKEND=redis requires the redis package: pip install redis")
+        client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        return RedisOutcomeCache(client, int(ttl), int(not_found_ttl), changes=changes)
+    if backend == "local_redis":
+        from local_redis import LocalRedis
+        return RedisOutcomeCache(LocalRedis(), int(ttl), int(not_found_ttl), changes=changes)
+    raise ValueError(f"Unknown OUTCOME_CACHE_BACKEND: {backend}")
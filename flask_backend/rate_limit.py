@@ -0,0 +1,256 @@
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+
+# Rate limiting for /redeem, checked before any Supabase or CleanCloud call:
+#   - per client IP and per code, limit requests per period
+#   - a budget of failed attempts (unknown, redeemed or expired codes) per
+#     client subnet (/24 for IPv4, /64 for IPv6); once it is spent that subnet
+#     is turned away until it refills, so one guessing script rotating through
+#     its addresses is stopped without locking out anyone else
+#   - failed attempts across all clients past an alert rate are counted and
+#     logged, but never block: customers keep redeeming during an attack
+#
+#   RATE_LIMIT_BACKEND=memory         # memory, redis, local_redis or none
+#   RATE_LIMIT_PER_IP=30/60           # requests / seconds, 0 disables
+#   RATE_LIMIT_PER_CODE=10/60
+#   RATE_LIMIT_FAILED_BUDGET=60/300   # per subnet
+#   RATE_LIMIT_FAILED_ALERT=600/60    # all clients, alert only
+#   RATE_LIMIT_MAX_ENTRIES=100000     # memory backend, per scope
+#   RATE_LIMIT_TRUSTED_PROXIES=0      # proxies in front of the app, for X-Forwarded-For
+#
+# Behind a proxy every request comes from the proxy's address, so until
+# RATE_LIMIT_TRUSTED_PROXIES is set, requests carrying X-Forwarded-For are not
+# limited per IP or subnet (one bucket would turn away every customer at
+# once) and a warning is logged. The memory backend counts per process: with
+# WEB_CONCURRENCY workers a client gets up to that many times each limit.
+
+logger = logging.getLogger(__name__)
+
+IP = "ip"
+CODE = "code"
+FAILED = "failed"
+FAILED_ALERT = "failed_alert"
+
+RATE_LIMITED = REGISTRY.counter(
+    "redeem_rate_limited_total", "/redeem requests turned away by the rate limiter", ["scope"])
+FAILED_OVER_ALERT = REGISTRY.counter(
+    "redeem_failed_over_alert_total", "Failed /redeem attempts past RATE_LIMIT_FAILED_ALERT, all clients")
+
+
+class TokenBucketStore:
+    """In-process token buckets, key -> (tokens, updated_at), least recently used evicted first
+
+    A bucket holds up to limit tokens and refills at limit/period per second, so
+    an evicted bucket (idle, so usually full anyway) loses nothing.
+    """
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, limit, period, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(limit)
+        tokens, updated_at = bucket
+        return min(float(limit), tokens + (now - updated_at) * limit / period)
+
+    def hit(self, key, limit, period, cost=1, force=False):
+        """Take cost tokens; returns 0 if allowed, else seconds until they are available
+
+        force takes them even if that leaves the bucket in debt.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, limit, period, now)
+            allowed = tokens >= cost
+            if allowed or force:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (cost - tokens) * period / limit
+
+    def remaining(self, key, limit, period):
+        with self._lock:
+            return self._tokens(key, limit, period, time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._buckets)}
+
+
+class RedisSlidingWindowStore:
+    """Shared counters on a Redis-compatible client (redis.Redis or local_redis.LocalRedis)
+
+    Sliding-window counter: one INCR'd key per fixed window, and the count is the
+    current window plus the previous one weighted by how much of it still
+    overlaps. Two small keys per limited key; checks and increments are separate
+    calls, so concurrent requests can overshoot the limit slightly.
+    """
+
+    def __init__(self, client, prefix="gift_codes:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _window(self, key, period):
+        now = time.time()
+        window = int(now // period)
+        elapsed = (now - window * period) / period
+        current_key = f"{self.prefix}{key}:{window}"
+        previous, current = self.client.mget([f"{self.prefix}{key}:{window - 1}", current_key])
+        count = int(current or 0) + int(previous or 0) * (1 - elapsed)
+        return current_key, count, elapsed
+
+    def hit(self, key, limit, period, cost=1, force=False):
+        current_key, count, elapsed = self._window(key, period)
+        allowed = count + cost <= limit
+        if allowed or force:
+            self.client.incr(current_key, cost)
+            self.client.expire(current_key, int(math.ceil(period * 2)))
+        return 0.0 if allowed else max(1.0, (1 - elapsed) * period)
+
+    def remaining(self, key, limit, period):
+        return limit - self._window(key, period)[1]
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class RateLimited(Exception):
+    """A request was turned away; scope is IP, CODE or FAILED, retry_after whole seconds"""
+
+    def __init__(self, scope, retry_after):
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Too many attempts, please try again in {self.retry_after} seconds.")
+
+
+class RateLimiter:
+
+    def __init__(self, stores, per_ip=None, per_code=None, failed_budget=None, failed_alert=None):
+        # stores: scope -> store, so floods of one scope (e.g. guessed codes) can't evict another's buckets
+        self.stores = stores
+        self.rules = {IP: per_ip, CODE: per_code, FAILED: failed_budget, FAILED_ALERT: failed_alert}
+        self._alerted_at = None
+
+    def check(self, ip, code):
+        """Raise RateLimited if this request must be turned away; otherwise count it"""
+        failed_budget = self.rules[FAILED]
+        if failed_budget and ip:
+            remaining = self.stores[FAILED].remaining(f"{FAILED}:{client_subnet(ip)}", *failed_budget)
+            if remaining < 1:
+                limit, period = failed_budget
+                RATE_LIMITED.inc(scope=FAILED)
+                raise RateLimited(FAILED, (1 - remaining) * period / limit)
+        for scope, key in ((IP, ip), (CODE, code)):
+            rule = self.rules[scope]
+            if rule and key:
+                retry_after = self.stores[scope].hit(f"{scope}:{key}", *rule)
+                if retry_after:
+                    RATE_LIMITED.inc(scope=scope)
+                    raise RateLimited(scope, retry_after)
+
+    def record_failure(self, ip):
+        """Spend one unit of ip's subnet failed-attempts budget, and count it towards the alert rate"""
+        if self.rules[FAILED] and ip:
+            self.stores[FAILED].hit(f"{FAILED}:{client_subnet(ip)}", *self.rules[FAILED], force=True)
+        alert = self.rules[FAILED_ALERT]
+        if alert and self.stores[FAILED].hit(FAILED_ALERT, *alert, force=True):
+            FAILED_OVER_ALERT.inc()
+            # one warning per alert period, not one per failed attempt
+            now = time.monotonic()
+            if self._alerted_at is None or now - self._alerted_at >= alert[1]:
+                self._alerted_at = now
+                logger.warning("Failed /redeem attempts above %d per %ss across all clients", *alert,
+                               extra={"event": "redeem_failed_alert"})
+
+    def stats(self):
+        return {scope: store.stats() for scope, store in self.stores.items()}
+
+
+def parse_rule(value):
+    """"30/60" -> (30, 60.0): 30 requests per 60 seconds; "0" or "" -> None"""
+    if not value or value.strip() == "0":
+        return None
+    limit, _, period = value.partition("/")
+    return int(limit), float(period or 1)
+
+
+def client_subnet(ip):
+    """The /24 (IPv4) or /64 (IPv6) network of ip, which one household or attacker usually holds whole"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    return str(ipaddress.ip_network(f"{address}/{24 if address.version == 4 else 64}", strict=False))
+
+
+_warned_untrusted_proxy = False
+
+
+def client_ip(remote_addr, forwarded_for, trusted_proxies=0):
+    """The client address, taken from X-Forwarded-For when the app sits behind trusted proxies
+
+    None if the request came through a proxy that isn't trusted: remote_addr is
+    then the proxy's, shared by every client.
+    """
+    global _warned_untrusted_proxy
+    if forwarded_for and not trusted_proxies:
+        if not _warned_untrusted_proxy:
+            _warned_untrusted_proxy = True
+            logger.warning("X-Forwarded-For is present but RATE_LIMIT_TRUSTED_PROXIES=0: requests are not "
+                           "rate limited per IP; set it to the number of proxies in front of the app",
+                           extra={"event": "rate_limit_untrusted_proxy"})
+        return None
+    if forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        # each trusted proxy appended one hop; the one before them is the client
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr
+
+
+def rate_limiter_from_env():
+    """Build the limiter selected by RATE_LIMIT_BACKEND (memory, redis, local_redis or none)"""
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend == "none":
+        return None
+    if backend == "memory":
+        max_entries = int(os.getenv("RATE_LIMIT_MAX_ENTRIES", "100000"))
+        stores = {IP: TokenBucketStore(max_entries), CODE: TokenBucketStore(max_entries),
+                  FAILED: TokenBucketStore(max_entries)}
+        # WEB_CONCURRENCY is the process count for gunicorn (gunicorn.conf.py) and uvicorn --workers
+        processes = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if processes > 1:
+            logger.warning("RATE_LIMIT_BACKEND=memory counts per process: with WEB_CONCURRENCY=%d each limit "
+                           "allows up to %d times as many requests; use redis to share the counts",
+                           processes, processes)
+    elif backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RATE_LIMIT_BACKEND=redis requires the redis package: pip install redis")
+        store = RedisSlidingWindowStore(redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+        stores = {IP: store, CODE: store, FAILED: store}
+    elif backend == "local_redis":
+        from local_redis import LocalRedis
+        store = RedisSlidingWindowStore(LocalRedis())
+        stores = {IP: store, CODE: store, FAILED: store}
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return RateLimiter(
+        stores,
+        per_ip=parse_rule(os.getenv("RATE_LIMIT_PER_IP", "30/60")),
+        per_code=parse_rule(os.getenv("RATE_LIMIT_PER_CODE", "10/60")),
+        failed_budget=parse_rule(os.getenv("RATE_LIMIT_FAILED_BUDGET", "60/300")),
+        failed_alert=parse_rule(os.getenv("RATE_LIMIT_FAILED_ALERT", "600/60")),
+    )
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from supabase_tool import card_value, FULFILLED, FULFILLMENT_REVIEW
+from local_backend import supabase_client_from_env
+from fulfillment_queue import queue_from_env, code_fulfillment, purchase_payloads
+from log_config import setup_logging
+import config
+
+# Find redeemed codes whose gift cards were never sent and send them.
+#
+#   python reconcile.py --batch 50 --pause 2
+#
+# Scans gift_codes rows still marked pending or failed, oldest redeemed_at
+# first, starting from the watermark left by the previous run (kept in the
+# fulfillment queue's SQLite file). For each code, its queue jobs decide:
+#
+#   all jobs succeeded                -> row marked fulfilled (the worker's write was lost)
+#   a purchase may have gone through  -> row marked review, check CleanCloud by hand
+#   jobs failed                       -> failed jobs requeued
+#   no jobs in this queue             -> reported as missing; jobs created with --create-missing
+#   card_value the denominations can't make -> reported as unsplittable
+#   jobs still queued or running      -> left alone
+#
+# The queue is the only record of what was bought, so every server and worker
+# must share one queue file. A code missing from it was either enqueued on a
+# queue this run can't see (buying again would send a second card) or its
+# queue file was lost; only pass --create-missing once you know which.
+#
+# Codes redeemed in the last --grace seconds are skipped so a /redeem still
+# enqueueing its jobs is not raced; requeueing is atomic per code, so running
+# this next to the workers can't buy a card twice. Requeues go out in batches
+# of --batch with --pause seconds between them, so a backlog doesn't hit
+# CleanCloud all at once. The new watermark is the oldest code still
+# unresolved, so codes that keep failing are retried (and reported) every run.
+
+WATERMARK = "reconcile_redeemed_at"
+
+
+def reconcile(client, queue, settings, grace_seconds=600, batch_size=50, pause_seconds=1.0,
+              limit=None, dry_run=False, from_start=False, create_missing=False):
+    """Scan unfulfilled redemptions from the stored watermark; returns a summary dict"""
+    since = None if from_start else queue.get_watermark(WATERMARK)
+    before = (datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)).isoformat()
+    started = time.perf_counter()
+    counts = {"scanned": 0, "fulfilled": 0, "review": 0, "requeued": 0, "jobs_requeued": 0, "in_progress": 0,
+              "missing": 0, "unsplittable": 0}
+    requeued_codes = []
+    missing_codes = []
+    unsplittable_codes = []
+    oldest_unresolved = None
+    last_scanned = None
+    in_batch = 0
+
+    for row in client.iter_unfulfilled(since=since, before=before):
+        if limit is not None and counts["scanned"] >= limit:
+            break
+        counts["scanned"] += 1
+        last_scanned = row["redeemed_at"]
+        code = row["code"]
+        jobs = queue.jobs_for_code(code)
+        status, accounts, references = code_fulfillment(jobs)
+
+        if status in (FULFILLED, FULFILLMENT_REVIEW):
+            counts["fulfilled" if status == FULFILLED else "review"] += 1
+            if not dry_run:
+                client.record_fulfillment(code, status, accounts, references)
+            continue
+
+        if oldest_unresolved is None:
+            oldest_unresolved = row["redeemed_at"]
+        if status is None and jobs:
+            counts["in_progress"] += 1
+            continue
+        if not jobs and not create_missing:
+            counts["missing"] += 1
+            missing_codes.append(code)
+            continue
+        if dry_run:
+            counts["requeued"] += 1
+            requeued_codes.append(code)
+            continue
+
+        try:
+            amounts = settings.denomination_table.split(card_value(row, settings.gift_card_amount))
+        except ValueError:
+            # GIFT_CARD_DENOMINATIONS changed since upload, or a bad card_value: fix by hand
+            counts["unsplittable"] += 1
+            unsplittable_codes.append(code)
+            continue
+        job_ids = queue.requeue(code, purchase_payloads(code, row["recipient_email"], row["recipient_phone"],
+                                                        amounts))
+        if not job_ids:
+            # picked up by a worker or another run in the meantime
+            counts["in_progress"] += 1
+            continue
+        counts["requeued"] += 1
+        counts["jobs_requeued"] += len(job_ids)
+        requeued_codes.append(code)
+        in_batch += 1
+        if in_batch >= batch_size:
+            in_batch = 0
+            time.sleep(pause_seconds)
+
+    if oldest_unresolved is not None:
+        watermark = oldest_unresolved
+    elif limit is not None and counts["scanned"] >= limit:
+        watermark = last_scanned
+    else:
+        watermark = before
+    if not dry_run and watermark is not None:
+        queue.set_watermark(WATERMARK, watermark)
+
+    return {
+        **counts,
+        "requeued_codes": requeued_codes,
+        "missing_codes": missing_codes,
+        "unsplittable_codes": unsplittable_codes,
+        "since": since,
+        "before": before,
+        "watermark": watermark,
+        "dry_run": dry_run,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send gift cards for redeemed codes that were never fulfilled")
+    parser.add_argument("--batch", type=int, default=50, help="codes requeued before each pause")
+    parser.add_argument("--pause", type=float, default=1.0, help="seconds to wait between batches")
+    parser.add_argument("--grace", type=float, default=600, help="skip codes redeemed in the last N seconds")
+    parser.add_argument("--limit", type=int, help="stop after scanning this many codes")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--from-start", action="store_true", help="ignore the stored watermark")
+    parser.add_argument("--create-missing", action="store_true",
+                        help="create jobs for codes this queue has no record of (only if its file was lost)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging(fmt=os.getenv("LOG_FORMAT", "text"))
+    settings = config.current()
+    supabase = supabase_client_from_env()
+    summary = reconcile(supabase, queue_from_env(), settings, grace_seconds=args.grace, batch_size=args.batch,
+                        pause_seconds=args.pause, limit=args.limit, dry_run=args.dry_run,
+                        from_start=args.from_start, create_missing=args.create_missing)
+    print(json.dumps(summary, indent=2))
+    if summary["requeued"] or summary["review"] or summary["missing"] or summary["unsplittable"]:
+        print(f"🔁 {summary['requeued']} codes requeued, {summary['review']} need review, "
+              f"{summary['missing']} missing from the queue, "
+              f"{summary['unsplittable']} worth an amount the denominations can't make, "
+              f"{summary['fulfilled']} already fulfilled ({summary['scanned']} scanned in {summary['seconds']}s)")
+    else:
+        print(f"✅ Nothing to reconcile, {summary['scanned']} codes scanned in {summary['seconds']}s")
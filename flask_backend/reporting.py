@@ -0,0 +1,148 @@
+import csv
+import io
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from metrics import REGISTRY
+from single_flight import SingleFlight
+
+# Partner reporting: codes uploaded, distributed and redeemed per distributed_to,
+# per day and per card value, served by GET /stats.
+#
+# The counts come from gift_code_stats (sql/code_stats.sql), a per-day summary.
+# Triggers on gift_codes append each statement's net change to the counts to
+# gift_code_stats_changes, and refresh_gift_code_stats() folds those rows into
+# the summary, so a refresh costs the activity since the previous one rather
+# than the days it touched. /stats never reads gift_codes itself: a cache miss
+# refreshes the summary (at most once per STATS_CACHE_SECONDS per process) and
+# adds up its rows, and the response is cached for the same time.
+#
+#   STATS_CACHE_SECONDS=60
+#
+# GET /stats/export streams gift_codes as CSV in serial_number order, one
+# keyset page at a time, so memory use doesn't grow with the table.
+
+STATS_REQUESTS = REGISTRY.counter(
+    "stats_requests_total", "/stats responses by where they came from", ["source"])
+
+EXPORT_COLUMNS = ("serial_number", "code", "card_value", "expiry_date", "distributed_to", "distributed_at",
+                  "is_redeemed", "redeemed_at", "fulfillment_status")
+
+
+def parse_day(value):
+    """ISO date from a query parameter, None if empty; raises ValueError if malformed"""
+    return date.fromisoformat(value).isoformat() if value else None
+
+
+def summarize(rows, default_card_value, distributed_to=None):
+    """Totals and breakdowns from gift_code_stats rows; codes without a card_value count at default_card_value"""
+    totals = {"uploaded": 0, "distributed": 0, "redeemed": 0, "redeemed_value": 0.0}
+    by_partner, by_day, by_card_value = {}, {}, {}
+    for row in rows:
+        if distributed_to is not None and row["distributed_to"] != distributed_to:
+            continue
+        value = float(row["card_value"]) if row["card_value"] is not None else default_card_value
+        counts = {"uploaded": row["uploaded"], "distributed": row["distributed"], "redeemed": row["redeemed"],
+                  "redeemed_value": row["redeemed"] * value}
+        for bucket in (totals,
+                       by_partner.setdefault(row["distributed_to"], dict.fromkeys(counts, 0)),
+                       by_day.setdefault(row["day"], dict.fromkeys(counts, 0)),
+                       by_card_value.setdefault(value, dict.fromkeys(counts, 0))):
+            for name, n in counts.items():
+                bucket[name] += n
+    return {
+        "totals": totals,
+        # codes not distributed yet are listed under distributed_to null
+        "by_partner": [{"distributed_to": k, **v} for k, v in
+                       sorted(by_partner.items(), key=lambda item: (item[0] is None, item[0] or ""))],
+        "by_day": [{"day": k, **v} for k, v in sorted(by_day.items())],
+        "by_card_value": [{"card_value": k, **v} for k, v in sorted(by_card_value.items())],
+    }
+
+
+class StatsCache:
+    """/stats responses per query, each kept for ttl seconds"""
+
+    def __init__(self, ttl_seconds=60, max_entries=256):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.refreshed_at = None
+        self._entries = OrderedDict()  # query -> (stats, expires_at)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = None
+        self._flight = SingleFlight()
+
+    def get(self, client, since=None, until=None, distributed_to=None, default_card_value=10.0):
+        """Stats for days since..until, optionally for one partner, through client (a SupabaseClient)"""
+        key = (since, until, distributed_to, default_card_value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                STATS_REQUESTS.inc(source="cache")
+                return entry[0]
+
+        # concurrent misses for the same query share one load
+        stats, shared = self._flight.do(key, lambda: self._load(client, key))
+        STATS_REQUESTS.inc(source="shared" if shared else "database")
+        return stats
+
+    def _load(self, client, key):
+        since, until, distributed_to, default_card_value = key
+        self._refresh(client)
+        stats = {
+            "since": since,
+            "until": until,
+            "distributed_to": distributed_to,
+            "refreshed_at": self.refreshed_at,
+            **summarize(client.iter_code_stats(since, until), default_card_value, distributed_to),
+        }
+        with self._lock:
+            self._entries[key] = (stats, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return stats
+
+    def _refresh(self, client):
+        # one summary refresh per ttl, whichever query missed
+        with self._refresh_lock:
+            if self._last_refresh is not None and time.monotonic() - self._last_refresh < self.ttl:
+                return
+            result = client.refresh_code_stats() or {}
+            self._last_refresh = time.monotonic()
+            # not refreshed: another process is refreshing right now, its counts are at most a refresh behind
+            if result.get("refreshed"):
+                self.refreshed_at = result.get("refreshed_at")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._refresh_lock:
+            self._last_refresh = None
+
+
+def stats_cache_from_env():
+    return StatsCache(ttl_seconds=float(os.getenv("STATS_CACHE_SECONDS", "60")))
+
+
+def export_filename(distributed_to=None):
+    return "gift_codes_" + re.sub(r"[^A-Za-z0-9_-]+", "_", distributed_to or "all") + ".csv"
+
+
+def export_csv(client, distributed_to=None, page_size=1000, rows_per_chunk=500):
+    """Yield CSV text for every gift_codes row (or one partner's), in serial_number order"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = client.iter_codes(page_size=page_size, columns=", ".join(EXPORT_COLUMNS), distributed_to=distributed_to)
+    for n, row in enumerate(rows, start=1):
+        writer.writerow([row.get(column) for column in EXPORT_COLUMNS])
+        if n % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
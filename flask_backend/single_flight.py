@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+# Single-flight call coalescing: while a call for a key is running, other
+# callers with the same key wait for it and get its outcome instead of making
+# their own call. Used by the redeem path so a code posted by many users at
+# once costs one database round trip. Coalescing is per process.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread version, do(key, fn) -> (result, shared)"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run fn() unless a call for key is in flight; shared is True if another caller ran it
+
+        Exceptions raised by fn are raised to every caller that shared the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """asyncio version, await do(key, coroutine_fn) -> (result, shared)"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # the caller running it was cancelled; run it ourselves instead
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here so an unshared failure isn't reported as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
@@ -0,0 +1,152 @@
+-- Per-day counts behind GET /stats (reporting.py). Run once in the Supabase SQL editor;
+-- rerunning it is safe and rebuilds the summary.
+--
+-- gift_code_stats holds, for each UTC day, distributed_to and card_value, how
+-- many codes were uploaded, distributed and redeemed that day. Statement
+-- triggers on gift_codes append each statement's net change to those counts
+-- to gift_code_stats_changes: the old row's events are subtracted and the new
+-- row's added, so re-distributing a code to another partner (or resetting it)
+-- moves its counts from the old day and partner to the new ones. A redemption
+-- adds one small row there; statements that touch no counted column (status,
+-- fulfillment) add nothing. refresh_gift_code_stats() folds the pending
+-- changes into gift_code_stats, so a refresh costs the activity since the
+-- previous one, however large the print-run days are.
+
+create table if not exists gift_code_stats (
+    day date not null,
+    distributed_to text,
+    card_value numeric,
+    uploaded integer not null default 0,
+    distributed integer not null default 0,
+    redeemed integer not null default 0
+);
+
+create index if not exists gift_code_stats_day_idx on gift_code_stats (day);
+create unique index if not exists gift_code_stats_key_idx
+    on gift_code_stats (day, distributed_to, card_value) nulls not distinct;
+
+create table if not exists gift_code_stats_watermark (
+    id boolean primary key default true check (id),
+    refreshed_at timestamptz not null
+);
+
+-- insert-only, so concurrent redemptions never wait on each other here
+create table if not exists gift_code_stats_changes (
+    id bigint generated always as identity primary key,
+    day date not null,
+    distributed_to text,
+    card_value numeric,
+    uploaded integer not null,
+    distributed integer not null,
+    redeemed integer not null
+);
+
+create or replace function gift_code_stats_capture()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_rows text;
+begin
+    v_rows := case tg_op
+        when 'INSERT' then 'select 1 as sign, * from new_rows'
+        when 'DELETE' then 'select -1 as sign, * from old_rows'
+        else 'select -1 as sign, * from old_rows union all select 1 as sign, * from new_rows'
+    end;
+    execute format($q$
+        with changed as (%s)
+        insert into gift_code_stats_changes (day, distributed_to, card_value, uploaded, distributed, redeemed)
+        select e.day, c.distributed_to, c.card_value, sum(e.uploaded), sum(e.distributed), sum(e.redeemed)
+          from changed c
+         cross join lateral (values ((c.uploaded_at at time zone 'utc')::date, c.sign, 0, 0),
+                                    ((c.distributed_at at time zone 'utc')::date, 0, c.sign, 0),
+                                    ((c.redeemed_at at time zone 'utc')::date, 0, 0,
+                                     case when c.is_redeemed then c.sign else 0 end))
+               as e(day, uploaded, distributed, redeemed)
+         where e.day is not null
+         group by e.day, c.distributed_to, c.card_value
+        having sum(e.uploaded) <> 0 or sum(e.distributed) <> 0 or sum(e.redeemed) <> 0
+    $q$, v_rows);
+    return null;
+end;
+$$;
+
+drop trigger if exists gift_code_stats_insert on gift_codes;
+create trigger gift_code_stats_insert after insert on gift_codes
+    referencing new table as new_rows
+    for each statement execute function gift_code_stats_capture();
+
+drop trigger if exists gift_code_stats_update on gift_codes;
+create trigger gift_code_stats_update after update on gift_codes
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function gift_code_stats_capture();
+
+drop trigger if exists gift_code_stats_delete on gift_codes;
+create trigger gift_code_stats_delete after delete on gift_codes
+    referencing old table as old_rows
+    for each statement execute function gift_code_stats_capture();
+
+-- Returns {"refreshed": true, "days": <days changed>, "refreshed_at": ...},
+-- or {"refreshed": false} if another refresh is already running.
+create or replace function refresh_gift_code_stats(p_full boolean default false)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_started timestamptz := now();
+    v_since timestamptz;
+    v_days integer;
+begin
+    -- one refresh at a time across all app processes, the others return straight away
+    if not pg_try_advisory_xact_lock(hashtext('refresh_gift_code_stats')) then
+        return jsonb_build_object('refreshed', false);
+    end if;
+
+    select refreshed_at into v_since from gift_code_stats_watermark;
+
+    if p_full or v_since is null then
+        delete from gift_code_stats;
+        -- one statement, so the pending changes are cleared under the same
+        -- snapshot the rebuild reads: later commits stay queued for the next refresh
+        with cleared as (delete from gift_code_stats_changes)
+        insert into gift_code_stats (day, distributed_to, card_value, uploaded, distributed, redeemed)
+        select e.day, g.distributed_to, g.card_value, sum(e.uploaded), sum(e.distributed), sum(e.redeemed)
+          from gift_codes g
+         cross join lateral (values ((g.uploaded_at at time zone 'utc')::date, 1, 0, 0),
+                                    ((g.distributed_at at time zone 'utc')::date, 0, 1, 0),
+                                    ((g.redeemed_at at time zone 'utc')::date, 0, 0,
+                                     case when g.is_redeemed then 1 else 0 end))
+               as e(day, uploaded, distributed, redeemed)
+         where e.day is not null
+         group by e.day, g.distributed_to, g.card_value
+        having sum(e.uploaded) <> 0 or sum(e.distributed) <> 0 or sum(e.redeemed) <> 0;
+        select count(distinct day) into v_days from gift_code_stats;
+    else
+        with drained as (
+            delete from gift_code_stats_changes
+            returning day, distributed_to, card_value, uploaded, distributed, redeemed
+        ), applied as (
+            insert into gift_code_stats as s (day, distributed_to, card_value, uploaded, distributed, redeemed)
+            select day, distributed_to, card_value, sum(uploaded), sum(distributed), sum(redeemed)
+              from drained
+             group by day, distributed_to, card_value
+            on conflict (day, distributed_to, card_value) do update
+               set uploaded = s.uploaded + excluded.uploaded,
+                   distributed = s.distributed + excluded.distributed,
+                   redeemed = s.redeemed + excluded.redeemed
+            returning s.day
+        )
+        select count(distinct day) into v_days from applied;
+        -- e.g. every code of a day re-distributed to another partner
+        delete from gift_code_stats where uploaded = 0 and distributed = 0 and redeemed = 0;
+    end if;
+
+    insert into gift_code_stats_watermark (id, refreshed_at) values (true, v_started)
+        on conflict (id) do update set refreshed_at = excluded.refreshed_at;
+
+    return jsonb_build_object('refreshed', true, 'days', v_days, 'refreshed_at', v_started);
+end;
+$$;
+
+-- start the summary and the change log from the same snapshot
+select refresh_gift_code_stats(true);
@@ -0,0 +1,58 @@
+-- Lifecycle status of each code: available | redeemed | expired.
+-- Run once in the Supabase SQL editor, before redeem_gift_code.sql and
+-- redeem_gift_codes.sql, then run `python expiry_sweeper.py --backfill` once to
+-- mark the codes that were redeemed or expired before this migration.
+--
+--   redeemed: set by redeem_gift_code(s) in the same UPDATE as is_redeemed
+--   expired:  set in bulk by sweep_code_status (expiry_sweeper.py), or by
+--             redeem_gift_code when it meets an expired code the sweeper hasn't
+--             reached yet; update_expiry sets it back to available when the
+--             date moves into the future
+
+-- a constant default doesn't rewrite the table
+alter table gift_codes add column if not exists status text not null default 'available';
+
+-- not valid: existing rows aren't scanned while the table is locked; run
+-- `alter table gift_codes validate constraint gift_codes_status_check;` afterwards
+alter table gift_codes drop constraint if exists gift_codes_status_check;
+alter table gift_codes add constraint gift_codes_status_check
+    check (status in ('available', 'redeemed', 'expired')) not valid;
+
+-- The sweeper's candidates, available codes by expiry date. CONCURRENTLY keeps
+-- redemptions running while it builds; run it on its own, outside a transaction.
+create index concurrently if not exists gift_codes_available_expiry_idx
+    on gift_codes (expiry_date, serial_number)
+    where status = 'available' and expiry_date is not null;
+
+-- Serial range and number of available codes past their expiry date, read from
+-- the index above. Returns {"min": ..., "max": ..., "count": ...}.
+create or replace function expired_code_range()
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object('min', min(serial_number), 'max', max(serial_number), 'count', count(*))
+      from gift_codes
+     where status = 'available'
+       and expiry_date is not null
+       and expiry_date < current_date;
+$$;
+
+-- Mark the available codes in [p_from_serial, p_to_serial] that are redeemed
+-- (only after the migration, before --backfill has run) or past their expiry
+-- date. Each call is its own short transaction, locking at most one chunk of
+-- rows. Returns the number of codes marked.
+create or replace function sweep_code_status(p_from_serial bigint, p_to_serial bigint)
+returns integer
+language sql
+as $$
+    with swept as (
+        update gift_codes
+           set status = case when is_redeemed then 'redeemed' else 'expired' end
+         where serial_number between p_from_serial and p_to_serial
+           and status = 'available'
+           and (is_redeemed or expiry_date < current_date)
+        returning 1
+    )
+    select count(*)::integer from swept;
+$$;
@@ -0,0 +1,21 @@
+-- Fulfillment outcome of each redeemed code, written by the fulfillment workers
+-- and read by reconcile.py. Run once in the Supabase SQL editor, before
+-- redeem_gift_code.sql (which sets fulfillment_status = 'pending' on redemption).
+--
+-- fulfillment_status: pending | fulfilled | failed | review, null for codes
+-- redeemed before this migration.
+
+alter table gift_codes
+    add column if not exists fulfillment_status text,
+    add column if not exists fulfillment_account text,
+    add column if not exists fulfillment_reference text,
+    add column if not exists fulfilled_at timestamptz;
+
+-- reconcile.py walks unfulfilled redemptions in (redeemed_at, code) order from a
+-- watermark. The partial index holds only those rows, so the scan stays small
+-- however many fulfilled codes the table accumulates. CONCURRENTLY keeps
+-- redemptions running while it builds; run this statement on its own, since it
+-- can't be inside a transaction.
+create index concurrently if not exists gift_codes_unfulfilled_idx
+    on gift_codes (redeemed_at, code)
+    where is_redeemed and fulfillment_status in ('pending', 'failed');
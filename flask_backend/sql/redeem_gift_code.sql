@@ -0,0 +1,67 @@
+-- Atomic single round-trip redemption used by SupabaseClient.redeem_code.
+-- Run once in the Supabase SQL editor, after fulfillment_status.sql and code_status.sql.
+--
+-- The UPDATE validates existence, redemption and expiry in its WHERE clause, so
+-- there is no window between checking a code and marking it redeemed. When no
+-- row is updated, a lookup on the unique code index tells the caller why.
+-- Codes are redeemable while status = 'available' (sql/code_status.sql).
+-- expiry_sweeper.py marks expired codes in bulk; one that expired since its
+-- last run is caught by the date guard and marked here, so it is rejected on
+-- status alone from then on.
+--
+-- Returns {"status": "redeemed" | "not_found" | "already_redeemed" | "expired", ...row fields}
+
+create or replace function redeem_gift_code(
+    p_code text,
+    p_recipient_email text,
+    p_recipient_phone text,
+    p_metadata jsonb default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_row gift_codes%rowtype;
+begin
+    update gift_codes
+       set is_redeemed = true,
+           status = 'redeemed',
+           redeemed_at = now(),
+           recipient_email = p_recipient_email,
+           recipient_phone = p_recipient_phone,
+           metadata = p_metadata,
+           fulfillment_status = 'pending'
+     where code = p_code
+       and status = 'available'
+       -- is_redeemed covers rows from before the migration until `expiry_sweeper.py --backfill` has run
+       and is_redeemed = false
+       and (expiry_date is null or expiry_date >= current_date)
+    returning * into v_row;
+
+    if found then
+        return jsonb_build_object(
+            'status', 'redeemed',
+            'code', v_row.code,
+            'serial_number', v_row.serial_number,
+            'redeemed_at', v_row.redeemed_at,
+            'expiry_date', v_row.expiry_date,
+            'card_value', v_row.card_value
+        );
+    end if;
+
+    select * into v_row from gift_codes where code = p_code;
+
+    if not found then
+        return jsonb_build_object('status', 'not_found', 'code', p_code);
+    elsif v_row.is_redeemed then
+        return jsonb_build_object('status', 'already_redeemed', 'code', p_code,
+                                  'redeemed_at', v_row.redeemed_at);
+    else
+        if v_row.status = 'available' then
+            update gift_codes set status = 'expired' where code = p_code and status = 'available';
+        end if;
+        return jsonb_build_object('status', 'expired', 'code', p_code,
+                                  'serial_number', v_row.serial_number, 'expiry_date', v_row.expiry_date);
+    end if;
+end;
+$$;
@@ -0,0 +1,77 @@
+-- Set-based batch redemption used by SupabaseClient.redeem_codes (/redeem/batch).
+-- Run once in the Supabase SQL editor, after fulfillment_status.sql and code_status.sql.
+--
+-- p_items is a JSON array of {"code", "recipient_email", "recipient_phone", "metadata"}.
+-- Returns a JSON array with one result per item, in the same order and shape as
+-- redeem_gift_code returns for a single code. The whole batch is one statement
+-- per step instead of one round trip per code. If a code appears more than once,
+-- its first item redeems it and the rest get already_redeemed.
+
+create or replace function redeem_gift_codes(p_items jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_results jsonb;
+begin
+    -- Lock the batch's rows in code order first, so concurrent batches with
+    -- overlapping codes queue up behind each other instead of deadlocking
+    perform 1
+       from gift_codes
+      where code in (select item->>'code' from jsonb_array_elements(p_items) as item)
+      order by code
+        for update;
+
+    with items as (
+        select i.code, i.recipient_email, i.recipient_phone, i.metadata, i.ord
+          from jsonb_to_recordset(p_items) with ordinality
+               as i(code text, recipient_email text, recipient_phone text, metadata jsonb, ord bigint)
+    ),
+    first_items as (
+        select distinct on (code) * from items order by code, ord
+    ),
+    redeemed as (
+        update gift_codes g
+           set is_redeemed = true,
+               status = 'redeemed',
+               redeemed_at = now(),
+               recipient_email = f.recipient_email,
+               recipient_phone = f.recipient_phone,
+               metadata = f.metadata,
+               fulfillment_status = 'pending'
+          from first_items f
+         where g.code = f.code
+           and g.status = 'available'
+           and g.is_redeemed = false
+           and (g.expiry_date is null or g.expiry_date >= current_date)
+        returning g.code, g.serial_number, g.redeemed_at, g.expiry_date, g.card_value
+    )
+    -- gift_codes below is the state before the update; the rows are locked, so nothing else changed them
+    select coalesce(jsonb_agg(
+               case
+                   when r.code is not null and i.ord = f.ord then
+                       jsonb_build_object('status', 'redeemed', 'code', r.code, 'serial_number', r.serial_number,
+                                          'redeemed_at', r.redeemed_at, 'expiry_date', r.expiry_date,
+                                          'card_value', r.card_value)
+                   when r.code is not null then
+                       jsonb_build_object('status', 'already_redeemed', 'code', i.code,
+                                          'redeemed_at', r.redeemed_at)
+                   when g.code is null then
+                       jsonb_build_object('status', 'not_found', 'code', i.code)
+                   when g.is_redeemed then
+                       jsonb_build_object('status', 'already_redeemed', 'code', i.code,
+                                          'redeemed_at', g.redeemed_at)
+                   else
+                       jsonb_build_object('status', 'expired', 'code', i.code, 'serial_number', g.serial_number,
+                                          'expiry_date', g.expiry_date)
+               end
+               order by i.ord), '[]'::jsonb)
+      into v_results
+      from items i
+      join first_items f on f.code = i.code
+      left join redeemed r on r.code = i.code
+      left join gift_codes g on g.code = i.code;
+
+    return v_results;
+end;
+$$;
@@ -0,0 +1,397 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from supabase_tool import (RedeemError, AVAILABLE, REDEEMED, NOT_FOUND, ALREADY_REDEEMED, EXPIRED,
+                           FULFILLMENT_PENDING, FULFILLMENT_FAILED, redeemed_or_raise, expiry_values,
+                           distribution_values, fulfillment_values)
+
+# gift_codes in a local SQLite file, for profiling and load tests without
+# Supabase (GIFT_CODES_BACKEND=sqlite, see local_backend.py). Same methods and
+# results as FakeSupabaseClient; redeem_gift_code(s) and the gift_code_stats
+# triggers follow the SQL in sql/, each redemption one UPDATE ... RETURNING in
+# a write transaction.
+# WAL mode lets several server processes share one file.
+
+DEFAULT_GIFT_CODES_PATH = "gift_codes.db"
+
+COLUMNS = ("code", "serial_number", "uploaded_at", "expiry_date", "distributed_to", "distributed_at",
+           "is_redeemed", "status", "redeemed_at", "recipient_email", "recipient_phone", "metadata", "card_value",
+           "fulfillment_status", "fulfillment_account", "fulfillment_reference", "fulfilled_at")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _today():
+    # Supabase's current_date is the UTC date
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _stats_events(row, sign):
+    """SELECT of row's (NEW or OLD) uploaded, distributed and redeemed events, each counted sign times"""
+    return f"""
+        SELECT substr({row}.uploaded_at, 1, 10) AS day, {row}.distributed_to AS distributed_to,
+               {row}.card_value AS card_value, {sign} AS uploaded, 0 AS distributed, 0 AS redeemed
+        UNION ALL
+        SELECT substr({row}.distributed_at, 1, 10), {row}.distributed_to, {row}.card_value, 0, {sign}, 0
+         WHERE {row}.distributed_at IS NOT NULL
+        UNION ALL
+        SELECT substr({row}.redeemed_at, 1, 10), {row}.distributed_to, {row}.card_value, 0, 0, {sign}
+         WHERE {row}.is_redeemed AND {row}.redeemed_at IS NOT NULL"""
+
+
+def _stats_capture(events):
+    """Trigger body appending the net change of events to gift_code_stats_changes"""
+    return f"""
+        INSERT INTO gift_code_stats_changes (day, distributed_to, card_value, uploaded, distributed, redeemed)
+        SELECT day, distributed_to, card_value, SUM(uploaded), SUM(distributed), SUM(redeemed)
+          FROM ({events})
+         GROUP BY day, distributed_to, card_value
+        HAVING SUM(uploaded) <> 0 OR SUM(distributed) <> 0 OR SUM(redeemed) <> 0;"""
+
+
+def _row_dict(row):
+    data = dict(row)
+    if "is_redeemed" in data:
+        data["is_redeemed"] = bool(data["is_redeemed"])
+    if data.get("metadata") is not None:
+        data["metadata"] = json.loads(data["metadata"])
+    return data
+
+
+class SqliteGiftCodes:
+
+    def __init__(self, db_path=DEFAULT_GIFT_CODES_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self):
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS gift_codes (
+                serial_number INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT NOT NULL UNIQUE,
+                uploaded_at TEXT NOT NULL,
+                expiry_date TEXT,
+                distributed_to TEXT,
+                distributed_at TEXT,
+                is_redeemed INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'available',
+                redeemed_at TEXT,
+                recipient_email TEXT,
+                recipient_phone TEXT,
+                metadata TEXT,
+                card_value REAL,
+                fulfillment_status TEXT,
+                fulfillment_account TEXT,
+                fulfillment_reference TEXT,
+                fulfilled_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_gift_codes_available_expiry
+                ON gift_codes (expiry_date, serial_number)
+                WHERE status = 'available' AND expiry_date IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_gift_codes_unfulfilled
+                ON gift_codes (redeemed_at, code)
+                WHERE is_redeemed AND fulfillment_status IN ('pending', 'failed');
+            CREATE TABLE IF NOT EXISTS gift_code_stats (
+                day TEXT NOT NULL,
+                distributed_to TEXT,
+                card_value REAL,
+                uploaded INTEGER NOT NULL,
+                distributed INTEGER NOT NULL,
+                redeemed INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS gift_code_stats_watermark (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                refreshed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS gift_code_stats_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                day TEXT NOT NULL,
+                distributed_to TEXT,
+                card_value REAL,
+                uploaded INTEGER NOT NULL,
+                distributed INTEGER NOT NULL,
+                redeemed INTEGER NOT NULL
+            );
+        """)
+        # the triggers of sql/code_stats.sql, per row since SQLite has no statement triggers
+        counted = ("uploaded_at", "distributed_to", "distributed_at", "card_value", "is_redeemed", "redeemed_at")
+        changed = " OR ".join(f"OLD.{name} IS NOT NEW.{name}" for name in counted)
+        self._connection().executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS gift_code_stats_insert AFTER INSERT ON gift_codes BEGIN
+                {_stats_capture(_stats_events("NEW", 1))}
+            END;
+            CREATE TRIGGER IF NOT EXISTS gift_code_stats_update AFTER UPDATE ON gift_codes WHEN {changed} BEGIN
+                {_stats_capture(_stats_events("OLD", -1) + " UNION ALL " + _stats_events("NEW", 1))}
+            END;
+            CREATE TRIGGER IF NOT EXISTS gift_code_stats_delete AFTER DELETE ON gift_codes BEGIN
+                {_stats_capture(_stats_events("OLD", -1))}
+            END;
+        """)
+
+    def _write(self, fn):
+        """Run fn(conn) in a write transaction"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _insert_params(codes, metadata, card_value, uploaded_at):
+        metadata = json.dumps(metadata) if metadata is not None else None
+        return [(code, uploaded_at, metadata, card_value) for code in codes]
+
+    def upload_codes(self, codes, metadata=None, card_value=None):
+        codes = list(codes)
+
+        def insert(conn):
+            before = conn.execute("SELECT COALESCE(MAX(serial_number), 0) FROM gift_codes").fetchone()[0]
+            try:
+                conn.executemany(
+                    "INSERT INTO gift_codes (code, uploaded_at, metadata, card_value) VALUES (?, ?, ?, ?)",
+                    self._insert_params(codes, metadata, card_value, _now()))
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"duplicate key value violates unique constraint: {e}") from e
+            return conn.execute("SELECT * FROM gift_codes WHERE serial_number > ? ORDER BY serial_number",
+                                (before,)).fetchall()
+        return [_row_dict(row) for row in self._write(insert)]
+
+    def insert_codes_batch(self, codes, metadata=None, card_value=None):
+        def insert(conn):
+            return conn.executemany(
+                "INSERT OR IGNORE INTO gift_codes (code, uploaded_at, metadata, card_value) VALUES (?, ?, ?, ?)",
+                self._insert_params(codes, metadata, card_value, _now())).rowcount
+        return self._write(insert)
+
+    @staticmethod
+    def _redeem(conn, code, recipient_email, recipient_phone, metadata):
+        """redeem_gift_code inside an open write transaction"""
+        row = conn.execute("""
+            UPDATE gift_codes
+               SET is_redeemed = 1, status = 'redeemed', redeemed_at = ?, recipient_email = ?,
+                   recipient_phone = ?, metadata = ?, fulfillment_status = 'pending'
+             WHERE code = ? AND status = 'available' AND is_redeemed = 0
+               AND (expiry_date IS NULL OR expiry_date >= ?)
+            RETURNING code, serial_number, redeemed_at, expiry_date, card_value
+        """, (_now(), recipient_email, recipient_phone, json.dumps(metadata) if metadata is not None else None,
+              code, _today())).fetchone()
+        if row is not None:
+            return {"status": REDEEMED, **dict(row)}
+
+        row = conn.execute("SELECT serial_number, is_redeemed, status, redeemed_at, expiry_date FROM gift_codes "
+                           "WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            return {"status": NOT_FOUND, "code": code}
+        if row["is_redeemed"]:
+            return {"status": ALREADY_REDEEMED, "code": code, "redeemed_at": row["redeemed_at"]}
+        if row["status"] == AVAILABLE:
+            conn.execute("UPDATE gift_codes SET status = 'expired' WHERE code = ?", (code,))
+        return {"status": EXPIRED, "code": code, "serial_number": row["serial_number"],
+                "expiry_date": row["expiry_date"]}
+
+    def redeem_gift_code(self, p_code, p_recipient_email, p_recipient_phone, p_metadata=None):
+        """Same contract as the redeem_gift_code SQL function"""
+        return self._write(lambda conn: self._redeem(conn, p_code, p_recipient_email, p_recipient_phone, p_metadata))
+
+    def redeem_gift_codes(self, p_items):
+        """Same contract as the redeem_gift_codes SQL function, in one transaction"""
+        return self._write(lambda conn: [
+            self._redeem(conn, item["code"], item["recipient_email"], item["recipient_phone"], item.get("metadata"))
+            for item in p_items])
+
+    def redeem_codes(self, items):
+        outcomes = []
+        for item, result in zip(items, self.redeem_gift_codes(items)):
+            try:
+                outcomes.append(redeemed_or_raise(item["code"], result))
+            except RedeemError as e:
+                outcomes.append(e)
+        return outcomes
+
+    def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
+        result = self.redeem_gift_code(code, recipient_email, recipient_phone, metadata)
+        return redeemed_or_raise(code, result)
+
+    def iter_codes(self, after_serial=0, page_size=1000, columns="code, serial_number", distributed_to=None):
+        names = [c.strip() for c in columns.split(",")]
+        if names != ["*"] and not set(names) <= set(COLUMNS):
+            raise ValueError(f"Unknown gift_codes columns: {columns}")
+        select = "*" if names == ["*"] else ", ".join(names)
+        conn = self._connection()
+        while True:
+            query = f"SELECT {select}, serial_number AS _serial FROM gift_codes WHERE serial_number > ?"
+            params = [after_serial]
+            if distributed_to is not None:
+                query += " AND distributed_to = ?"
+                params.append(distributed_to)
+            rows = conn.execute(query + " ORDER BY serial_number LIMIT ?", (*params, page_size)).fetchall()
+            for row in rows:
+                data = _row_dict(row)
+                after_serial = data.pop("_serial")
+                yield data
+            if len(rows) < page_size:
+                return
+
+    def ping(self):
+        self._connection().execute("SELECT 1").fetchone()
+
+    def count_codes(self):
+        return self._connection().execute("SELECT COUNT(*) FROM gift_codes").fetchone()[0]
+
+    def refresh_code_stats(self, full=False):
+        """refresh_gift_code_stats: fold in gift_code_stats_changes, or rebuild if full or never refreshed"""
+        started = _now()
+
+        def refresh(conn):
+            watermark = conn.execute("SELECT refreshed_at FROM gift_code_stats_watermark").fetchone()
+            days = rebuild(conn) if full or watermark is None else apply_changes(conn)
+            conn.execute("INSERT OR REPLACE INTO gift_code_stats_watermark (id, refreshed_at) VALUES (1, ?)",
+                         (started,))
+            return days
+
+        def apply_changes(conn):
+            groups = conn.execute("""
+                SELECT day, distributed_to, card_value, SUM(uploaded) AS uploaded,
+                       SUM(distributed) AS distributed, SUM(redeemed) AS redeemed
+                  FROM gift_code_stats_changes
+                 GROUP BY day, distributed_to, card_value
+            """).fetchall()
+            conn.execute("DELETE FROM gift_code_stats_changes")
+            for group in groups:
+                counts = (group["uploaded"], group["distributed"], group["redeemed"])
+                key = (group["day"], group["distributed_to"], group["card_value"])
+                updated = conn.execute("""
+                    UPDATE gift_code_stats
+                       SET uploaded = uploaded + ?, distributed = distributed + ?, redeemed = redeemed + ?
+                     WHERE day = ? AND distributed_to IS ? AND card_value IS ?
+                """, (*counts, *key)).rowcount
+                if not updated:
+                    conn.execute("INSERT INTO gift_code_stats (day, distributed_to, card_value, uploaded, "
+                                 "distributed, redeemed) VALUES (?, ?, ?, ?, ?, ?)", (*key, *counts))
+            conn.execute("DELETE FROM gift_code_stats WHERE uploaded = 0 AND distributed = 0 AND redeemed = 0")
+            return len({group["day"] for group in groups})
+
+        def rebuild(conn):
+            conn.execute("DELETE FROM gift_code_stats_changes")
+            conn.execute("DELETE FROM gift_code_stats")
+            conn.execute("""
+                INSERT INTO gift_code_stats (day, distributed_to, card_value, uploaded, distributed, redeemed)
+                SELECT day, distributed_to, card_value, SUM(event = 'uploaded'), SUM(event = 'distributed'),
+                       SUM(event = 'redeemed')
+                  FROM (SELECT substr(uploaded_at, 1, 10) AS day, distributed_to, card_value, 'uploaded' AS event
+                          FROM gift_codes
+                        UNION ALL
+                        SELECT substr(distributed_at, 1, 10), distributed_to, card_value, 'distributed'
+                          FROM gift_codes WHERE distributed_at IS NOT NULL
+                        UNION ALL
+                        SELECT substr(redeemed_at, 1, 10), distributed_to, card_value, 'redeemed'
+                          FROM gift_codes WHERE is_redeemed AND redeemed_at IS NOT NULL)
+                 GROUP BY day, distributed_to, card_value
+            """)
+            return conn.execute("SELECT COUNT(DISTINCT day) FROM gift_code_stats").fetchone()[0]
+        return {"refreshed": True, "days": self._write(refresh), "refreshed_at": started}
+
+    def iter_code_stats(self, since=None, until=None, page_size=1000):
+        """Offset pages of gift_code_stats, like SupabaseClient.iter_code_stats"""
+        offset = 0
+        while True:
+            rows = self._connection().execute("""
+                SELECT * FROM gift_code_stats
+                 WHERE (? IS NULL OR day >= ?) AND (? IS NULL OR day <= ?)
+                 ORDER BY day, COALESCE(distributed_to, ''), COALESCE(card_value, 0), rowid
+                 LIMIT ? OFFSET ?
+            """, (since, since, until, until, page_size, offset)).fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < page_size:
+                return
+            offset += page_size
+
+    def record_fulfillment(self, code, status, account=None, reference=None):
+        values = fulfillment_values(status, account, reference)
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        self._write(lambda conn: conn.execute(f"UPDATE gift_codes SET {assignments} WHERE code = ?",
+                                              (*values.values(), code)))
+
+    def iter_unfulfilled(self, since=None, before=None, page_size=500):
+        """Keyset pages in (redeemed_at, code) order, like SupabaseClient.iter_unfulfilled"""
+        after = (None, None)
+        while True:
+            rows = self._connection().execute("""
+                SELECT * FROM gift_codes
+                 WHERE is_redeemed AND fulfillment_status IN (?, ?)
+                   AND (? IS NULL OR redeemed_at >= ?) AND (? IS NULL OR redeemed_at < ?)
+                   AND (? IS NULL OR (redeemed_at, code) > (?, ?))
+                 ORDER BY redeemed_at, code
+                 LIMIT ?
+            """, (FULFILLMENT_PENDING, FULFILLMENT_FAILED, since, since, before, before, after[0], *after,
+                  page_size)).fetchall()
+            for row in rows:
+                yield _row_dict(row)
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]["redeemed_at"], rows[-1]["code"])
+
+    def reset_code(self, code):
+        self._write(lambda conn: conn.execute("""
+            UPDATE gift_codes
+               SET is_redeemed = 0, status = 'available', recipient_email = NULL, recipient_phone = NULL,
+                   redeemed_at = NULL, fulfillment_status = NULL, fulfillment_account = NULL,
+                   fulfillment_reference = NULL, fulfilled_at = NULL
+             WHERE code = ?
+        """, (code,)))
+
+    def update_range(self, start_serial, end_serial, values):
+        unknown = set(values) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown gift_codes columns: {sorted(unknown)}")
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        return self._write(lambda conn: conn.execute(
+            f"UPDATE gift_codes SET {assignments} WHERE serial_number BETWEEN ? AND ? AND is_redeemed = 0",
+            (*values.values(), start_serial, end_serial)).rowcount)
+
+    def update_expiry(self, start_serial, end_serial, new_expiry_date):
+        return self.update_range(start_serial, end_serial, expiry_values(new_expiry_date))
+
+    def distribute_cards(self, start_serial, end_serial, distributed_to, distributed_at=None):
+        return self.update_range(start_serial, end_serial, distribution_values(distributed_to, distributed_at))
+
+    def max_serial(self):
+        return self._connection().execute("SELECT COALESCE(MAX(serial_number), 0) FROM gift_codes").fetchone()[0]
+
+    def expired_code_range(self):
+        """Same contract as the expired_code_range SQL function"""
+        row = self._connection().execute("""
+            SELECT MIN(serial_number) AS min, MAX(serial_number) AS max, COUNT(*) AS count
+              FROM gift_codes
+             WHERE status = 'available' AND expiry_date IS NOT NULL AND expiry_date < ?
+        """, (_today(),)).fetchone()
+        return dict(row)
+
+    def sweep_code_status(self, start_serial, end_serial):
+        """Same contract as the sweep_code_status SQL function"""
+        return self._write(lambda conn: conn.execute("""
+            UPDATE gift_codes
+               SET status = CASE WHEN is_redeemed THEN 'redeemed' ELSE 'expired' END
+             WHERE serial_number BETWEEN ? AND ? AND status = 'available'
+               AND (is_redeemed OR expiry_date < ?)
+        """, (start_serial, end_serial, _today())).rowcount)
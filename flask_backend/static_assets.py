@@ -0,0 +1,154 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+# Serves the redeem page built by build_static.py, in front of the app.
+#
+# Every file in the dist directory and its .gz/.br variants is read into memory
+# at startup, with its headers worked out once. A request for one of them is
+# answered by the WSGI/ASGI wrapper before Flask or Starlette sees it: no
+# routing, request hooks, CORS headers or metrics, just a dict lookup, so the
+# workers stay free for /redeem.
+#
+#   STATIC_DIST_DIR=../frontend/dist   # unset dist directory: the app serves ../frontend as before
+#
+# Fingerprinted files (redeem.<hash>.js) are cached for a year as immutable;
+# the HTML pages are revalidated on every load with their ETag (304 if unchanged).
+
+DEFAULT_DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "dist")
+INDEX_PAGE = "redeem.html"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_HASHED = re.compile(r"\.[0-9a-f]{10}\.[a-z0-9]+$")
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _accepted_encodings(header):
+    """Codings from an Accept-Encoding header, without those given q=0"""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison, as for GET
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class StaticAssets:
+    """The files of a build_static.py dist directory, by URL path"""
+
+    def __init__(self, dist_dir=DEFAULT_DIST_DIR, index_page=INDEX_PAGE):
+        self.dist_dir = dist_dir
+        self.files = {}  # "/redeem.<hash>.js" -> {coding: (body, headers)}
+        for name in sorted(os.listdir(dist_dir)):
+            if name == "manifest.json" or name.endswith((".gz", ".br")):
+                continue
+            self.files["/" + name] = self._load(name)
+        if "/" + index_page in self.files:
+            self.files["/"] = self.files["/" + index_page]
+        with open(os.path.join(dist_dir, "manifest.json")) as file:
+            self.manifest = json.load(file)
+
+    def _load(self, name):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        cache_control = IMMUTABLE if _HASHED.search(name) else REVALIDATE
+        variants = {}
+        for coding, suffix in (("identity", ""),) + _ENCODINGS:
+            path = os.path.join(self.dist_dir, name + suffix)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as file:
+                body = file.read()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            headers = [("Content-Type", content_type), ("Cache-Control", cache_control), ("ETag", etag),
+                       ("Vary", "Accept-Encoding")]
+            if coding != "identity":
+                headers.append(("Content-Encoding", coding))
+            variants[coding] = (body, etag, headers)
+        return variants
+
+    def response(self, path, method, accept_encoding=None, if_none_match=None):
+        """(status, headers, body) for a GET/HEAD of path, None if it isn't a static file"""
+        variants = self.files.get(path)
+        if variants is None or method not in ("GET", "HEAD"):
+            return None
+        accepted = _accepted_encodings(accept_encoding)
+        coding = next((c for c, _ in _ENCODINGS if c in accepted and c in variants), "identity")
+        body, etag, headers = variants[coding]
+        if _etag_matches(if_none_match, etag):
+            return 304, headers, b""
+        return 200, headers + [("Content-Length", str(len(body)))], b"" if method == "HEAD" else body
+
+    def stats(self):
+        return {"files": len(self.files), "bytes": sum(len(body) for variants in self.files.values()
+                                                       for body, _, _ in variants.values())}
+
+
+_STATUS_LINES = {200: "200 OK", 304: "304 Not Modified"}
+
+
+class StaticAssetsWSGI:
+    """WSGI wrapper answering static file requests before the wrapped app (app.py)"""
+
+    def __init__(self, app, assets):
+        self.app = app
+        self.assets = assets
+
+    def __call__(self, environ, start_response):
+        found = self.assets.response(environ.get("PATH_INFO", ""), environ.get("REQUEST_METHOD"),
+                                     environ.get("HTTP_ACCEPT_ENCODING"), environ.get("HTTP_IF_NONE_MATCH"))
+        if found is None:
+            return self.app(environ, start_response)
+        status, headers, body = found
+        start_response(_STATUS_LINES[status], headers)
+        return [body]
+
+
+class StaticAssetsASGI:
+    """ASGI middleware answering static file requests before the wrapped app (asgi_app.py)"""
+
+    def __init__(self, app, assets):
+        self.app = app
+        self.assets = assets
+
+    async def __call__(self, scope, receive, send):
+        found = None
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            accept_encoding = headers.get(b"accept-encoding", b"").decode("latin-1")
+            if_none_match = headers.get(b"if-none-match", b"").decode("latin-1")
+            found = self.assets.response(scope["path"], scope["method"], accept_encoding, if_none_match)
+        if found is None:
+            return await self.app(scope, receive, send)
+        status, headers, body = found
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def static_assets_from_env():
+    """StaticAssets over STATIC_DIST_DIR, or None if build_static.py hasn't been run"""
+    dist_dir = os.getenv("STATIC_DIST_DIR") or DEFAULT_DIST_DIR
+    if not os.path.exists(os.path.join(dist_dir, "manifest.json")):
+        return None
+    return StaticAssets(dist_dir)
@@ -1,16 +1,263 @@
-from datetime import datetime, timezone
+import asyncio
+from datetime import date, datetime, timezone
+import logging
 import supabase
+from postgrest import CountMethod, ReturnMethod
+from code_changes import UPLOADED, RESET, EXPIRY
+from metrics import REGISTRY
+from single_flight import SingleFlight, AsyncSingleFlight
 
 # columns: code, serial_number, uploaded_at, expiry_date, distributed_to, distributed_at
 # is_redeemed, redeemed_at, recipient_email, recipient_phone, metadata, card_value
+# fulfillment_status, fulfillment_account, fulfillment_reference, fulfilled_at (sql/fulfillment_status.sql)
+# status (sql/code_status.sql)
 
 # uploaded_at, redeemed_at and distributed_at are TIMESTAMPTZ
 # expiry_date is a DATE
 
-class SupabaseClient(supabase.Client):
+logger = logging.getLogger(__name__)
 
-    def __init__(self, url, key):
+REDEEM_TOTAL = REGISTRY.counter(
+    "gift_code_redeem_total", "Redeem attempts by outcome and where the outcome was decided",
+    ["outcome", "source"])
+SUPABASE_SECONDS = REGISTRY.histogram(
+    "supabase_call_seconds", "Latency of Supabase calls", ["operation"])
+
+# redeem_gift_code statuses
+REDEEMED = "redeemed"
+NOT_FOUND = "not_found"
+ALREADY_REDEEMED = "already_redeemed"
+EXPIRED = "expired"
+
+# gift_codes.status values: available, or REDEEMED / EXPIRED as above
+AVAILABLE = "available"
+
+# fulfillment_status values
+FULFILLMENT_PENDING = "pending"    # set by redeem_gift_code, gift cards queued
+FULFILLED = "fulfilled"            # every gift card bought
+FULFILLMENT_FAILED = "failed"      # nothing bought, retries used up; reconcile.py retries
+FULFILLMENT_REVIEW = "review"      # a purchase may have gone through, check CleanCloud by hand
+
+
+class RedeemError(ValueError):
+    """A code could not be redeemed, reason is one of the redeem_gift_code statuses"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def not_found_message(code):
+    return f"Code '{code}' not found in database."
+
+
+MONTHS = ("January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December")
+
+
+def _format_utc_timestamp(value):
+    """'2025-03-04T15:06:07.123+00:00' -> 'March 04, 2025 at 03:06 PM UTC', None if not UTC ISO"""
+    # PostgREST returns timestamptz in UTC, so slicing is enough and no datetime is built
+    if len(value) < 16 or value[4] != "-" or value[10] != "T" or not value.endswith(("+00:00", "Z")):
+        return None
+    try:
+        month, hour = int(value[5:7]), int(value[11:13])
+    except ValueError:
+        return None
+    if not 1 <= month <= 12:
+        return None
+    return (f"{MONTHS[month - 1]} {value[8:10]}, {value[0:4]} at "
+            f"{(hour - 1) % 12 + 1:02d}:{value[14:16]} {'AM' if hour < 12 else 'PM'} UTC")
+
+
+def already_redeemed_message(code, redeemed_at):
+    if not redeemed_at:
+        # Fallback if no timestamp is available
+        return f"Code '{code}' has already been redeemed."
+    formatted_time = _format_utc_timestamp(redeemed_at) if isinstance(redeemed_at, str) else None
+    if formatted_time is not None:
+        return f"Code '{code}' has already been redeemed on {formatted_time}."
+    try:
+        # Handle ISO format with or without 'Z'
+        redeemed_datetime = datetime.fromisoformat(redeemed_at.replace('Z', '+00:00'))
+        # Format as a readable date and time
+        formatted_time = redeemed_datetime.strftime("%B %d, %Y at %I:%M %p UTC")
+    except (ValueError, TypeError):
+        # Fallback if timestamp parsing fails
+        formatted_time = redeemed_at
+    return f"Code '{code}' has already been redeemed on {formatted_time}."
+
+
+def redeemed_or_raise(code, result):
+    """Return the redeem_gift_code result, or raise RedeemError for a failed redemption"""
+    status = result.get("status") if result else NOT_FOUND
+
+    if status == REDEEMED:
+        return result
+
+    if status == NOT_FOUND:
+        raise RedeemError(NOT_FOUND, not_found_message(code))
+
+    if status == ALREADY_REDEEMED:
+        raise RedeemError(ALREADY_REDEEMED, already_redeemed_message(code, result.get("redeemed_at")))
+
+    if status == EXPIRED:
+        raise RedeemError(EXPIRED, f"Code '{code}' has expired on {result.get('expiry_date')}.")
+
+    raise ValueError(f"Unexpected redeem status for code '{code}': {status}")
+
+
+def card_value(result, default):
+    """The redeemed code's card_value from the redeem_gift_code result, default if it has none"""
+    value = result.get("card_value") if result else None
+    return float(value) if value is not None else default
+
+
+def fulfillment_values(status, account=None, reference=None):
+    values = {"fulfillment_status": status, "fulfillment_account": account, "fulfillment_reference": reference}
+    if status == FULFILLED:
+        values["fulfilled_at"] = datetime.now(timezone.utc).isoformat()
+    return values
+
+
+def expiry_values(new_expiry_date):
+    # Ensure new_expiry_date is a date object for DATE field
+    if isinstance(new_expiry_date, datetime):
+        new_expiry_date = new_expiry_date.date()
+    # status follows the new date, so moving it into the future makes expired codes available again
+    status = EXPIRED if new_expiry_date < date.today() else AVAILABLE
+    return {"expiry_date": new_expiry_date.isoformat(), "status": status}
+
+
+def distribution_values(distributed_to, distributed_at=None):
+    if distributed_at is None:
+        distributed_at = datetime.now(timezone.utc).isoformat()
+    return {"distributed_to": distributed_to, "distributed_at": distributed_at}
+
+
+class RedeemPathMixin:
+    """Steps of redeem_code around the database call, shared by the sync and async clients"""
+
+    def _init_redeem_path(self, outcome_cache, single_flight, changes=None):
+        # optional outcome_cache.OutcomeCache / RedisOutcomeCache of known-bad codes
+        self.outcome_cache = outcome_cache
+        # optional code_changes.CodeChanges, where changes are announced to other processes
+        self.changes = changes
+        # concurrent redemptions of one code share a single database call
+        self.single_flight = single_flight
+        # optional code_index.CodeIndex, set after construction since it pages through this client
+        self.code_index = None
+
+    def _upload_floor(self):
+        """Before an insert: a serial every row it adds will be above, if uploads are announced"""
+        # serials come from a sequence, so rows inserted from now on get larger ones than any committed
+        return self.max_serial() if self.changes is not None else None
+
+    def _codes_uploaded(self, codes, floor):
+        if self.outcome_cache is not None:
+            self.outcome_cache.invalidate(codes)
+        if self.code_index is not None:
+            self.code_index.add(codes)
+        if self.changes is not None:
+            self.changes.record(UPLOADED, after_serial=floor)
+
+    def _codes_reset(self, codes):
+        if self.outcome_cache is not None:
+            self.outcome_cache.invalidate(codes)
+        if self.changes is not None:
+            self.changes.record(RESET, codes=list(codes))
+
+    def _expiry_changed(self, start_serial, end_serial):
+        if self.outcome_cache is not None:
+            self.outcome_cache.invalidate_serials(start_serial, end_serial)
+        if self.changes is not None:
+            self.changes.record(EXPIRY, start_serial=start_serial, end_serial=end_serial)
+
+    def _check_known_outcome(self, code):
+        """Raise RedeemError if the code can be rejected without asking the database"""
+        # Codes the index has never seen don't exist, no need to ask the database
+        if self.code_index is not None and not self.code_index.might_contain(code):
+            REDEEM_TOTAL.inc(outcome=NOT_FOUND, source="index")
+            raise RedeemError(NOT_FOUND, not_found_message(code))
+
+        # Codes already known to be missing, redeemed or expired never reach the database
+        if self.outcome_cache is not None:
+            cached = self.outcome_cache.get(code)
+            if cached is not None:
+                REDEEM_TOTAL.inc(outcome=cached[0], source="cache")
+                raise RedeemError(*cached)
+
+    @staticmethod
+    def _redeem_params(code, recipient_email, recipient_phone, metadata):
+        return {
+            "p_code": code,
+            "p_recipient_email": recipient_email,
+            "p_recipient_phone": recipient_phone,
+            "p_metadata": metadata,
+        }
+
+    def _finish_redeem(self, code, data, shared=False):
+        """Turn the redeem_gift_code result into a return value or RedeemError
+
+        shared is True for callers that waited on a concurrent call for the same
+        code; if that call redeemed it, they lost the race.
+        """
+        source = "coalesced" if shared else "database"
+        if shared and data and data.get("status") == REDEEMED:
+            data = {"status": ALREADY_REDEEMED, "code": code, "redeemed_at": data.get("redeemed_at")}
+        try:
+            result = redeemed_or_raise(code, data)
+            REDEEM_TOTAL.inc(outcome=REDEEMED, source=source)
+        except RedeemError as e:
+            REDEEM_TOTAL.inc(outcome=e.reason, source=source)
+            if self.outcome_cache is not None and not shared:
+                # the serial lets an expiry change drop only the entries of its range
+                self.outcome_cache.put(code, e.reason, str(e), data.get("serial_number") if data else None)
+            raise
+        # later submissions of this code are answered from the cache
+        if self.outcome_cache is not None:
+            self.outcome_cache.put(code, ALREADY_REDEEMED, already_redeemed_message(code, result.get("redeemed_at")),
+                                   result.get("serial_number"))
+        logger.debug("Redeemed %s", code)
+        return result
+
+    def _known_outcomes(self, items):
+        """Per item, the RedeemError if it can be rejected without the database, else None"""
+        outcomes = []
+        for item in items:
+            try:
+                self._check_known_outcome(item["code"])
+                outcomes.append(None)
+            except RedeemError as e:
+                outcomes.append(e)
+        return outcomes
+
+    @staticmethod
+    def _batch_params(items):
+        return {"p_items": [{
+            "code": item["code"],
+            "recipient_email": item["recipient_email"],
+            "recipient_phone": item["recipient_phone"],
+            "metadata": item.get("metadata"),
+        } for item in items]}
+
+    def _finish_batch(self, items, outcomes, data):
+        """Fill in the outcomes still None from the redeem_gift_codes results, which are in item order"""
+        results = iter(data or [])
+        for i, outcome in enumerate(outcomes):
+            if outcome is None:
+                try:
+                    outcomes[i] = self._finish_redeem(items[i]["code"], next(results, None))
+                except RedeemError as e:
+                    outcomes[i] = e
+        return outcomes
+
+
+class SupabaseClient(RedeemPathMixin, supabase.Client):
+
+    def __init__(self, url, key, outcome_cache=None, changes=None):
         super().__init__(url, key)
+        self._init_redeem_path(outcome_cache, SingleFlight(), changes)
 
     def upload_codes(self, codes, metadata = None, card_value = None):
         # Prepare all data for bulk insert
@@ -25,129 +272,254 @@ class SupabaseClient(supabase.Client):
             bulk_data.append(data)
 
         try:
+            floor = self._upload_floor()
             response = self.table("gift_codes").insert(bulk_data).execute()
-            print(f"✅ Successfully inserted {len(codes)} codes in bulk")
+            logger.info("Inserted %d codes in bulk", len(codes))
+            self._codes_uploaded(codes, floor)
             return response.data
         except Exception as e:
             error_message = e.message if hasattr(e, 'message') else str(e)
-            print(f"❌ Error bulk inserting codes: {error_message}")
+            logger.error("Error bulk inserting codes: %s", error_message)
             raise e
 
+    def insert_codes_batch(self, codes, metadata=None, card_value=None):
+        """Insert one batch, skipping codes that already exist. Returns the number inserted"""
+        bulk_data = [{"code": code, "metadata": metadata} for code in codes]
+        if card_value is not None:
+            for data in bulk_data:
+                data["card_value"] = card_value
+        floor = self._upload_floor()
+        # ignore_duplicates -> ON CONFLICT (code) DO NOTHING; only a count comes back, not the rows
+        response = self.table("gift_codes").upsert(
+            bulk_data, on_conflict="code", ignore_duplicates=True,
+            count=CountMethod.exact, returning=ReturnMethod.minimal,
+        ).execute()
+        self._codes_uploaded(codes, floor)
+        return response.count if response.count is not None else len(codes)
+
     def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
-        check_res = self.table("gift_codes").select("*").eq("code", code).execute()
-        rows = check_res.data
+        self._check_known_outcome(code)
 
-        if not rows:
-            raise ValueError(f"Code '{code}' not found in database.")
+        # One round trip: the redeem_gift_code function (sql/redeem_gift_code.sql)
+        # validates and updates the row atomically and returns a status code
+        def call():
+            with SUPABASE_SECONDS.time(operation="redeem_gift_code"):
+                return self.rpc("redeem_gift_code", self._redeem_params(
+                    code, recipient_email, recipient_phone, metadata)).execute().data
 
-        row = rows[0]
-        if row.get("is_redeemed"):
-            redeemed_at = row.get("redeemed_at")
-            if redeemed_at:
-                # Parse the timestamp and format it nicely
-                try:
-                    if isinstance(redeemed_at, str):
-                        # Handle ISO format with or without 'Z'
-                        redeemed_datetime = datetime.fromisoformat(redeemed_at.replace('Z', '+00:00'))
-                    else:
-                        redeemed_datetime = redeemed_at
-                    
-                    # Format as a readable date and time
-                    formatted_time = redeemed_datetime.strftime("%B %d, %Y at %I:%M %p UTC")
-                    raise ValueError(f"Code '{code}' has already been redeemed on {formatted_time}.")
-                except (ValueError, TypeError):
-                    # Fallback if timestamp parsing fails
-                    raise ValueError(f"Code '{code}' has already been redeemed on {redeemed_at}.")
-            else:
-                # Fallback if no timestamp is available
-                raise ValueError(f"Code '{code}' has already been redeemed.")
-        
-        expiry_date = row.get("expiry_date")
-        if expiry_date:
-            # expiry_date is a DATE field, so we compare with today's date
-            from datetime import date
-            if isinstance(expiry_date, str):
-                expiry_date_obj = datetime.fromisoformat(expiry_date.replace('Z', '')).date()
-            else:
-                expiry_date_obj = expiry_date
-            
-            if date.today() > expiry_date_obj:
-                raise ValueError(f"Code '{code}' has expired on {expiry_date_obj}.")
-
-        data = {
-            "is_redeemed": True,
-            "redeemed_at": datetime.now(timezone.utc).isoformat(),
-            "recipient_email": recipient_email,
-            "recipient_phone": recipient_phone,
-            "metadata": metadata
-        }
-        
-        try:
-            response = self.table("gift_codes").update(data)\
-                .eq("code", code).eq("is_redeemed", False).execute()
-            # response: postgrest.base_request_builder.APIResponse[TypeVar]
-            # response.data: list of dicts
-            # response.data[0]: dict with the updated row
-            data = response.data
-            if not data:
-                raise ValueError(f"Code {code} not found or already redeemed.")
-            updated_row = data[0]
-            print(f"✅ Redeemed {code} for email {recipient_email}")
-            print(f"Updated row: {updated_row}")
-        except Exception as e:
-            raise e
+        data, shared = self.single_flight.do(code, call)
+        return self._finish_redeem(code, data, shared)
     
+    def redeem_codes(self, items):
+        """Redeem many codes with one redeem_gift_codes call (sql/redeem_gift_codes.sql)
+
+        items are dicts with code, recipient_email, recipient_phone and optional
+        metadata. Returns, per item, the redeem result or the RedeemError.
+        """
+        outcomes = self._known_outcomes(items)
+        pending = [item for item, outcome in zip(items, outcomes) if outcome is None]
+        data = []
+        if pending:
+            with SUPABASE_SECONDS.time(operation="redeem_gift_codes"):
+                data = self.rpc("redeem_gift_codes", self._batch_params(pending)).execute().data
+        return self._finish_batch(items, outcomes, data)
+
+    def iter_codes(self, after_serial=0, page_size=1000, columns="code, serial_number", distributed_to=None):
+        """Yield rows with serial_number > after_serial, in serial order
+
+        Keyset pagination on serial_number, so each page is an index range scan
+        no matter how deep into the table it is. columns must include serial_number.
+        """
+        while True:
+            query = self.table("gift_codes").select(columns).gt("serial_number", after_serial)
+            if distributed_to is not None:
+                query = query.eq("distributed_to", distributed_to)
+            rows = query.order("serial_number").limit(page_size).execute().data
+            if not rows:
+                return
+            yield from rows
+            after_serial = rows[-1]["serial_number"]
+            if len(rows) < page_size:
+                return
+
+    def ping(self):
+        """One cheap read, so the pooled HTTP connection to PostgREST is open before traffic arrives"""
+        with SUPABASE_SECONDS.time(operation="ping"):
+            self.table("gift_codes").select("serial_number").limit(1).execute()
+
+    def count_codes(self):
+        response = self.table("gift_codes").select("code", count=CountMethod.exact, head=True).execute()
+        return response.count or 0
+
+    def refresh_code_stats(self, full=False):
+        """Bring gift_code_stats up to date (sql/code_stats.sql); returns {"refreshed", "days", "refreshed_at"}"""
+        with SUPABASE_SECONDS.time(operation="refresh_gift_code_stats"):
+            return self.rpc("refresh_gift_code_stats", {"p_full": full}).execute().data
+
+    def iter_code_stats(self, since=None, until=None, page_size=1000):
+        """Yield gift_code_stats rows with since <= day <= until (ISO dates, either may be None)
+
+        The summary has one row per day, partner and card value, so plain
+        offset paging is enough here.
+        """
+        offset = 0
+        while True:
+            query = self.table("gift_code_stats").select("*")
+            if since is not None:
+                query = query.gte("day", since)
+            if until is not None:
+                query = query.lte("day", until)
+            rows = query.order("day").order("distributed_to").order("card_value")\
+                .range(offset, offset + page_size - 1).execute().data
+            yield from rows
+            if len(rows) < page_size:
+                return
+            offset += page_size
+
+    def record_fulfillment(self, code, status, account=None, reference=None):
+        """Store the fulfillment outcome of a redeemed code on its row"""
+        with SUPABASE_SECONDS.time(operation="record_fulfillment"):
+            self.table("gift_codes").update(
+                fulfillment_values(status, account, reference), returning=ReturnMethod.minimal
+            ).eq("code", code).execute()
+
+    def iter_unfulfilled(self, since=None, before=None, page_size=500):
+        """Yield redeemed rows still pending or failed, in (redeemed_at, code) order
+
+        redeemed_at >= since and < before. Keyset pagination over the partial
+        index from sql/fulfillment_status.sql, so only unfulfilled rows are read.
+        """
+        columns = "code, redeemed_at, card_value, recipient_email, recipient_phone, fulfillment_status"
+        after = None
+        while True:
+            query = self.table("gift_codes").select(columns).eq("is_redeemed", True)\
+                .in_("fulfillment_status", [FULFILLMENT_PENDING, FULFILLMENT_FAILED])
+            if since is not None:
+                query = query.gte("redeemed_at", since)
+            if before is not None:
+                query = query.lt("redeemed_at", before)
+            if after is not None:
+                query = query.or_(f'redeemed_at.gt."{after[0]}",'
+                                  f'and(redeemed_at.eq."{after[0]}",code.gt."{after[1]}")')
+            rows = query.order("redeemed_at").order("code").limit(page_size).execute().data
+            if not rows:
+                return
+            yield from rows
+            after = (rows[-1]["redeemed_at"], rows[-1]["code"])
+            if len(rows) < page_size:
+                return
+
     # For testing only
     def reset_code(self, code):
         try:
             response = self.table("gift_codes").update({
                 "is_redeemed": False,
+                "status": AVAILABLE,
                 "recipient_email": None,
                 "recipient_phone": None,
-                "redeemed_at": None
+                "redeemed_at": None,
+                **fulfillment_values(None),
+                "fulfilled_at": None
             }).eq("code", code).execute()
+            self._codes_reset([code])
             if response.data:
-                print(f"✅ Reset {code} successfully.")
+                logger.info("Reset %s", code)
             else:
-                print(f"❌ Code {code} not found or not redeemed.")
+                logger.warning("Code %s not found or not redeemed", code)
         except Exception as e:
             error_message = e.message if hasattr(e, 'message') else str(e)
-            print(f"❌ Error resetting {code}: {error_message}")
+            logger.error("Error resetting %s: %s", code, error_message)
+
+    def update_range(self, start_serial, end_serial, values):
+        """Update unredeemed codes in [start_serial, end_serial]; returns the number of rows changed
+
+        Only the count comes back (return=minimal), not the modified rows. Raises on error.
+        """
+        response = self.table("gift_codes").update(
+            values, count=CountMethod.exact, returning=ReturnMethod.minimal
+        ).gte("serial_number", start_serial).lte("serial_number", end_serial).eq("is_redeemed", False).execute()
+
+        if "expiry_date" in values:
+            self._expiry_changed(start_serial, end_serial)
+        return response.count or 0
+
+    def max_serial(self):
+        rows = self.table("gift_codes").select("serial_number").order("serial_number", desc=True).limit(1).execute().data
+        return rows[0]["serial_number"] if rows else 0
+
+    def expired_code_range(self):
+        """Serial range of available codes past their expiry date (sql/code_status.sql)
+
+        Returns {"min", "max", "count"}; min and max are None when there are none.
+        """
+        with SUPABASE_SECONDS.time(operation="expired_code_range"):
+            return self.rpc("expired_code_range", {}).execute().data
+
+    def sweep_code_status(self, start_serial, end_serial):
+        """Mark the redeemed and expired codes in [start_serial, end_serial]; returns the number marked"""
+        with SUPABASE_SECONDS.time(operation="sweep_code_status"):
+            return self.rpc("sweep_code_status",
+                            {"p_from_serial": start_serial, "p_to_serial": end_serial}).execute().data or 0
 
     def update_expiry(self, start_serial, end_serial, new_expiry_date: datetime):
         # update all codes in the range [start_serial, end_serial] that are not redeemed
         try:
-            # Ensure new_expiry_date is a date object for DATE field
-            if isinstance(new_expiry_date, datetime):
-                expiry_value = new_expiry_date.date().isoformat()
+            updated = self.update_range(start_serial, end_serial, expiry_values(new_expiry_date))
+            if updated:
+                logger.info("Updated expiry date for %d codes from %s to %s", updated, start_serial, end_serial)
             else:
-                expiry_value = new_expiry_date.isoformat()
-                
-            response = self.table("gift_codes").update({
-                "expiry_date": expiry_value
-            }).gte("serial_number", start_serial).lte("serial_number", end_serial).eq("is_redeemed", False).execute()
-
-            if response.data:
-                print(f"✅ Updated expiry date for codes from {start_serial} to {end_serial}.")
-            else:
-                print(f"❌ No codes found in the range {start_serial} to {end_serial} that are not redeemed.")
+                logger.warning("No unredeemed codes found in the range %s to %s", start_serial, end_serial)
+            return updated
         except Exception as e:
             error_message = e.message if hasattr(e, 'message') else str(e)
-            print(f"❌ Error updating expiry date: {error_message}")
+            logger.error("Error updating expiry date: %s", error_message)
     
     def distribute_cards(self, start_serial, end_serial, distributed_to, distributed_at=None):
-        if distributed_at is None:
-            distributed_at = datetime.now(timezone.utc).isoformat()
         try:
-            response = self.table("gift_codes").update({
-                "distributed_to": distributed_to,
-                "distributed_at": distributed_at
-            }).gte("serial_number", start_serial).lte("serial_number", end_serial).eq("is_redeemed", False).execute()
-
-            if response.data:
-                print(f"✅ Distributed codes from {start_serial} to {end_serial} to {distributed_to}.")
+            updated = self.update_range(start_serial, end_serial,
+                                        distribution_values(distributed_to, distributed_at))
+            if updated:
+                logger.info("Distributed %d codes from %s to %s to %s", updated, start_serial, end_serial, distributed_to)
             else:
-                print(f"❌ No codes found in the range {start_serial} to {end_serial} that are not redeemed.")
+                logger.warning("No unredeemed codes found in the range %s to %s", start_serial, end_serial)
+            return updated
         except Exception as e:
             error_message = e.message if hasattr(e, 'message') else str(e)
-            print(f"❌ Error distributing cards: {error_message}")
+            logger.error("Error distributing cards: %s", error_message)
+
+
+class AsyncSupabaseClient(RedeemPathMixin, supabase.AsyncClient):
+    """Async redemption path for asgi_app.py; same checks, cache and index as SupabaseClient"""
+
+    def __init__(self, url, key, outcome_cache=None, changes=None):
+        super().__init__(url, key)
+        self._init_redeem_path(outcome_cache, AsyncSingleFlight(), changes)
+
+    async def redeem_code(self, code, recipient_email, recipient_phone, metadata=None):
+        # the outcome cache may be Redis, so its calls run in the default thread pool
+        await asyncio.to_thread(self._check_known_outcome, code)
+
+        async def call():
+            with SUPABASE_SECONDS.time(operation="redeem_gift_code"):
+                response = await self.rpc("redeem_gift_code", self._redeem_params(
+                    code, recipient_email, recipient_phone, metadata)).execute()
+            return response.data
+
+        data, shared = await self.single_flight.do(code, call)
+        return await asyncio.to_thread(self._finish_redeem, code, data, shared)
+
+    async def ping(self):
+        """SupabaseClient.ping"""
+        with SUPABASE_SECONDS.time(operation="ping"):
+            await self.table("gift_codes").select("serial_number").limit(1).execute()
+
+    async def redeem_codes(self, items):
+        """SupabaseClient.redeem_codes"""
+        outcomes = await asyncio.to_thread(self._known_outcomes, items)
+        pending = [item for item, outcome in zip(items, outcomes) if outcome is None]
+        data = []
+        if pending:
+            with SUPABASE_SECONDS.time(operation="redeem_gift_codes"):
+                response = await self.rpc("redeem_gift_codes", self._batch_params(pending)).execute()
+            data = response.data
+        return await asyncio.to_thread(self._finish_batch, items, outcomes, data)
@@ -0,0 +1,64 @@
+import dataclasses
+import importlib
+import json
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """app.py on the in-memory gift codes store, with the fulfillment queue under a temp dir"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("app"))
+        for name, value in {"SUPABASE_URL": "http://127.0.0.1:9", "SUPABASE_KEY": "x",
+                            "GIFT_CODES_BACKEND": "memory", "FULFILLMENT_WORKERS": "0",
+                            "RATE_LIMIT_BACKEND": "none", "CODE_INDEX_ENABLED": "false",
+                            "CODE_CHANGES_PATH": "none"}.items():
+            patch.setenv(name, value)
+        yield importlib.import_module("app")
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("body", ["[1, 2]", '"CODE"', "null", "not json"])
+def test_redeem_rejects_a_body_that_is_not_an_object(client, body):
+    response = client.post("/redeem", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_job_status_shows_the_code_only_to_partners_and_admins(app_module, client, monkeypatch):
+    config = app_module.config
+    monkeypatch.setattr(config, "_current", dataclasses.replace(config.current(), admin_api_token="admin-token"))
+    job_id = app_module.fulfillment_queue.enqueue("CODE1", {"recipient_email": "a@example.com"})
+
+    public = client.get(f"/redeem/status/{job_id}").get_json()
+    assert public == {"success": True, "job_id": job_id, "status": "pending", "attempts": 0}
+
+    admin = client.get(f"/redeem/status/{job_id}", headers={"Authorization": "Bearer admin-token"}).get_json()
+    assert admin["code"] == "CODE1"
+    assert "last_error" in admin
+
+
+def test_batch_wait_is_capped_below_the_worker_timeout(app_module, client, monkeypatch):
+    config = app_module.config
+    monkeypatch.setattr(config, "_current", dataclasses.replace(
+        config.current(), admin_api_token="admin-token", redeem_batch_wait_seconds=120))
+    monkeypatch.setattr(app_module, "THREAD_WAIT_SECONDS", 0.2)
+    monkeypatch.setattr(app_module, "POLL_INTERVAL", 0.05)
+    app_module.supabase.store.upload_codes(["BATCH1"])
+
+    started = time.monotonic()
+    response = client.post("/redeem/batch?wait=true", headers={"Authorization": "Bearer admin-token"},
+                           json={"items": [{"code": "BATCH1", "recipient_email": "a@example.com",
+                                            "recipient_phone": "+6591234567"}]})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    # no fulfillment workers run here, so the job stays pending until the cap
+    assert time.monotonic() - started < 5
+    assert lines[0]["success"] is True
+    assert lines[-1]["fulfillment_pending"] == 1
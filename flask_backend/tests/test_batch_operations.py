@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+import pytest
+
+from batch_operations import overlap_groups, read_range_operations, run_range_operations
+from local_backend import LocalSupabaseClient
+from sqlite_gift_codes import SqliteGiftCodes
+
+
+def distribute(start, end, partner):
+    return {"operation": "distribute", "start_serial": start, "end_serial": end, "value": partner}
+
+
+def test_overlapping_ranges_of_one_operation_share_a_group():
+    operations = [distribute(1, 500, "A"), distribute(501, 1000, "B"), distribute(400, 600, "C"),
+                  {"operation": "expiry", "start_serial": 1, "end_serial": 1000, "value": "2030-01-01"},
+                  distribute(2000, 2100, "D")]
+    assert sorted(overlap_groups(operations)) == [[0, 1, 2], [3], [4]]
+
+
+class SlowClient(LocalSupabaseClient):
+    """Updates take a random time, so groups run in parallel finish in any order"""
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.active = 0
+        self.most_active = 0
+        self._lock = threading.Lock()
+
+    def update_range(self, start_serial, end_serial, values):
+        with self._lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(random.uniform(0.005, 0.02))
+        try:
+            return super().update_range(start_serial, end_serial, values)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_last_overlapping_range_in_the_file_wins(tmp_path):
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    store.upload_codes([f"CODE{i}" for i in range(1, 41)])
+    operations = [distribute(1, 20, "A"), distribute(21, 40, "B"), distribute(15, 25, "C"),
+                  distribute(18, 19, "D"), distribute(30, 32, "E"), distribute(31, 31, "F")]
+
+    client = SlowClient(store)
+    summary = run_range_operations(client, operations, max_workers=8)
+
+    assert summary["failed"] == 0
+    assert [r["rows_affected"] for r in summary["operations"]] == [20, 20, 11, 2, 3, 1]
+    partners = {row["serial_number"]: row["distributed_to"]
+                for row in store.iter_codes(columns="serial_number, distributed_to")}
+    expected = {}
+    for operation in operations:
+        for serial in range(operation["start_serial"], operation["end_serial"] + 1):
+            expected[serial] = operation["value"]
+    assert partners == expected
+
+
+def test_disjoint_ranges_run_concurrently(tmp_path):
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    store.upload_codes([f"CODE{i}" for i in range(1, 81)])
+    client = SlowClient(store)
+    run_range_operations(client, [distribute(i, i + 9, f"P{i}") for i in range(1, 81, 10)], max_workers=8)
+    assert client.most_active > 1
+
+
+def test_unknown_operation_is_reported_with_its_line(tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text("operation,start_serial,end_serial,value\ndistribute,1,5,A\nrefund,6,9,B\n")
+    with pytest.raises(ValueError, match=r"ranges.csv:3: unknown operation 'refund'"):
+        read_range_operations(str(path))
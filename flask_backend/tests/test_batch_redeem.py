@@ -0,0 +1,27 @@
+import pytest
+
+from batch_redeem import BatchRedemption, parse_batch
+
+VALID = {"code": "CODE1", "recipient_email": "a@example.com", "recipient_phone": "+6591234567"}
+
+
+@pytest.mark.parametrize("item", [
+    {**VALID, "recipient_email": 42},
+    {**VALID, "recipient_phone": ["+6591234567"]},
+    {**VALID, "recipient_email": ""},
+    {**VALID, "code": {"code": "CODE1"}},
+    {"code": "CODE1"},
+    "CODE1",
+])
+def test_invalid_item_gets_its_own_400(item):
+    batch = BatchRedemption([VALID, item], {})
+    assert batch.valid == [0]
+    assert batch.lines[1]["status"] == 400
+    assert batch.lines[1]["reason"] == "invalid_request"
+
+
+@pytest.mark.parametrize("body, status", [
+    (None, 400), ([VALID], 400), ({"items": []}, 400), ({"items": [VALID] * 3}, 413)])
+def test_parse_batch_rejects_the_whole_body(body, status):
+    items, error = parse_batch(body, max_items=2)
+    assert items is None and error[1] == status
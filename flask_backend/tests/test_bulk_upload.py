@@ -0,0 +1,73 @@
+import json
+import threading
+
+import pytest
+
+from bulk_upload import UploadCheckpoint, upload_stream
+
+
+class Client:
+    """insert_codes_batch stand-in that can fail from a given code on"""
+
+    def __init__(self, fail_on=None):
+        self.codes = []
+        self.fail_on = fail_on
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def insert_codes_batch(self, codes, metadata=None, card_value=None):
+        with self._lock:
+            self.calls += 1
+            if self.fail_on in codes:
+                raise ConnectionError("connection reset")
+            new = [code for code in codes if code not in self.codes]
+            self.codes.extend(new)
+            return len(new)
+
+
+CODES = [f"CODE{i:03d}" for i in range(25)]
+
+
+def test_crashed_upload_resumes_after_the_last_committed_batch(tmp_path):
+    checkpoint = str(tmp_path / "upload.checkpoint")
+    client = Client(fail_on="CODE012")
+    with pytest.raises(ConnectionError):
+        upload_stream(client, CODES, "codes.csv", batch_size=5, max_in_flight=1, checkpoint_path=checkpoint,
+                      max_retries=2, retry_delay=0)
+    with open(checkpoint) as file:
+        assert json.load(file)["committed_rows"] == 10
+
+    client.fail_on = None
+    client.calls = 0
+    summary = upload_stream(client, CODES, "codes.csv", batch_size=5, max_in_flight=1,
+                            checkpoint_path=checkpoint)
+
+    assert summary["resumed_from"] == 10
+    assert client.calls == 3
+    assert client.codes == CODES
+    assert not (tmp_path / "upload.checkpoint").exists()
+
+
+def test_replayed_rows_are_counted_as_skipped(tmp_path):
+    client = Client()
+    client.codes = CODES[:7]
+    summary = upload_stream(client, CODES, "codes.csv", batch_size=5, max_in_flight=3)
+    assert (summary["rows"], summary["inserted"], summary["skipped"]) == (25, 18, 7)
+    assert sorted(client.codes) == CODES
+
+
+def test_checkpoint_of_another_source_is_ignored(tmp_path):
+    path = str(tmp_path / "upload.checkpoint")
+    UploadCheckpoint(path, "old.csv").save(100)
+    assert UploadCheckpoint(path, "new.csv").committed_rows == 0
+    assert UploadCheckpoint(path, "old.csv").committed_rows == 100
+
+
+def test_checkpoint_never_passes_a_batch_that_failed(tmp_path):
+    checkpoint = str(tmp_path / "upload.checkpoint")
+    client = Client(fail_on="CODE001")
+    with pytest.raises(ConnectionError):
+        upload_stream(client, CODES, "codes.csv", batch_size=5, max_in_flight=4, checkpoint_path=checkpoint,
+                      max_retries=1, retry_delay=0)
+    # later batches may have been committed, but the first one wasn't
+    assert UploadCheckpoint(checkpoint, "codes.csv").committed_rows == 0
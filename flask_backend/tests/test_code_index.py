@@ -0,0 +1,146 @@
+import pytest
+
+from code_changes import CodeChanges, UPLOADED
+from code_index import CodeIndex
+from local_backend import LocalSupabaseClient
+from sqlite_gift_codes import SqliteGiftCodes
+from supabase_tool import RedeemError
+
+
+class Table:
+    """gift_codes stand-in: rows become visible when committed, in any serial order"""
+
+    def __init__(self):
+        self.rows = []
+        self.next_serial = 1
+
+    def reserve(self, code):
+        row = {"code": code, "serial_number": self.next_serial}
+        self.next_serial += 1
+        return row
+
+    def commit(self, *rows):
+        self.rows.extend(rows)
+
+    def iter_codes(self, after_serial):
+        return iter(sorted((row for row in self.rows if row["serial_number"] > after_serial),
+                           key=lambda row: row["serial_number"]))
+
+    def count_codes(self):
+        return len(self.rows)
+
+
+@pytest.fixture
+def table():
+    table = Table()
+    table.commit(*(table.reserve(f"CODE{i}") for i in range(10)))
+    return table
+
+
+def make_index(table, **options):
+    return CodeIndex(table.iter_codes, table.count_codes, min_capacity=1000, **options)
+
+
+def test_answers_maybe_until_built(table):
+    index = make_index(table)
+    assert index.might_contain("NOPE")
+    index.build()
+    assert index.might_contain("CODE3")
+    assert not index.might_contain("NOPE")
+
+
+def test_refresh_adds_new_codes(table):
+    index = make_index(table)
+    index.build()
+    table.commit(table.reserve("NEW1"), table.reserve("NEW2"))
+
+    assert index.refresh() == 2
+    assert index.might_contain("NEW1") and index.might_contain("NEW2")
+    assert index.last_serial == 12
+    assert index.refresh() == 0
+
+
+def test_refresh_finds_rows_committed_below_the_watermark(table):
+    index = make_index(table, rescan_serials=100)
+    index.build()
+    slow = table.reserve("SLOW")  # serial 11, committed last
+    fast = table.reserve("FAST")  # serial 12
+    table.commit(fast)
+    index.refresh()
+    assert not index.might_contain("SLOW")
+
+    table.commit(slow)
+    assert index.refresh() == 1
+    assert index.might_contain("SLOW")
+    assert index._filter.count == 12
+
+
+def test_late_commit_past_the_rescan_window_waits_for_the_rebuild(table):
+    index = make_index(table, rescan_serials=1, rebuild_seconds=3600)
+    index.build()
+    slow = table.reserve("SLOW")
+    table.commit(*(table.reserve(f"FAST{i}") for i in range(5)))
+    index.refresh()
+    table.commit(slow)
+
+    index.refresh()
+    assert not index.might_contain("SLOW")
+
+    index.last_build_at -= 3600
+    index.refresh()
+    assert index.might_contain("SLOW")
+
+
+@pytest.fixture
+def gift_codes(tmp_path):
+    """A server and an upload tool in separate processes: a client each on one store and journal"""
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    changes_path = str(tmp_path / "code_changes.log")
+    server = LocalSupabaseClient(store, changes=CodeChanges(changes_path))
+    uploader = LocalSupabaseClient(SqliteGiftCodes(store.db_path), changes=CodeChanges(changes_path))
+    uploader.insert_codes_batch([f"CODE{i}" for i in range(10)])
+    server.code_index = CodeIndex(server.iter_codes, server.count_codes, min_capacity=1000,
+                                  changes=server.changes)
+    server.code_index.build()
+    return server, uploader
+
+
+def test_code_uploaded_by_another_process_after_build_is_redeemable(gift_codes):
+    server, uploader = gift_codes
+    with pytest.raises(RedeemError):
+        server.redeem_code("LATE", "a@example.com", None)
+
+    uploader.insert_codes_batch(["LATE"])
+
+    # the index hasn't read the row yet, so the miss goes to the database
+    assert server.redeem_code("LATE", "a@example.com", None)["status"] == "redeemed"
+    assert server.code_index.refresh() == 1
+    assert server.code_index.might_contain("LATE")
+    assert not server.code_index.might_contain("NOPE")
+
+
+def test_announced_upload_far_below_the_watermark_is_read(gift_codes):
+    server, uploader = gift_codes
+    server.code_index.rescan_serials = 0
+    # rows committed below everything the index has read, as a slow batch would
+    uploader.store._connection().execute(
+        "INSERT INTO gift_codes (serial_number, code, uploaded_at) VALUES (0, 'SLOW', '2025-01-01')")
+    uploader.changes.record(UPLOADED, after_serial=-1)
+
+    assert server.code_index.might_contain("SLOW")
+    server.code_index.refresh()
+    assert server.code_index.might_contain("SLOW")
+
+
+def test_second_process_loads_the_snapshot_instead_of_paging(table, tmp_path):
+    snapshot_path = str(tmp_path / "code_index.snapshot")
+    first = make_index(table, snapshot_path=snapshot_path)
+    first.build()
+
+    pages = []
+    second = CodeIndex(lambda after: pages.append(after) or table.iter_codes(after), table.count_codes,
+                       min_capacity=1000, rescan_serials=2, snapshot_path=snapshot_path)
+    assert second.build() == 10
+    assert pages == [8]  # only the incremental rescan below the snapshot's watermark
+    assert second.might_contain("CODE7")
+    assert not second.might_contain("NOPE")
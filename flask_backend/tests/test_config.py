@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    """A .env and source accounts file under tmp_path, with the settings and callbacks restored afterwards"""
+    accounts = tmp_path / "accounts.txt"
+    accounts.write_text("# partners\nACC1\nACC2\n\nACC1\n")
+    dotenv = tmp_path / ".env"
+    dotenv.write_text(f"GIFT_CARD_AMOUNT=10\nGIFT_CARD_SOURCE_ACCOUNTS_FILE={accounts}\n")
+    monkeypatch.setattr(config, "find_dotenv", lambda: str(dotenv))
+    monkeypatch.setattr(config, "_PROCESS_ENV", {})
+    monkeypatch.setattr(config, "_reload_callbacks", [])
+    monkeypatch.setattr(config, "_current", None)
+    return dotenv, accounts
+
+
+def test_load_settings_parses_the_environment(tmp_path):
+    settings = config.load_settings({"PARTNER_API_TOKENS": " a, ,b ", "GIFT_CARD_AMOUNT": "25",
+                                     "GIFT_CARD_SOURCE_ACCOUNTS_FILE": str(tmp_path / "missing.txt")})
+    assert settings.partner_api_tokens == ("a", "b")
+    assert settings.gift_card_amount == 25.0
+    assert settings.source_accounts == ()
+
+
+def test_reload_picks_up_the_changed_files_and_calls_back(env_file):
+    dotenv, accounts = env_file
+    assert config.current().source_accounts == ("ACC1", "ACC2")
+    seen = []
+    config.on_reload(lambda settings: seen.append(settings.gift_card_amount))
+
+    dotenv.write_text(dotenv.read_text().replace("GIFT_CARD_AMOUNT=10", "GIFT_CARD_AMOUNT=20"))
+    accounts.write_text("ACC3\n")
+    config.reload()
+
+    assert config.current().gift_card_amount == 20.0
+    assert config.current().source_accounts == ("ACC3",)
+    assert seen == [20.0]
+
+
+def test_process_environment_wins_over_the_env_file(env_file, monkeypatch):
+    monkeypatch.setattr(config, "_PROCESS_ENV", {"GIFT_CARD_AMOUNT": "50"})
+    assert config.reload().gift_card_amount == 50.0
+
+
+def test_bad_reload_keeps_the_current_settings(env_file):
+    dotenv, _ = env_file
+    before = config.current()
+    called = []
+    config.on_reload(called.append)
+
+    dotenv.write_text(dotenv.read_text().replace("GIFT_CARD_AMOUNT=10", "GIFT_CARD_AMOUNT=ten"))
+    assert config.reload() is before
+    assert config.current() is before
+    assert called == []
+
+
+def test_failing_callback_does_not_stop_the_others(env_file):
+    called = []
+    config.on_reload(lambda settings: 1 / 0)
+    config.on_reload(called.append)
+    config.reload()
+    assert len(called) == 1
+
+
+def test_watcher_reloads_when_the_accounts_file_changes(env_file):
+    _, accounts = env_file
+    config.current()
+    watcher = config.ConfigWatcher(interval_seconds=0.01)
+    watcher.start()
+    try:
+        accounts.write_text("ACC9\n")
+        # make sure the mtime moves even on filesystems with coarse timestamps
+        os.utime(accounts, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+        deadline = time.monotonic() + 5
+        while config.current().source_accounts != ("ACC9",) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+    assert config.current().source_accounts == ("ACC9",)
+
+
+def test_watcher_reloads_on_request(env_file):
+    dotenv, _ = env_file
+    config.current()
+    watcher = config.ConfigWatcher(interval_seconds=0)
+    watcher.start()
+    try:
+        dotenv.write_text(dotenv.read_text().replace("GIFT_CARD_AMOUNT=10", "GIFT_CARD_AMOUNT=30"))
+        watcher.request_reload()
+        deadline = time.monotonic() + 5
+        while config.current().gift_card_amount != 30.0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+    assert config.current().gift_card_amount == 30.0
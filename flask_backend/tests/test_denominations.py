@@ -0,0 +1,41 @@
+import pytest
+
+from denominations import DenominationTable, parse_denominations
+
+
+def test_split_caps_each_card_at_the_max_amount():
+    table = DenominationTable(max_amount=50)
+    assert table.split(120) == (50.0, 50.0, 20.0)
+    assert table.split(12.5) == (12.5,)
+
+
+def test_split_uses_the_fewest_cards_of_the_denominations():
+    table = DenominationTable((10, 25))
+    assert table.split(45) == (25.0, 10.0, 10.0)
+    assert table.split(60) == (25.0, 25.0, 10.0)
+
+
+def test_split_beyond_the_precomputed_table():
+    table = DenominationTable((5, 10, 25, 50), max_value=100)
+    assert table.split(1005) == (50.0,) * 20 + (5.0,)
+
+
+def test_denominations_above_the_max_amount_are_dropped():
+    assert DenominationTable((5, 10, 100), max_amount=50).split(100) == (10.0,) * 10
+
+
+@pytest.mark.parametrize("amount", [0, -10, 0.001])
+def test_split_rejects_amounts_that_are_not_positive(amount):
+    with pytest.raises(ValueError):
+        DenominationTable().split(amount)
+
+
+@pytest.mark.parametrize("amount", [3, 7, 12.5, 1001])
+def test_split_rejects_amounts_the_denominations_cant_make(amount):
+    with pytest.raises(ValueError):
+        DenominationTable((5, 10, 25, 50), max_value=100).split(amount)
+
+
+def test_parse_denominations():
+    assert parse_denominations("5, 10,25") == (5.0, 10.0, 25.0)
+    assert parse_denominations(None) == ()
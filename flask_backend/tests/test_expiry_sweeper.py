@@ -0,0 +1,84 @@
+import pytest
+
+from expiry_sweeper import sweep
+from local_backend import LocalSupabaseClient
+from sqlite_gift_codes import SqliteGiftCodes
+
+PAST = "2020-01-01"
+FUTURE = "2999-01-01"
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Codes C1..C8: C2, C5 and C6 expired, C7 not yet, C3 redeemed"""
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    store.upload_codes([f"C{n}" for n in range(1, 9)])
+    store._write(lambda conn: conn.execute(
+        "UPDATE gift_codes SET expiry_date = ? WHERE code IN ('C2', 'C5', 'C6')", (PAST,)))
+    store._write(lambda conn: conn.execute("UPDATE gift_codes SET expiry_date = ? WHERE code = 'C7'", (FUTURE,)))
+    store.redeem_gift_code("C3", "a@example.com", "+6591234567")
+    return store
+
+
+def statuses(store):
+    rows = store._connection().execute("SELECT code, status FROM gift_codes ORDER BY serial_number")
+    return {row["code"]: row["status"] for row in rows}
+
+
+def test_marks_expired_codes_in_chunks(store):
+    summary = sweep(LocalSupabaseClient(store), chunk_size=2)
+    assert summary["candidates"] == 3
+    assert (summary["from_serial"], summary["to_serial"]) == (2, 6)
+    assert summary["chunks"] == 3  # 2-3, 4-5, 6
+    assert summary["marked"] == 3 and summary["failed_chunks"] == 0
+    assert statuses(store) == {"C1": "available", "C2": "expired", "C3": "redeemed", "C4": "available",
+                               "C5": "expired", "C6": "expired", "C7": "available", "C8": "available"}
+
+
+def test_second_sweep_has_nothing_to_do(store):
+    client = LocalSupabaseClient(store)
+    sweep(client)
+    summary = sweep(client)
+    assert summary["candidates"] == 0
+    assert summary["from_serial"] is None
+    assert (summary["chunks"], summary["marked"]) == (0, 0)
+
+
+def test_expired_code_is_rejected_after_sweep(store):
+    sweep(LocalSupabaseClient(store))
+    assert store.redeem_gift_code("C2", "a@example.com", "+6591234567")["status"] == "expired"
+
+
+def test_backfill_marks_codes_redeemed_before_the_migration(store):
+    # before the migration status was not kept up to date on redemption
+    store._write(lambda conn: conn.execute("UPDATE gift_codes SET status = 'available'"))
+    summary = sweep(LocalSupabaseClient(store), chunk_size=3, backfill=True)
+    assert summary["candidates"] is None
+    assert (summary["from_serial"], summary["to_serial"], summary["chunks"]) == (1, 8, 3)
+    assert summary["marked"] == 4
+    assert statuses(store)["C3"] == "redeemed"
+    assert statuses(store)["C7"] == "available"
+
+
+def test_failed_chunk_does_not_stop_the_sweep(store):
+    client = LocalSupabaseClient(store)
+    real = store.sweep_code_status
+
+    def flaky(start, end):
+        if start == 2:
+            raise RuntimeError("statement timeout")
+        return real(start, end)
+
+    client.sweep_code_status = flaky
+    summary = sweep(client, chunk_size=2)
+    assert (summary["chunks"], summary["failed_chunks"], summary["marked"]) == (3, 1, 2)
+    assert statuses(store)["C2"] == "available"
+    # the next sweep retries the range that failed
+    assert sweep(LocalSupabaseClient(store))["marked"] == 1
+
+
+def test_pause_between_chunks(store, monkeypatch):
+    pauses = []
+    monkeypatch.setattr("expiry_sweeper.time.sleep", pauses.append)
+    sweep(LocalSupabaseClient(store), chunk_size=2, pause_seconds=0.5)
+    assert pauses == [0.5, 0.5]
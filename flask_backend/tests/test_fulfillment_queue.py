@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+
+from fulfillment_queue import (FulfillmentQueue, FulfillmentWorkerPool, FulfillmentError, PENDING, RUNNING,
+                               SUCCEEDED, FAILED, PURCHASE_STARTED, standalone_worker_count)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+def test_concurrent_claims_take_each_job_once(db_path):
+    job_ids = FulfillmentQueue(db_path).enqueue_many("CODE1", [{"n": i} for i in range(20)])
+    # one queue object per thread, like separate worker processes sharing the file
+    claimed = []
+    lock = threading.Lock()
+
+    def drain():
+        queue = FulfillmentQueue(db_path)
+        while (job := queue.claim()) is not None:
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=drain) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_expired_lease_is_claimed_again(db_path):
+    queue = FulfillmentQueue(db_path, lease_seconds=0.05)
+    job_id = queue.enqueue("CODE1", {"amount": 10})
+    assert queue.claim()["id"] == job_id
+    assert queue.claim() is None  # still leased
+
+    time.sleep(0.1)  # the worker holding it "died"
+    job = FulfillmentQueue(db_path).claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_crash_mid_purchase_fails_for_review_without_buying_again(db_path):
+    queue = FulfillmentQueue(db_path, lease_seconds=0.05)
+    job_id = queue.enqueue("CODE1", {"amount": 10})
+    job = queue.claim()
+    assert queue.start_purchase(job["id"], job["code"]) is None
+    time.sleep(0.1)  # died after writing the ledger entry, before the purchase returned
+
+    calls = []
+    pool = FulfillmentWorkerPool(queue, calls.append)
+    pool.run_job(queue.claim())
+
+    assert calls == []
+    assert queue.get(job_id)["status"] == FAILED
+    assert queue.jobs_for_code("CODE1")[0]["purchase_status"] == PURCHASE_STARTED
+
+
+def test_bought_but_not_completed_is_completed_from_the_ledger(db_path):
+    queue = FulfillmentQueue(db_path, lease_seconds=0.05)
+    job_id = queue.enqueue("CODE1", {"amount": 10})
+    job = queue.claim()
+    queue.start_purchase(job["id"], job["code"])
+    queue.finish_purchase(job["id"], {"card": "GC-1"})
+    time.sleep(0.1)
+
+    calls = []
+    FulfillmentWorkerPool(queue, calls.append).run_job(queue.claim())
+
+    assert calls == []
+    assert queue.get(job_id)["status"] == SUCCEEDED
+    assert queue.get(job_id)["result"] == {"card": "GC-1"}
+
+
+def test_fulfillment_error_retries_and_clears_the_ledger(db_path):
+    queue = FulfillmentQueue(db_path, retry_delay=0)
+
+    def declined(payload):
+        raise FulfillmentError("declined")
+
+    job_id = queue.enqueue("CODE1", {"amount": 10})
+    FulfillmentWorkerPool(queue, declined).run_job(queue.claim())
+
+    job = queue.jobs_for_code("CODE1")[0]
+    assert job["status"] == PENDING
+    assert job["purchase_status"] is None
+    assert queue.claim()["id"] == job_id
+
+
+def test_counts_follow_status_changes(db_path):
+    queue = FulfillmentQueue(db_path)
+    first, second, third = queue.enqueue_many("CODE1", [{}, {}, {}])
+    assert queue.counts() == {PENDING: 3}
+
+    job = queue.claim()
+    assert queue.counts() == {PENDING: 2, RUNNING: 1}
+    queue.complete(job["id"])
+    job = queue.claim()
+    queue.fail(job["id"], job["attempts"], "declined", retry=False)
+
+    assert queue.counts() == {PENDING: 1, SUCCEEDED: 1, FAILED: 1}
+
+
+def test_counts_start_from_existing_jobs(db_path):
+    queue = FulfillmentQueue(db_path)
+    queue.enqueue_many("CODE1", [{}, {}])
+    conn = queue._connection()
+    conn.executescript("""
+        DROP TRIGGER fulfillment_jobs_count_insert;
+        DROP TRIGGER fulfillment_jobs_count_update;
+        DROP TRIGGER fulfillment_jobs_count_delete;
+        DROP TABLE fulfillment_job_counts;
+    """)
+
+    assert FulfillmentQueue(db_path).counts() == {PENDING: 2}
+
+
+def test_prune_keeps_codes_with_unfinished_or_failed_jobs(db_path):
+    queue = FulfillmentQueue(db_path)
+    done = queue.enqueue_many("DONE", [{}, {}])
+    partly = queue.enqueue_many("PARTLY", [{}, {}])
+    failed = queue.enqueue_many("FAILED", [{}, {}])
+    for job_id, code in [(done[0], "DONE"), (done[1], "DONE"), (partly[0], "PARTLY")]:
+        queue.start_purchase(job_id, code)
+        queue.finish_purchase(job_id, {})
+        queue.complete(job_id)
+    for job_id in failed:
+        queue.fail(job_id, 1, "declined", retry=False)
+
+    assert queue.prune(time.time() - 60) == 0
+    assert queue.prune(time.time() + 1, batch_size=1) == 1
+
+    assert queue.jobs_for_code("DONE") == []
+    assert queue._connection().execute("SELECT COUNT(*) FROM purchase_ledger WHERE code = 'DONE'").fetchone()[0] == 0
+    assert len(queue.jobs_for_code("PARTLY")) == 2
+    assert len(queue.jobs_for_code("FAILED")) == 2
+    assert queue.counts() == {SUCCEEDED: 1, PENDING: 1, FAILED: 2}
+
+
+def test_standalone_pool_runs_when_the_app_workers_are_off(monkeypatch):
+    monkeypatch.delenv("FULFILLMENT_QUEUE_WORKERS", raising=False)
+    monkeypatch.setenv("FULFILLMENT_WORKERS", "0")
+    assert standalone_worker_count() == 4
+
+    monkeypatch.setenv("FULFILLMENT_QUEUE_WORKERS", "6")
+    assert standalone_worker_count() == 6
+    assert standalone_worker_count(2) == 2
+    with pytest.raises(ValueError):
+        standalone_worker_count(-1)
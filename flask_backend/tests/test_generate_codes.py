@@ -0,0 +1,76 @@
+import csv
+import itertools
+
+import generate_codes
+from generate_codes import (CHARS, INDEX_KEY_BYTES, check_character, generate_code_batch, generate_gift_cards,
+                            index_key, is_valid_check_character)
+
+
+def read_codes(path):
+    with open(path, newline="") as file:
+        return [row["gift_code"] for row in csv.DictReader(file)]
+
+
+def test_codes_are_unique_across_runs(tmp_path):
+    csv_path, index_path = str(tmp_path / "gift_cards.csv"), str(tmp_path / "gift_cards.idx")
+    assert generate_gift_cards(300, csv_path, index_path, batch_size=100) == 300
+    assert generate_gift_cards(200, csv_path, index_path, batch_size=64) == 200
+
+    codes = read_codes(csv_path)
+    assert len(codes) == len(set(codes)) == 500
+    with open(index_path, "rb") as file:
+        index = file.read()
+    keys = [index[i:i + INDEX_KEY_BYTES] for i in range(0, len(index), INDEX_KEY_BYTES)]
+    assert keys == sorted(set(index_key(code) for code in codes))
+
+
+def test_colliding_codes_are_dropped_and_replaced(tmp_path, monkeypatch):
+    csv_path, index_path = str(tmp_path / "gift_cards.csv"), str(tmp_path / "gift_cards.idx")
+    generate_gift_cards(5, csv_path, index_path)
+    existing = read_codes(csv_path)
+
+    # the next run draws two existing codes and one code twice before random ones
+    fresh = generate_code_batch(10)
+    draws = iter([existing[0], existing[3], fresh[0], fresh[0]] + fresh[1:])
+    monkeypatch.setattr(generate_codes, "generate_code_batch",
+                        lambda count, length=16: list(itertools.islice(draws, count)))
+    assert generate_gift_cards(6, csv_path, index_path, batch_size=4) == 6
+
+    codes = read_codes(csv_path)
+    assert len(codes) == len(set(codes)) == 11
+    assert codes[:5] == existing
+
+
+def test_generated_codes_use_only_code_characters():
+    codes = generate_code_batch(1000)
+    assert all(len(code) == 16 and set(code) <= set(CHARS) for code in codes)
+    # 16,000 draws over 36 characters: every one of them shows up
+    assert set("".join(codes)) == set(CHARS)
+
+
+def test_check_character_catches_every_single_typo():
+    code = "K7QX2M9PLA4ZT0WB"
+    full = code + check_character(code)
+    assert is_valid_check_character(full)
+    for i in range(len(full)):
+        for char in CHARS:
+            if char != full[i]:
+                assert not is_valid_check_character(full[:i] + char + full[i + 1:])
+
+
+def test_check_character_catches_most_transpositions():
+    pairs = [(a, b) for a in CHARS for b in CHARS if a != b]
+    missed = 0
+    for a, b in pairs:
+        code = "K7QX2M9" + a + b + "A4ZT0WB"
+        swapped = "K7QX2M9" + b + a + "A4ZT0WB"
+        missed += is_valid_check_character(swapped + check_character(code))
+    # Luhn mod N only misses swaps of a few character pairs
+    assert missed / len(pairs) < 0.01
+
+
+def test_check_characters_with_the_csv_flag(tmp_path):
+    csv_path, index_path = str(tmp_path / "gift_cards.csv"), str(tmp_path / "gift_cards.idx")
+    generate_gift_cards(50, csv_path, index_path, add_check_character=True)
+    codes = read_codes(csv_path)
+    assert all(len(code) == 17 and is_valid_check_character(code) for code in codes)
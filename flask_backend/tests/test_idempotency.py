@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from idempotency import (IdempotencyStore, RedisIdempotencyStore, SqliteIdempotencyStore, idempotency_store_from_env,
+                         STARTED, REPLAY, IN_PROGRESS, MISMATCH)
+from local_redis import LocalRedis
+
+
+@pytest.fixture(params=["memory", "redis", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return IdempotencyStore()
+    if request.param == "redis":
+        return RedisIdempotencyStore(LocalRedis(), poll_interval=0.01)
+    return SqliteIdempotencyStore(str(tmp_path / "idempotency.db"), poll_interval=0.01)
+
+
+def test_finished_request_is_replayed(store):
+    assert store.begin("key", "fp") == (STARTED, None)
+    store.finish("key", {"status": "redeemed"}, 202)
+
+    assert store.begin("key", "fp") == (REPLAY, ({"status": "redeemed"}, 202))
+
+
+def test_key_reused_for_another_request_is_rejected(store):
+    store.begin("key", "fp")
+    assert store.begin("key", "other", wait_seconds=0) == (MISMATCH, None)
+    store.finish("key", {}, 202)
+    assert store.begin("key", "other") == (MISMATCH, None)
+
+
+def test_duplicate_reports_in_progress_after_waiting(store):
+    store.begin("key", "fp")
+    assert store.begin("key", "fp", wait_seconds=0) == (IN_PROGRESS, None)
+
+
+def test_duplicate_waits_for_the_first_response(store):
+    store.begin("key", "fp")
+    timer = threading.Timer(0.1, store.finish, ("key", {"status": "redeemed"}, 202))
+    timer.start()
+
+    assert store.begin("key", "fp", wait_seconds=5) == (REPLAY, ({"status": "redeemed"}, 202))
+    timer.join()
+
+
+def test_released_key_runs_again(store):
+    store.begin("key", "fp")
+    store.release("key")
+    assert store.begin("key", "fp", wait_seconds=0) == (STARTED, None)
+
+
+def test_sqlite_store_is_shared_and_claims_expire(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    first = SqliteIdempotencyStore(path, lock_seconds=0.1)
+    second = SqliteIdempotencyStore(path, lock_seconds=0.1)
+
+    assert first.begin("key", "fp") == (STARTED, None)
+    assert second.begin("key", "fp", wait_seconds=0) == (IN_PROGRESS, None)
+    time.sleep(0.15)  # the first process died without finishing
+    assert second.begin("key", "fp", wait_seconds=0) == (STARTED, None)
+    second.finish("key", {"status": "redeemed"}, 202)
+    assert first.begin("key", "fp") == (REPLAY, ({"status": "redeemed"}, 202))
+
+
+def test_per_process_store_refused_with_several_processes(monkeypatch):
+    monkeypatch.setenv("IDEMPOTENCY_BACKEND", "memory")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(ValueError):
+        idempotency_store_from_env()
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    assert isinstance(idempotency_store_from_env(), IdempotencyStore)
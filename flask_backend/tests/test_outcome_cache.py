@@ -0,0 +1,86 @@
+from datetime import date, timedelta
+
+import pytest
+
+from code_changes import CodeChanges
+from local_backend import LocalSupabaseClient
+from local_redis import LocalRedis
+from outcome_cache import OutcomeCache, RedisOutcomeCache
+from sqlite_gift_codes import SqliteGiftCodes
+from supabase_tool import RedeemError, NOT_FOUND, ALREADY_REDEEMED, EXPIRED
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_cache(request):
+    def make(changes=None):
+        if request.param == "memory":
+            return OutcomeCache(changes=changes)
+        return RedisOutcomeCache(LocalRedis(), changes=changes)
+    return make
+
+
+def test_expiry_change_drops_only_its_serial_range(make_cache):
+    cache = make_cache()
+    cache.put("IN", EXPIRED, "expired", 5)
+    cache.put("OUT", EXPIRED, "expired", 50)
+    cache.put("USED", ALREADY_REDEEMED, "redeemed", 6)
+
+    cache.invalidate_serials(1, 10)
+
+    assert cache.get("IN") is None
+    assert cache.get("OUT") == (EXPIRED, "expired")
+    assert cache.get("USED") == (ALREADY_REDEEMED, "redeemed")
+
+
+def test_journaled_changes_reach_a_cache_in_another_process(make_cache, tmp_path):
+    path = str(tmp_path / "code_changes.log")
+    cache = make_cache(CodeChanges(path))
+    cache.put("GONE", NOT_FOUND, "not found")
+    cache.put("USED", ALREADY_REDEEMED, "redeemed", 1)
+    cache.put("OLD", EXPIRED, "expired", 2)
+
+    CodeChanges(path).record("reset", codes=["USED"])
+    CodeChanges(path).record("expiry", start_serial=2, end_serial=2)
+    CodeChanges(path).record("uploaded", after_serial=2)
+
+    assert cache.get("GONE") is None
+    assert cache.get("USED") is None
+    assert cache.get("OLD") is None
+
+
+@pytest.fixture
+def clients(tmp_path):
+    """A server with an outcome cache and batch_operations.py in another process"""
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    changes_path = str(tmp_path / "code_changes.log")
+    server = LocalSupabaseClient(store, outcome_cache=OutcomeCache(changes=CodeChanges(changes_path)),
+                                 changes=CodeChanges(changes_path))
+    tool = LocalSupabaseClient(SqliteGiftCodes(store.db_path), changes=CodeChanges(changes_path))
+    tool.insert_codes_batch(["CODE1", "CODE2"])
+    return server, tool
+
+
+def test_reset_by_another_process_makes_the_code_redeemable(clients):
+    server, tool = clients
+    server.redeem_code("CODE1", "a@example.com", None)
+    with pytest.raises(RedeemError):
+        server.redeem_code("CODE1", "b@example.com", None)
+
+    tool.reset_code("CODE1")
+
+    assert server.redeem_code("CODE1", "b@example.com", None)["status"] == "redeemed"
+
+
+def test_expiry_extended_by_another_process_makes_the_code_redeemable(clients):
+    server, tool = clients
+    tool.update_expiry(1, 2, date.today() - timedelta(days=1))
+    for code in ("CODE1", "CODE2"):
+        with pytest.raises(RedeemError) as error:
+            server.redeem_code(code, "a@example.com", None)
+        assert error.value.reason == EXPIRED
+
+    tool.update_expiry(1, 1, date.today() + timedelta(days=30))
+
+    assert server.redeem_code("CODE1", "a@example.com", None)["status"] == "redeemed"
+    # outside the updated range the cached outcome still answers
+    assert server.outcome_cache.get("CODE2")[0] == EXPIRED
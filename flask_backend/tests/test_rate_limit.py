@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from local_redis import LocalRedis
+from rate_limit import (TokenBucketStore, RedisSlidingWindowStore, RateLimiter, RateLimited, client_ip,
+                        client_subnet, IP, CODE, FAILED)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now))
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_refills_at_the_rate(clock):
+    store = TokenBucketStore()
+    assert [store.hit("k", 3, 60) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert store.hit("k", 3, 60) == pytest.approx(20.0)
+
+    clock.now += 20
+    assert store.hit("k", 3, 60) == 0.0
+    assert store.hit("k", 3, 60) > 0
+
+
+def test_token_bucket_evicts_the_least_recently_used_key(clock):
+    store = TokenBucketStore(max_entries=2)
+    store.hit("a", 1, 60)
+    store.hit("b", 1, 60)
+    store.hit("a", 1, 60)
+    store.hit("c", 1, 60)
+    assert store.stats() == {"entries": 2}
+    # b was evicted with its spent token, a is still limited
+    assert store.remaining("a", 1, 60) < 1
+    assert store.remaining("b", 1, 60) == 1
+
+
+def test_sliding_window_weighs_the_previous_window(clock):
+    clock.now = 600.0  # start of a 60s window
+    store = RedisSlidingWindowStore(LocalRedis())
+    assert all(store.hit("k", 4, 60) == 0.0 for _ in range(4))
+    assert store.hit("k", 4, 60) > 0
+
+    # halfway through the next window half of the previous count still applies
+    clock.now += 90
+    assert store.remaining("k", 4, 60) == pytest.approx(2)
+    assert store.hit("k", 4, 60) == 0.0
+    assert store.hit("k", 4, 60) == 0.0
+    assert store.hit("k", 4, 60) == pytest.approx(30)
+
+
+def test_failed_budget_is_shared_by_a_subnet(clock):
+    limiter = RateLimiter({IP: TokenBucketStore(), CODE: TokenBucketStore(), FAILED: TokenBucketStore()},
+                          failed_budget=(2, 60))
+    limiter.record_failure("203.0.113.1")
+    limiter.record_failure("203.0.113.2")
+
+    with pytest.raises(RateLimited) as error:
+        limiter.check("203.0.113.99", "CODE")
+    assert error.value.scope == FAILED
+    limiter.check("198.51.100.1", "CODE")
+
+
+def test_client_subnet():
+    assert client_subnet("203.0.113.7") == "203.0.113.0/24"
+    assert client_subnet("2001:db8::1") == "2001:db8::/64"
+    assert client_subnet("not an ip") == "not an ip"
+
+
+def test_client_ip_is_unknown_behind_an_untrusted_proxy():
+    assert client_ip("10.0.0.1", None) == "10.0.0.1"
+    assert client_ip("10.0.0.1", "203.0.113.7") is None
+    assert client_ip("10.0.0.1", "198.51.100.1, 203.0.113.7", trusted_proxies=1) == "203.0.113.7"
+    assert client_ip("10.0.0.1", "198.51.100.1, 203.0.113.7", trusted_proxies=2) == "198.51.100.1"
@@ -0,0 +1,96 @@
+import pytest
+
+import config
+from fulfillment_queue import FulfillmentQueue
+from local_backend import LocalSupabaseClient
+from reconcile import reconcile, WATERMARK
+from sqlite_gift_codes import SqliteGiftCodes
+
+
+@pytest.fixture
+def setup(tmp_path):
+    """Codes OLD, MID and NEW redeemed on three days, a queue, and settings without denominations"""
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    client = LocalSupabaseClient(store)
+    queue = FulfillmentQueue(str(tmp_path / "queue.db"))
+    (tmp_path / "accounts.txt").write_text("ACC1\n")
+    settings = config.load_settings({"GIFT_CARD_SOURCE_ACCOUNTS_FILE": str(tmp_path / "accounts.txt")})
+    for day, code in (("01", "OLD"), ("02", "MID"), ("03", "NEW")):
+        store.upload_codes([code])
+        store.redeem_gift_code(code, "a@example.com", "+6591234567")
+        store._write(lambda conn: conn.execute("UPDATE gift_codes SET redeemed_at = ? WHERE code = ?",
+                                               (f"2025-01-{day}T00:00:00+00:00", code)))
+    return client, queue, settings
+
+
+def finish_jobs(queue, code, succeeded):
+    for job_id in queue.enqueue_many(code, [{"amount": 10}]):
+        job = queue.claim()
+        assert job["id"] == job_id
+        if succeeded:
+            queue.complete(job_id, {"account": "ACC1"})
+        else:
+            queue.fail(job_id, job["attempts"], "declined", retry=False)
+
+
+def scanned_codes(client, queue, settings, **options):
+    summary = reconcile(client, queue, settings, pause_seconds=0, **options)
+    return summary, queue.get_watermark(WATERMARK)
+
+
+def test_watermark_stops_at_the_oldest_unresolved_code(setup):
+    client, queue, settings = setup
+    finish_jobs(queue, "OLD", succeeded=True)
+    finish_jobs(queue, "MID", succeeded=False)
+    finish_jobs(queue, "NEW", succeeded=True)
+
+    summary, watermark = scanned_codes(client, queue, settings)
+    assert (summary["scanned"], summary["fulfilled"], summary["requeued"]) == (3, 2, 1)
+    # MID's jobs are pending again, so the next run starts there and skips OLD
+    assert watermark == "2025-01-02T00:00:00+00:00"
+
+    summary, _ = scanned_codes(client, queue, settings)
+    assert (summary["scanned"], summary["in_progress"]) == (1, 1)
+
+
+def test_watermark_moves_to_the_grace_cutoff_once_everything_is_resolved(setup):
+    client, queue, settings = setup
+    for code in ("OLD", "MID", "NEW"):
+        finish_jobs(queue, code, succeeded=True)
+
+    summary, watermark = scanned_codes(client, queue, settings)
+    assert summary["fulfilled"] == 3
+    assert watermark == summary["before"]
+    assert scanned_codes(client, queue, settings)[0]["scanned"] == 0
+
+
+def test_limit_leaves_the_watermark_at_the_last_code_scanned(setup):
+    client, queue, settings = setup
+    for code in ("OLD", "MID", "NEW"):
+        finish_jobs(queue, code, succeeded=True)
+
+    _, watermark = scanned_codes(client, queue, settings, limit=2)
+    assert watermark == "2025-01-02T00:00:00+00:00"
+    summary, _ = scanned_codes(client, queue, settings)
+    assert (summary["scanned"], summary["fulfilled"]) == (1, 1)
+
+
+def test_missing_codes_hold_the_watermark_and_dry_run_writes_nothing(setup):
+    client, queue, settings = setup
+    summary, watermark = scanned_codes(client, queue, settings, dry_run=True, create_missing=True)
+    assert summary["requeued"] == 3 and watermark is None
+    assert queue.jobs_for_code("OLD") == []
+
+    summary, watermark = scanned_codes(client, queue, settings)
+    assert summary["missing_codes"] == ["OLD", "MID", "NEW"]
+    assert watermark == "2025-01-01T00:00:00+00:00"
+
+    summary, _ = scanned_codes(client, queue, settings, create_missing=True)
+    assert summary["jobs_requeued"] == 3
+
+
+def test_from_start_ignores_the_watermark(setup):
+    client, queue, settings = setup
+    queue.set_watermark(WATERMARK, "2025-01-03T00:00:00+00:00")
+    assert scanned_codes(client, queue, settings)[0]["scanned"] == 1
+    assert scanned_codes(client, queue, settings, from_start=True)[0]["scanned"] == 3
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from sqlite_gift_codes import SqliteGiftCodes
+from supabase_tool import distribution_values
+
+
+def stats_rows(store):
+    return sorted(((row["day"], row["distributed_to"], row["card_value"], row["uploaded"], row["distributed"],
+                    row["redeemed"]) for row in store.iter_code_stats()), key=repr)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_folding_in_the_changes_matches_a_full_rebuild(tmp_path, seed):
+    rng = random.Random(seed)
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    store.refresh_code_stats()
+    codes = []
+    for step in range(60):
+        action = rng.choice(["upload", "distribute", "redeem", "reset", "move", "refresh"])
+        if action == "upload" or not codes:
+            batch = [f"S{seed}C{len(codes) + i}" for i in range(rng.randint(1, 20))]
+            store.upload_codes(batch, card_value=rng.choice([None, 10.0, 25.0]))
+            codes.extend(batch)
+        elif action == "distribute":
+            start = rng.randint(1, len(codes))
+            # re-distributing moves the counts to another partner and day
+            store.update_range(start, start + rng.randint(0, 10), distribution_values(
+                rng.choice(["alpha", "beta"]), f"2025-01-{rng.randint(1, 5):02d}T10:00:00+00:00"))
+        elif action == "redeem":
+            store.redeem_gift_code(rng.choice(codes), "a@example.com", "+6591234567")
+        elif action == "reset":
+            store.reset_code(rng.choice(codes))
+        elif action == "move":
+            store._write(lambda conn: conn.execute(
+                "UPDATE gift_codes SET uploaded_at = ? WHERE serial_number % 3 = ?",
+                (f"2024-12-{rng.randint(1, 31):02d}T08:00:00+00:00", rng.randint(0, 2))))
+        else:
+            store.refresh_code_stats()
+
+    store.refresh_code_stats()
+    folded = stats_rows(store)
+    store.refresh_code_stats(full=True)
+    assert folded == stats_rows(store)
+    assert sum(row[3] for row in folded) == len(codes)
+
+
+def test_first_refresh_rebuilds_rows_from_before_the_triggers(tmp_path):
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    store.upload_codes(["A", "B"])
+    # as if the rows had been there before the change log existed
+    store._write(lambda conn: conn.execute("DELETE FROM gift_code_stats_changes"))
+
+    store.refresh_code_stats()
+    assert sum(row[3] for row in stats_rows(store)) == 2
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(flight.do, "CODE1", fn) for _ in range(8)]
+        while flight.in_flight() == 0:
+            pass
+        # give the followers time to find the call in flight
+        threading.Event().wait(0.05)
+        release.set()
+        outcomes = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * 7
+    assert all(result == "result" for result, _ in outcomes)
+    assert flight.in_flight() == 0
+
+
+def test_error_is_raised_to_every_sharer_and_the_next_call_runs_again():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ConnectionError("database down")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, "CODE1", failing)
+        started.wait(5)
+        follower = executor.submit(flight.do, "CODE1", lambda: "not called")
+        threading.Event().wait(0.05)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ConnectionError):
+                future.result()
+
+    assert flight.do("CODE1", lambda: "fresh") == ("fresh", False)
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("A", lambda: 1) == (1, False)
+    assert flight.do("B", lambda: 2) == (2, False)
+
+
+def test_async_callers_share_one_call():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        outcomes = await asyncio.gather(*(flight.do("CODE1", fn) for _ in range(5)))
+        return calls, outcomes, flight.in_flight()
+
+    calls, outcomes, in_flight = asyncio.run(main())
+    assert len(calls) == 1
+    assert [shared for _, shared in outcomes] == [False, True, True, True, True]
+    assert in_flight == 0
+
+
+def test_async_follower_runs_the_call_when_the_leader_is_cancelled():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        leader = asyncio.ensure_future(flight.do("CODE1", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("CODE1", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, calls
+
+    (result, shared), calls = asyncio.run(main())
+    assert (result, shared) == (2, False)
+    assert len(calls) == 2
+
+
+def test_async_error_is_raised_to_every_sharer():
+    async def main():
+        flight = AsyncSingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("database down")
+
+        return await asyncio.gather(*(flight.do("CODE1", fn) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(outcome, ConnectionError) for outcome in asyncio.run(main()))
+
+
+def test_concurrent_redemptions_of_one_code_make_one_database_call(tmp_path):
+    from local_backend import LocalSupabaseClient
+    from sqlite_gift_codes import SqliteGiftCodes
+    from supabase_tool import RedeemError, ALREADY_REDEEMED
+
+    class SlowStore(SqliteGiftCodes):
+        calls = 0
+
+        def redeem_gift_code(self, *args, **kwargs):
+            SlowStore.calls += 1
+            threading.Event().wait(0.1)
+            return super().redeem_gift_code(*args, **kwargs)
+
+    store = SlowStore(str(tmp_path / "gift_codes.db"))
+    store.upload_codes(["SHARED"])
+    client = LocalSupabaseClient(store)
+
+    def redeem(i):
+        try:
+            return client.redeem_code("SHARED", f"user{i}@example.com", "+6591234567")["status"]
+        except RedeemError as e:
+            return e.reason
+
+    with ThreadPoolExecutor(6) as executor:
+        outcomes = list(executor.map(redeem, range(6)))
+
+    assert SlowStore.calls == 1
+    assert sorted(outcomes) == [ALREADY_REDEEMED] * 5 + ["redeemed"]
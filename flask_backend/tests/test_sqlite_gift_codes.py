@@ -0,0 +1,27 @@
+from sqlite_gift_codes import SqliteGiftCodes
+
+
+def test_iter_unfulfilled_pages_through_every_row_in_order(tmp_path):
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    codes = [f"CODE{i:02d}" for i in range(7)]
+    store.upload_codes(codes)
+    for code in codes:
+        store.redeem_gift_code(code, "a@example.com", "+6591234567")
+    # equal redeemed_at values are ordered by code across page boundaries
+    store._write(lambda conn: conn.execute("UPDATE gift_codes SET redeemed_at = '2025-01-01T00:00:00+00:00' "
+                                           "WHERE code IN ('CODE01', 'CODE02', 'CODE03')"))
+
+    rows = list(store.iter_unfulfilled(page_size=2))
+    assert sorted(row["code"] for row in rows) == codes
+    assert [row["code"] for row in rows[:3]] == ["CODE01", "CODE02", "CODE03"]
+    assert [(r["redeemed_at"], r["code"]) for r in rows] == sorted((r["redeemed_at"], r["code"]) for r in rows)
+
+
+def test_iter_code_stats_pages_through_every_row(tmp_path):
+    store = SqliteGiftCodes(str(tmp_path / "gift_codes.db"))
+    for value in (None, 5.0, 10.0, 25.0, 50.0):
+        store.upload_codes([f"V{value}"], card_value=value)
+    store.refresh_code_stats()
+
+    assert list(store.iter_code_stats(page_size=2)) == list(store.iter_code_stats())
+    assert len(list(store.iter_code_stats(page_size=2))) == 5
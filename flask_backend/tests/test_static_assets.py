@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import json
+
+import pytest
+
+import build_static
+from static_assets import IMMUTABLE, REVALIDATE, StaticAssets, StaticAssetsWSGI
+
+
+@pytest.fixture
+def frontend(tmp_path):
+    """A frontend directory with the assets and the page that links them"""
+    source = tmp_path / "frontend"
+    source.mkdir()
+    (source / "redeem.css").write_text("/* page */\nbody {\n  color: red;\n}\n")
+    (source / "redeem.js").write_text("// entry\nconsole.log(\"redeem\");\n")
+    (source / "redeem.html").write_text(
+        '<!-- page -->\n<link href="redeem.css">\n<script src="redeem.js"></script>\n')
+    return source
+
+
+def build(frontend, clean=False):
+    manifest, _ = build_static.build(str(frontend), clean=clean)
+    return manifest, frontend / "dist"
+
+
+def header(headers, name):
+    return dict(headers).get(name)
+
+
+def test_built_names_are_content_hashes(frontend):
+    manifest, dist = build(frontend)
+    for asset in build_static.ASSETS:
+        content = (dist / manifest[asset]).read_bytes()
+        assert manifest[asset] == build_static.hashed_name(asset, content)
+        assert hashlib.sha256(content).hexdigest()[:10] in manifest[asset]
+        assert gzip.decompress((dist / (manifest[asset] + ".gz")).read_bytes()) == content
+    assert json.loads((dist / "manifest.json").read_text()) == manifest
+
+
+def test_page_links_the_hashed_assets(frontend):
+    manifest, dist = build(frontend)
+    html = (dist / "redeem.html").read_text()
+    assert f'href="{manifest["redeem.css"]}"' in html
+    assert f'src="{manifest["redeem.js"]}"' in html
+    assert "<!--" not in html
+
+
+def test_changed_source_gets_a_new_name(frontend):
+    first, dist = build(frontend)
+    (frontend / "redeem.js").write_text("console.log(\"changed\");\n")
+    second, _ = build(frontend)
+    assert second["redeem.js"] != first["redeem.js"]
+    assert second["redeem.css"] == first["redeem.css"]
+    # pages still open in a browser may load the old file until they are reloaded
+    assert (dist / first["redeem.js"]).exists()
+
+    build(frontend, clean=True)
+    assert not (dist / first["redeem.js"]).exists()
+
+
+def test_cache_control(frontend):
+    manifest, dist = build(frontend)
+    assets = StaticAssets(str(dist))
+    status, headers, _ = assets.response("/" + manifest["redeem.js"], "GET")
+    assert status == 200
+    assert header(headers, "Cache-Control") == IMMUTABLE
+    status, headers, _ = assets.response("/redeem.html", "GET")
+    assert header(headers, "Cache-Control") == REVALIDATE
+    assert assets.response("/", "GET")[2] == (dist / "redeem.html").read_bytes()
+    assert assets.manifest == manifest
+
+
+def test_etag_revalidation(frontend):
+    _, dist = build(frontend)
+    assets = StaticAssets(str(dist))
+    _, headers, _ = assets.response("/redeem.html", "GET")
+    etag = header(headers, "ETag")
+    assert assets.response("/redeem.html", "GET", if_none_match=etag)[::2] == (304, b"")
+    assert assets.response("/redeem.html", "GET", if_none_match="W/" + etag)[0] == 304
+    assert assets.response("/redeem.html", "GET", if_none_match='"stale"')[0] == 200
+
+
+def test_encoding_negotiation(frontend):
+    manifest, dist = build(frontend)
+    assets = StaticAssets(str(dist))
+    path = "/" + manifest["redeem.css"]
+    content = (dist / manifest["redeem.css"]).read_bytes()
+
+    _, headers, body = assets.response(path, "GET", accept_encoding="gzip")
+    assert header(headers, "Content-Encoding") == "gzip"
+    assert header(headers, "Vary") == "Accept-Encoding"
+    assert gzip.decompress(body) == content
+
+    _, headers, body = assets.response(path, "GET", accept_encoding="gzip;q=0, identity")
+    assert header(headers, "Content-Encoding") is None
+    assert body == content
+
+
+def test_head_and_other_methods(frontend):
+    _, dist = build(frontend)
+    assets = StaticAssets(str(dist))
+    status, headers, body = assets.response("/redeem.html", "HEAD")
+    assert status == 200 and body == b""
+    assert header(headers, "Content-Length") == str((dist / "redeem.html").stat().st_size)
+    assert assets.response("/redeem.html", "POST") is None
+    assert assets.response("/missing.js", "GET") is None
+
+
+def test_wsgi_passes_other_paths_to_the_app(frontend):
+    _, dist = build(frontend)
+    started = []
+
+    def app(environ, start_response):
+        start_response("200 OK", [])
+        return [b"app"]
+
+    wsgi = StaticAssetsWSGI(app, StaticAssets(str(dist)))
+    assert wsgi({"PATH_INFO": "/redeem", "REQUEST_METHOD": "POST"},
+                lambda status, headers: started.append(status)) == [b"app"]
+    body = wsgi({"PATH_INFO": "/redeem.html", "REQUEST_METHOD": "GET"},
+                lambda status, headers: started.append(status))
+    assert body == [(dist / "redeem.html").read_bytes()]
+    assert started == ["200 OK", "200 OK"]
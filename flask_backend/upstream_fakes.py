@@ -0,0 +1,185 @@
+import asyncio
+import itertools
+import multiprocessing
+import random
+import socket
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from fake_supabase import FakeSupabaseClient
+
+# HTTP stand-ins for Supabase (PostgREST) and CleanCloud, for load tests and
+# benchmarks that must exercise the real clients and their connection pools.
+# Each answers after latency (plus up to jitter) seconds and fails error_rate
+# of requests. GET /_calls on either returns the number of calls per endpoint.
+#
+#   store = FakeSupabaseClient(); store.upload_codes(codes)
+#   postgrest = serve_in_process(postgrest_app(store, latency=0.02))
+#   os.environ["SUPABASE_URL"] = postgrest.url
+#   cleancloud = serve_in_process(cleancloud_app(latency=0.3))
+#   os.environ["CLEANCLOUD_API_URL"] = cleancloud.url + "/api/"
+
+
+async def _simulate(latency, error_rate, jitter=0.0):
+    """Wait like the upstream would; returns an error response or None"""
+    if latency or jitter:
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+    if error_rate and random.random() < error_rate:
+        return JSONResponse({"message": "Simulated upstream error"}, 503)
+    return None
+
+
+class CallCounter:
+    """ASGI middleware counting requests per "METHOD path", served at GET /_calls"""
+
+    def __init__(self, app):
+        self.app = app
+        self.calls = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            if scope["path"] == "/_calls":
+                return await JSONResponse(self.calls)(scope, receive, send)
+            name = f"{scope['method']} {scope['path']}"
+            self.calls[name] = self.calls.get(name, 0) + 1
+        await self.app(scope, receive, send)
+
+
+def _filter_value(request, column):
+    """Value of a PostgREST "column=gt.value" style filter, as (operator, value)"""
+    raw = request.query_params.get(column)
+    if raw is None:
+        return None, None
+    operator, _, value = raw.partition(".")
+    return operator, value
+
+
+def postgrest_app(store=None, latency=0.0, error_rate=0.0, jitter=0.0):
+    """PostgREST subset backed by a FakeSupabaseClient
+
+    rpc/redeem_gift_code and rpc/redeem_gift_codes, the gift_codes reads the code index makes:
+    select with serial_number=gt.N, order and limit, and exact counts, and
+    the code=eq.X updates that record fulfillment outcomes.
+    """
+    store = store if store is not None else FakeSupabaseClient()
+
+    async def redeem_gift_code(request):
+        error = await _simulate(latency, error_rate, jitter)
+        if error is not None:
+            return error
+        try:
+            params = await request.json()
+        except ClientDisconnect:
+            return Response(status_code=499)
+        return JSONResponse(store.redeem_gift_code(**params))
+
+    async def redeem_gift_codes(request):
+        error = await _simulate(latency, error_rate, jitter)
+        if error is not None:
+            return error
+        try:
+            params = await request.json()
+        except ClientDisconnect:
+            return Response(status_code=499)
+        return JSONResponse(store.redeem_gift_codes(**params))
+
+    async def gift_codes(request):
+        error = await _simulate(latency, error_rate, jitter)
+        if error is not None:
+            return error
+        operator, after_serial = _filter_value(request, "serial_number")
+        after_serial = int(after_serial) if operator == "gt" else 0
+        limit = int(request.query_params.get("limit", "1000"))
+        columns = [c.strip() for c in request.query_params.get("select", "*").split(",")]
+        rows = [store.rows[row["code"]] for row in itertools.islice(store.iter_codes(after_serial), limit)]
+        if columns != ["*"]:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+
+        headers = {}
+        if "count=exact" in request.headers.get("prefer", ""):
+            total = store.count_codes()
+            headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{total}" if rows else f"*/{total}"
+        if request.method == "HEAD":
+            return Response(headers=headers)
+        return JSONResponse(rows, headers=headers)
+
+    async def update_gift_code(request):
+        error = await _simulate(latency, error_rate, jitter)
+        if error is not None:
+            return error
+        operator, code = _filter_value(request, "code")
+        if operator != "eq":
+            return JSONResponse({"message": "only code=eq.X updates are supported"}, status_code=400)
+        values = await request.json()
+        with store._lock:
+            row = store.rows.get(code)
+            if row is not None:
+                row.update(values)
+        return Response(status_code=204)
+
+    app = Starlette(routes=[
+        Route("/rest/v1/rpc/redeem_gift_code", redeem_gift_code, methods=["POST"]),
+        Route("/rest/v1/rpc/redeem_gift_codes", redeem_gift_codes, methods=["POST"]),
+        Route("/rest/v1/gift_codes", gift_codes, methods=["GET", "HEAD"]),
+        Route("/rest/v1/gift_codes", update_gift_code, methods=["PATCH"]),
+    ])
+    app.state.store = store
+    return CallCounter(app)
+
+
+def cleancloud_app(latency=0.0, error_rate=0.0, decline_rate=0.0, jitter=0.0):
+    """CleanCloud giftCardBuy; declines are 200s without "Success", like the real API"""
+    gift_card_ids = itertools.count(1)
+
+    async def gift_card_buy(request):
+        error = await _simulate(latency, error_rate, jitter)
+        if error is not None:
+            return error
+        try:
+            data = await request.json()
+        except ClientDisconnect:
+            return Response(status_code=499)
+        if decline_rate and random.random() < decline_rate:
+            return JSONResponse({"Error": "Card declined", "customerID": data.get("customerID")})
+        return JSONResponse({"Success": "Gift card sent", "giftCardID": next(gift_card_ids),
+                             "customerID": data.get("customerID")})
+
+    app = Starlette(routes=[Route("/api/giftCardBuy", gift_card_buy, methods=["POST"])])
+    return CallCounter(app)
+
+
+def _serve(app, sock):
+    import uvicorn
+
+    uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off")).run(sockets=[sock])
+
+
+class ServerProcess:
+    """uvicorn server for an ASGI app in a forked process, bound to a free local port
+
+    A separate process keeps the fake's event loop from competing with the
+    load generator for the GIL. Any store passed to the app is copied into the child.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        # listening before the fork, so connections queue up while the child starts
+        self.sock.listen(4096)
+        self.url = f"http://{host}:{self.sock.getsockname()[1]}"
+        self.process = multiprocessing.get_context("fork").Process(target=_serve, args=(app, self.sock), daemon=True)
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join(10)
+        self.sock.close()
+
+
+def serve_in_process(app):
+    return ServerProcess(app).start()
@@ -1,33 +1,45 @@
 import csv
 import os
-from supabase_tool import SupabaseClient
+from local_backend import supabase_client_from_env
+from outcome_cache import outcome_cache_from_env
+from bulk_upload import upload_stream
+from log_config import setup_logging
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
-def read_gift_codes(filepath):
-    """Read gift codes from a CSV file with headers"""
-    codes = []
+def iter_gift_codes(filepath):
+    """Yield gift codes from a CSV file with headers, one row at a time"""
     if os.path.exists(filepath):
         with open(filepath, 'r', newline='') as file:
             reader = csv.DictReader(file)
             for row in reader:
                 if 'gift_code' in row and row['gift_code']:
-                    codes.append(row['gift_code'])
-    return codes
+                    yield row['gift_code']
+
+
+def read_gift_codes(filepath):
+    """Read gift codes from a CSV file with headers"""
+    return list(iter_gift_codes(filepath))
 
 
 
 load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
+# Supabase, or the local store selected by GIFT_CODES_BACKEND
+supabase = supabase_client_from_env(outcome_cache=outcome_cache_from_env())
 
 # upload codes from CSV
 if __name__ == "__main__":
-    codes = read_gift_codes("gift_cards.csv")
-    print(f"Found {len(codes)} codes to upload")
+    setup_logging(fmt=os.getenv("LOG_FORMAT", "text"))
+    csv_file = "gift_cards.csv"
     card_value = 5 # specify in dollars $
-    if codes: supabase.upload_codes(codes, card_value=card_value)
+    # rows per insert, and how many inserts run at once
+    batch_size = 1000
+    max_in_flight = 4
+    # progress is saved here; rerun after a crash to resume, deleted when the upload completes
+    checkpoint_path = "gift_cards.csv.checkpoint"
+    upload_stream(supabase, iter_gift_codes(csv_file), source=os.path.abspath(csv_file),
+                  batch_size=batch_size, max_in_flight=max_in_flight,
+                  checkpoint_path=checkpoint_path, card_value=card_value)
 
     # set expiry of serial 1 to 5 to december 31, 2025
     # expiry_datetime = datetime(2024, 12, 31, tzinfo=timezone.utc)
@@ -7,6 +7,8 @@ class GiftCodeRedeemer {
     this.confirmPhoneInput = document.getElementById("confirmPhone");
     this.redeemBtn = document.getElementById("redeemBtn");
     this.resultEl = document.getElementById("result");
+    // Idempotency key of a submission that got no answer yet, reused if the same details are sent again
+    this.pendingRedemption = null;
 
     // Initially disable confirmation fields
     this.confirmEmailInput.disabled = true;
@@ -157,8 +159,40 @@ class GiftCodeRedeemer {
     console.log("Result element updated:", this.resultEl.textContent);
   }
 
+  // Codes generated with a check character are 17 characters long: the last one is a
+  // Luhn mod 36 check over the first 16 (same as check_character in generate_codes.py)
+  hasValidCheckCharacter(code) {
+    const chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789";
+    let factor = 2;
+    let total = 0;
+    for (let i = code.length - 2; i >= 0; i--) {
+      const value = chars.indexOf(code[i]);
+      if (value < 0) {
+        return false;
+      }
+      const addend = factor * value;
+      factor = factor === 2 ? 1 : 2;
+      total += Math.floor(addend / 36) + (addend % 36);
+    }
+    return code[code.length - 1] === chars[(36 - (total % 36)) % 36];
+  }
+
+  // A retry of the same code and recipient (e.g. after a network error) carries the same key,
+  // so the server replays the first answer instead of reporting the code as already redeemed
+  idempotencyKeyFor(requestData) {
+    const fingerprint = JSON.stringify([requestData.code, requestData.recipient_email, requestData.recipient_phone]);
+    if (!this.pendingRedemption || this.pendingRedemption.fingerprint !== fingerprint) {
+      const key = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + Math.random().toString(36).slice(2);
+      this.pendingRedemption = { fingerprint, key };
+    }
+    return this.pendingRedemption.key;
+  }
+
   async redeemCode() {
-    const code = this.codeInput.value.trim();
+    // same normalization as filterCodeInput, in case the field was filled without typing
+    const code = this.codeInput.value.replace(/[\s-]/g, "").toUpperCase();
     const email = this.emailInput.value.trim();
     const confirmEmail = this.confirmEmailInput.value.trim();
     const phone = this.phoneInput.value.trim();
@@ -184,6 +218,12 @@ class GiftCodeRedeemer {
       return;
     }
 
+    // Catch typos before they reach the server: codes longer than 16 characters end in a check character
+    if (code.length > 16 && !this.hasValidCheckCharacter(code)) {
+      this.displayResult("⚠️ This code looks mistyped. Please check it and try again.", "orange");
+      return;
+    }
+
     // Basic email validation
     const emailRegex = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
     if (!emailRegex.test(email)) {
@@ -213,7 +253,8 @@ class GiftCodeRedeemer {
       const response = await fetch(API_URL, {
         method: "POST",
         headers: {
-          "Content-Type": "application/json"
+          "Content-Type": "application/json",
+          "Idempotency-Key": this.idempotencyKeyFor(requestData)
         },
         body: JSON.stringify(requestData)
       });
@@ -224,6 +265,13 @@ class GiftCodeRedeemer {
       const result = await response.json();
       console.log("Response data:", result);
 
+      // Only a final answer ends the attempt. Server errors, rate limits and "still being processed"
+      // keep the key, so the retry is answered for this same attempt instead of "already redeemed"
+      const retryable = response.status >= 500 || result.reason === "in_progress" || result.reason === "rate_limited";
+      if (!retryable) {
+        this.pendingRedemption = null;
+      }
+
       if (response.ok && result.success) {
         this.displayResult("✅ " + result.message, "green");
         // Clear the code field on successful redemption